@@ -1,28 +1,52 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 from dotenv import load_dotenv
 import random
 import json
-import csv
-from io import BytesIO, StringIO
 import requests
-from openpyxl import load_workbook
 import base64
+import io
 import mimetypes
 import re
-
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+import socket
+import sqlite3
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 from krishimitra_knowledge import KRISHIMITRA_KNOWLEDGE
+from sensor_parser import BATCH_MAX_FILES, SENSOR_EXTS, parse_many, parse_sensor_file, unpack_reports
+from timeseries import (
+    DROUGHT_MM, FARM_ID, MAX_BATCH, RESOLUTIONS, SEASON_MONTHS, SEASON_YEARS, metric_name, parse_readings,
+    parse_timestamp, rainfall_status, rainfall_windows, rollup_batch, season_bounds, season_of,
+)
+from geocoding import Geocoder, GeocoderBusy
+from forecast import ForecastService, trim_hourly
+from hedging import CircuitBreaker, HedgedCaller, Provider
+from knowledge_index import knowledge
+from chat_cache import ChatResponseCache
+from chat_context import (
+    CHAT_CONTEXT_CACHE, CHAT_CONTEXT_TTL, CHAT_HISTORY_TOKENS, TokenLedger, estimate_tokens, make_context_cache,
+    trim_history,
+)
+import image_prep
+import lazy_imports
+from http_client import client as upstream, public_url_error
+from db_profile import apply_sqlite_pragmas, database_url, engine_options, is_sqlite
+from result_cache import ResultCache, make_key, file_sha256, normalize_text
+from blob_store import BlobStore
+from storage import CappedStream, TooLarge, make_storage
+from work_queue import PRIORITIES, PriorityPool, QueueFull
 
 app = Flask(__name__)
 CORS(app)
@@ -30,19 +54,70 @@ load_dotenv()
 
 # Configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///krishimitra.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url(os.getenv('DATABASE_URL', 'sqlite:///krishimitra.db'))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['CACHE_FOLDER'] = os.getenv('CACHE_FOLDER', 'cache')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-change-this')
 
 # Initialize extensions
 db = SQLAlchemy(app)
+
+if is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+    @db.event.listens_for(Engine, 'connect')
+    def _sqlite_on_connect(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_sqlite_pragmas(dbapi_connection)
 bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
 
 # Create upload folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Upload bytes live in STORAGE_BACKEND (local folder, or an S3-compatible bucket shared by every node),
+# once per distinct content; blobs no row refers to are removed after the retention period
+upload_storage = make_storage(app.config['UPLOAD_FOLDER'])
+blobs = BlobStore(upload_storage)
+BLOB_RETENTION = float(os.getenv('BLOB_RETENTION_DAYS', 7)) * 24 * 3600
+BLOB_SWEEP_INTERVAL = int(os.getenv('BLOB_SWEEP_INTERVAL', 6 * 3600))  # seconds; 0 turns the sweeper off
+
+# Repeat uploads of the same photo (flaky connections) are served from here instead of calling the model again
+crop_cache = ResultCache(
+    os.path.join(app.config['CACHE_FOLDER'], 'results.sqlite3'),
+    table='crop_analysis',
+    ttl=int(os.getenv('CROP_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.getenv('CROP_CACHE_MAX_ENTRIES', 5000)),
+)
+# Parsed PDF statement pages, keyed by page content hash (banks reuse page templates and farmers re-upload)
+pdf_page_cache = ResultCache(
+    os.path.join(app.config['CACHE_FOLDER'], 'results.sqlite3'),
+    table='pdf_pages',
+    ttl=int(os.getenv('PDF_PAGE_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.getenv('PDF_PAGE_CACHE_MAX_ENTRIES', 20000)),
+)
+# First-turn chat questions repeat across thousands of farmers; replies are reused until the knowledge changes
+chat_responses = ChatResponseCache(
+    ResultCache(
+        os.path.join(app.config['CACHE_FOLDER'], 'results.sqlite3'),
+        table='chat_responses',
+        ttl=int(os.getenv('CHAT_CACHE_TTL', 24 * 3600)),
+        max_entries=int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 5000)),
+    ),
+    KRISHIMITRA_KNOWLEDGE,
+    similarity=float(os.getenv('CHAT_CACHE_SIMILARITY', 0.8)),
+)
+# Farmers come from a few thousand villages, so the same addresses repeat constantly
+geocoder = Geocoder(
+    ResultCache(os.path.join(app.config['CACHE_FOLDER'], 'results.sqlite3'), table='geocode', max_entries=100000),
+    min_interval=float(os.getenv('NOMINATIM_MIN_INTERVAL', 1.0)),
+    max_wait=float(os.getenv('NOMINATIM_MAX_WAIT', 3.0)),
+)
+# Nearby farms share one forecast per grid cell, refreshed when Open-Meteo publishes its hourly run
+forecasts = ForecastService(
+    grid_step=float(os.getenv('WEATHER_GRID_STEP', 0.1)),
+    max_cells=int(os.getenv('WEATHER_CACHE_MAX_CELLS', 10000)),
+)
 
 # Models
 class User(db.Model):
@@ -58,6 +133,14 @@ class User(db.Model):
         return f'<User {self.username}>'
 
 class UploadedFile(db.Model):
+    # A user's files newest first (the /api/files listing); id breaks ties between equal timestamps.
+    # result_key finds an earlier run over identical content so /api/process can reuse it.
+    __table_args__ = (
+        db.Index('ix_uploaded_file_user_uploaded', 'user_id', 'uploaded_at', 'id'),
+        db.Index('ix_uploaded_file_result_key', 'result_key', 'status'),
+        db.Index('ix_uploaded_file_path', 'file_path'),  # blob reference counts
+        db.Index('ix_uploaded_file_status_lease', 'status', 'lease_until'),  # unfinished work to reclaim
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
@@ -66,10 +149,26 @@ class UploadedFile(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed = db.Column(db.Boolean, default=False)
     ai_response = db.Column(db.Text, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the file
+    # Processing pipeline (/api/process); ai_response holds the JSON result, updated after every stage
+    status = db.Column(db.String(16), nullable=True, default='uploaded')  # uploaded, queued, processing, done, failed
+    kind = db.Column(db.String(16), nullable=True)  # sensor, statement, image
+    stage = db.Column(db.String(32), nullable=True)
+    params = db.Column(db.Text, nullable=True)
+    result_key = db.Column(db.String(64), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    lease_owner = db.Column(db.String(80), nullable=True)  # process holding a queued/processing file
+    lease_until = db.Column(db.DateTime, nullable=True)
     
     user = db.relationship('User', backref=db.backref('files', lazy=True))
 
 class SensorReport(db.Model):
+    __table_args__ = (
+        db.Index('ix_sensor_report_user_created', 'user_id', 'created_at'),
+        db.Index('ix_sensor_report_path', 'file_path'),  # blob reference counts
+        db.Index('ix_sensor_report_farm_hash', 'farm_id', 'content_hash'),  # one ingestion per report and farm
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
@@ -81,9 +180,12 @@ class SensorReport(db.Model):
     lat = db.Column(db.Float, nullable=True)
     lon = db.Column(db.Float, nullable=True)
     ai_summary = db.Column(db.Text, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the file
+    farm_id = db.Column(db.String(64), nullable=True)  # readings went into this farm's time series
 
 class SupportFeedback(db.Model):
     """User feedback, complaints, or ratings from the chatbot."""
+    __table_args__ = (db.Index('ix_support_feedback_type_created', 'type', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(20), nullable=False)  # 'feedback', 'complaint', 'rating'
     content = db.Column(db.Text, nullable=True)
@@ -92,6 +194,88 @@ class SupportFeedback(db.Model):
     email = db.Column(db.String(120), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class SensorSample(db.Model):
+    """One reading of one metric for a farm/field. Range scans go through (farm_id, metric, ts), which is
+    also unique: a reading sent again (retried IoT batch) is stored, and counted, once."""
+    __table_args__ = (db.Index('uq_sensor_sample_farm_metric_ts', 'farm_id', 'metric', 'ts', unique=True),)
+    id = db.Column(db.Integer, primary_key=True)
+    farm_id = db.Column(db.String(64), nullable=False)
+    metric = db.Column(db.String(32), nullable=False)
+    ts = db.Column(db.DateTime, nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    report_id = db.Column(db.Integer, db.ForeignKey('sensor_report.id'), nullable=True)
+
+class SensorRollup(db.Model):
+    """Hourly / daily count, sum, min, max per farm and metric; updated in place as samples arrive."""
+    __table_args__ = (db.UniqueConstraint('farm_id', 'metric', 'resolution', 'bucket', name='uq_sensor_rollup_bucket'),)
+    id = db.Column(db.Integer, primary_key=True)
+    farm_id = db.Column(db.String(64), nullable=False)
+    metric = db.Column(db.String(32), nullable=False)
+    resolution = db.Column(db.String(8), nullable=False)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    min_value = db.Column(db.Float, nullable=True)
+    max_value = db.Column(db.Float, nullable=True)
+
+class RainfallWindow(db.Model):
+    """Running rainfall total per farm and cropping season, so insurance checks never rescan readings."""
+    __table_args__ = (
+        db.UniqueConstraint('farm_id', 'season', 'season_year', name='uq_rainfall_window'),
+        db.Index('ix_rainfall_window_season_total', 'season', 'season_year', 'total_mm'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    farm_id = db.Column(db.String(64), nullable=False)
+    season = db.Column(db.String(8), nullable=False)  # kharif, rabi, zaid
+    season_year = db.Column(db.Integer, nullable=False)
+    total_mm = db.Column(db.Float, nullable=False, default=0.0)
+    readings = db.Column(db.Integer, nullable=False, default=0)
+    first_ts = db.Column(db.DateTime, nullable=True)
+    last_ts = db.Column(db.DateTime, nullable=True)
+
+class AnalysisJob(db.Model):
+    """Queued AI image analysis (crop-analysis / stage-verify); result is stored as JSON once done."""
+    # Queue depth checks and restart recovery filter on status
+    __table_args__ = (db.Index('ix_analysis_job_status_created', 'status', 'created_at'),)
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed
+    file_path = db.Column(db.String(500), nullable=False)
+    params = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    callback_url = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    lease_owner = db.Column(db.String(80), nullable=True)  # process holding a queued/running job
+    lease_until = db.Column(db.DateTime, nullable=True)
+
+# Model calls take up to a minute each; they run here so web workers return immediately. They spend that
+# minute waiting on the provider, so the pool is as wide as http_client lets a provider API be (per-host
+# caps) rather than a fixed few threads; under gevent the threads are greenlets.
+AI_PROVIDER_HOSTS = {'gemini': 'generativelanguage.googleapis.com', 'openai': 'api.openai.com'}
+analysis_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ANALYSIS_WORKERS', max(upstream.limit_for(h) for h in AI_PROVIDER_HOSTS.values()))),
+    thread_name_prefix='analysis',
+)
+ANALYSIS_MAX_QUEUED = int(os.getenv('ANALYSIS_MAX_QUEUED', 500))
+# Job webhooks (callbackUrl) go only to these hosts when set; otherwise to any host with public addresses
+CALLBACK_ALLOWED_HOSTS = frozenset(h.strip().lower() for h in os.getenv('CALLBACK_ALLOWED_HOSTS', '').split(',') if h.strip())
+# Uploaded files sent to /api/process are parsed and analysed here; throughput follows PIPELINE_WORKERS
+file_pipeline = PriorityPool(
+    workers=int(os.getenv('PIPELINE_WORKERS', 4)),
+    max_queued=int(os.getenv('PIPELINE_MAX_QUEUED', 1000)),
+    name='pipeline',
+)
+# Queued and running work is leased by the process whose pool holds it. A heartbeat renews the lease
+# every WORK_LEASE_SECONDS / 3; work whose lease ran out (worker recycled by max_requests, killed or
+# crashed) is claimed again by whichever process looks next, so it never stays queued forever.
+WORK_LEASE = int(os.getenv('WORK_LEASE_SECONDS', 300))
+JOB_ACTIVE = ('queued', 'running')
+FILE_ACTIVE = ('queued', 'processing')
+_lease = {}
+
 # Ensure all errors return JSON
 @app.errorhandler(404)
 def not_found(e):
@@ -106,6 +290,42 @@ def server_error(e):
 def home():
     return jsonify({'message': 'Krishimitra Backend API'})
 
+@app.route('/healthz/live', methods=['GET'])
+def healthz_live():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/healthz/ready', methods=['GET'])
+def healthz_ready():
+    """Readiness: start-up finished, the database answers and uploads can be written."""
+    checks = {'startup': 'ok' if _started else 'starting'}
+    try:
+        db.session.execute(db.text('SELECT 1'))
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = str(e)[:200]
+    checks['uploads'] = 'ok' if os.access(app.config['UPLOAD_FOLDER'], os.W_OK) else 'not writable'
+    ready = all(v == 'ok' for v in checks.values())
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'cropAnalysisCache': crop_cache.stats(),
+        'pdfPageCache': pdf_page_cache.stats(),
+        'geocodeCache': geocoder.stats(),
+        'weatherCache': forecasts.stats(),
+        'imageProviders': image_providers.stats(),
+        'upstream': upstream.stats(),
+        'lazyImports': lazy_imports.stats(),
+        'uploadStore': blobs.stats(),
+        'filePipeline': dict(file_pipeline.stats(), **_pipeline_counts),
+        'chatFaq': knowledge.stats(),
+        'chatResponses': chat_responses.stats(),
+        'chatTokens': chat_tokens.stats(),
+        'chatContextCache': chat_context_cache.stats() if chat_context_cache else None,
+    }), 200
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json() or {}
@@ -164,66 +384,167 @@ def login():
         }
     }), 200
 
-def _mime_for_ext(ext):
-    m = mimetypes.types_map.get(ext.lower()) if ext else None
-    if not m:
-        return 'application/octet-stream'
-    return m
+def _blob_refcounts(paths):
+    """{path: rows referring to it} from uploaded files, sensor reports and unfinished analysis jobs."""
+    counts = {}
+    sources = (
+        (UploadedFile.file_path, ()),
+        (SensorReport.file_path, ()),
+        (AnalysisJob.file_path, (AnalysisJob.status.in_(JOB_ACTIVE),)),
+    )
+    with app.app_context():
+        for column, conditions in sources:
+            rows = db.session.execute(
+                db.select(column, db.func.count()).where(column.in_(paths), *conditions).group_by(column)
+            ).all()
+            for path, n in rows:
+                counts[path] = counts.get(path, 0) + n
+    return counts
+
+def sweep_uploads():
+    """Remove unreferenced blobs older than BLOB_RETENTION_DAYS, with their derived image copies, and
+    chunked uploads that were never completed."""
+    result = blobs.sweep(_blob_refcounts, BLOB_RETENTION, companions=lambda path: [image_prep.derived_path(path)])
+    cutoff = time.time() - BLOB_RETENTION
+    uploads = {}  # upload id -> (part keys, newest part time)
+    for key, _, mtime in upload_storage.list('partial/'):
+        keys, newest = uploads.get(key.split('/')[1], ([], 0))
+        uploads[key.split('/')[1]] = (keys + [key], max(newest, mtime))
+    abandoned = [keys for keys, newest in uploads.values() if newest < cutoff]
+    for keys in abandoned:
+        for key in keys:
+            upload_storage.delete(key)
+    result['abandonedUploads'] = len(abandoned)
+    return result
+
+def _sweep_loop():
+    while True:
+        time.sleep(BLOB_SWEEP_INTERVAL)
+        try:
+            sweep_uploads()
+        except Exception as e:
+            app.logger.warning('Upload sweep failed: %s', e)
+
+_sweeper = []
+_sweeper_lock = threading.Lock()
+
+def _store_upload(storage, ext=None):
+    """Save an uploaded file into the blob store. Returns (path, sha256). The sweeper thread starts with
+    the first upload, in the serving process (never in a preforking master)."""
+    if BLOB_SWEEP_INTERVAL > 0 and not _sweeper:
+        with _sweeper_lock:
+            if not _sweeper:
+                _sweeper.append(threading.Thread(target=_sweep_loop, name='upload-sweeper', daemon=True))
+                _sweeper[0].start()
+    path, digest, _ = blobs.save_file(storage, ext)
+    return path, digest
+
+def _gemini_key():
+    return (os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip()
+
+# The knowledge base is identical on every turn: upload it once as cached content instead of resending it
+chat_context_cache = make_context_cache(CHAT_CONTEXT_CACHE, _gemini_key, CHAT_CONTEXT_TTL)
+chat_tokens = TokenLedger()
+
+def _gemini_chat_request(message, history, method, use_cache=True):
+    """(url, body, estimated prompt tokens) for a chat turn with the Krishimitra knowledge and conversation
+    history (trimmed to CHAT_HISTORY_TOKENS). method is 'generateContent' or 'streamGenerateContent'."""
+    key = _gemini_key()
+    # Build multi-turn contents: alternate user / model from history, then new user message
+    contents = []
+    for msg in trim_history(history, CHAT_HISTORY_TOKENS):
+        gemini_role = 'model' if msg['role'] == 'assistant' else 'user'
+        contents.append({'role': gemini_role, 'parts': [{'text': msg['content']}]})
+    contents.append({'role': 'user', 'parts': [{'text': message}]})
+    estimate = sum(estimate_tokens(c['parts'][0]['text']) for c in contents)
+
+    model = (os.getenv('GEMINI_MODEL') or 'gemini-pro').strip() or 'gemini-pro'
+    use_v1 = model == 'gemini-pro'
+    # v1 gemini-pro has no systemInstruction; prepend context as first user message
+    if use_v1:
+        preamble = 'Use ONLY the following context to answer. Do not make up info.\n\n' + KRISHIMITRA_KNOWLEDGE + '\n\n---\nConversation:'
+        contents = [{'role': 'user', 'parts': [{'text': preamble}]}] + contents
+        body = {'contents': contents, 'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 1024}}
+        estimate += estimate_tokens(preamble)
+    else:
+        body = {'contents': contents, 'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 1024}}
+        cached = chat_context_cache.get(model, KRISHIMITRA_KNOWLEDGE) if (use_cache and chat_context_cache) else None
+        if cached and chat_context_cache.provider_side:
+            body['cachedContent'] = cached
+        else:
+            body['systemInstruction'] = {'parts': [{'text': KRISHIMITRA_KNOWLEDGE}]}
+            estimate += estimate_tokens(KRISHIMITRA_KNOWLEDGE)
+    api_ver = 'v1' if use_v1 else 'v1beta'
+    url = f'https://generativelanguage.googleapis.com/{api_ver}/models/{model}:{method}?key={key}'
+    if method == 'streamGenerateContent':
+        url += '&alt=sse'
+    return url, body, estimate
+
+def _post_chat(message, history, method, **kwargs):
+    """POST a chat request; if Gemini rejects our cached content (expired or evicted early), drop it and
+    resend once with the knowledge inline. Returns (response, estimated prompt tokens)."""
+    url, body, estimate = _gemini_chat_request(message, history, method)
+    r = upstream.post(url, headers={'Content-Type': 'application/json'}, json=body, **kwargs)
+    if r.status_code != 200 and 'cachedContent' in body:
+        r.close()
+        model = (os.getenv('GEMINI_MODEL') or 'gemini-pro').strip() or 'gemini-pro'
+        chat_context_cache.invalidate(model, KRISHIMITRA_KNOWLEDGE)
+        url, body, estimate = _gemini_chat_request(message, history, method, use_cache=False)
+        r = upstream.post(url, headers={'Content-Type': 'application/json'}, json=body, **kwargs)
+    return r, estimate
 
 def _chat_with_gemini_rest(message, history=None):
-    """Customer care chat using Gemini with full Krishimitra knowledge and conversation history. Returns (reply_text, error_message)."""
-    key = (os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip()
+    """Customer care chat using Gemini with full Krishimitra knowledge and conversation history.
+    Returns (reply_text, error_message, usage)."""
+    key = _gemini_key()
     if not key:
-        return None, 'No GEMINI_API_KEY or GOOGLE_API_KEY set.'
-    history = history or []
+        return None, 'No GEMINI_API_KEY or GOOGLE_API_KEY set.', None
     try:
-        # Build multi-turn contents: alternate user / model from history, then new user message
-        contents = []
-        for msg in history:
-            role = (msg.get('role') or '').strip().lower()
-            content = (msg.get('content') or '').strip()
-            if not content:
-                continue
-            gemini_role = 'model' if role == 'assistant' else 'user'
-            contents.append({'role': gemini_role, 'parts': [{'text': content}]})
-        contents.append({'role': 'user', 'parts': [{'text': message}]})
-
-        model = (os.getenv('GEMINI_MODEL') or 'gemini-pro').strip() or 'gemini-pro'
-        use_v1 = model == 'gemini-pro'
-        # v1 gemini-pro has no systemInstruction; prepend context as first user message
-        if use_v1:
-            preamble = 'Use ONLY the following context to answer. Do not make up info.\n\n' + KRISHIMITRA_KNOWLEDGE + '\n\n---\nConversation:'
-            contents = [{'role': 'user', 'parts': [{'text': preamble}]}] + contents
-            body = {'contents': contents, 'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 1024}}
-        else:
-            body = {
-                'systemInstruction': {'parts': [{'text': KRISHIMITRA_KNOWLEDGE}]},
-                'contents': contents,
-                'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 1024},
-            }
-        api_ver = 'v1' if use_v1 else 'v1beta'
-        url = f'https://generativelanguage.googleapis.com/{api_ver}/models/{model}:generateContent'
-        r = requests.post(f'{url}?key={key}', headers={'Content-Type': 'application/json'}, json=body, timeout=45)
+        r, estimate = _post_chat(message, history, 'generateContent', timeout=45)
         j = r.json() if r.text else {}
         if r.status_code != 200:
             err = j.get('error', {})
             msg = err.get('message', r.text or f'HTTP {r.status_code}')
-            return None, (msg[:300] if isinstance(msg, str) else str(msg)[:300])
+            return None, (msg[:300] if isinstance(msg, str) else str(msg)[:300]), None
+        usage = chat_tokens.record(j.get('usageMetadata'), estimate)
         parts = j.get('candidates', [{}])
         if not parts:
-            return None, (j.get('error', {}).get('message') or 'No response from model')[:300]
+            return None, (j.get('error', {}).get('message') or 'No response from model')[:300], usage
         content = parts[0].get('content', {}).get('parts', [])
         if not content:
-            return None, 'Empty response from model'
+            return None, 'Empty response from model', usage
         text = (content[0].get('text') or '').strip()
-        return text or None, None
+        return text or None, None, usage
     except requests.exceptions.RequestException as e:
-        return None, str(e)[:200]
+        return None, str(e)[:200], None
     except Exception as e:
-        return None, str(e)[:200]
+        return None, str(e)[:200], None
+
+def _stream_chat_with_gemini(message, history=None, usage_out=None):
+    """Yield reply text chunks as Gemini generates them (streamGenerateContent over SSE).
+    Raises on connection/HTTP errors so the caller can fall back. Token usage is written to usage_out."""
+    # Short connect timeout; the read timeout applies between chunks, not to the whole reply
+    r, estimate = _post_chat(message, history, 'streamGenerateContent', stream=True, timeout=(5, 30))
+    usage = None
+    with r:
+        if r.status_code != 200:
+            raise RuntimeError(f'HTTP {r.status_code}')
+        r.encoding = 'utf-8'
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = json.loads(line[5:].strip() or '{}')
+            usage = chunk.get('usageMetadata') or usage
+            for cand in chunk.get('candidates') or []:
+                for part in (cand.get('content') or {}).get('parts') or []:
+                    if part.get('text'):
+                        yield part['text']
+    recorded = chat_tokens.record(usage, estimate)
+    if usage_out is not None:
+        usage_out.update(recorded)
 
 
-def _analyze_with_gemini(path, prompt, crop=None):
+def _analyze_with_gemini(path, prompt, crop=None, mime=None):
     """Use Gemini API for crop image analysis. Returns dict with summary, qualityScore, etc."""
     key = (os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip()
     if not key:
@@ -231,8 +552,7 @@ def _analyze_with_gemini(path, prompt, crop=None):
     try:
         with open(path, 'rb') as f:
             b64 = base64.b64encode(f.read()).decode('ascii')
-        ext = os.path.splitext(path)[1].lower()
-        mime = 'image/jpeg' if ext in ('.jpg', '.jpeg') else ('image/png' if ext == '.png' else 'image/webp')
+        mime = mime or image_prep.detect_mime(path)
         disease_map = {
             'wheat': ['rust (stripe, leaf, stem)', 'powdery mildew', 'leaf blight', 'aphids'],
             'rice': ['rice blast', 'bacterial leaf blight', 'sheath blight', 'brown planthopper'],
@@ -267,7 +587,7 @@ def _analyze_with_gemini(path, prompt, crop=None):
         model = (os.getenv('GEMINI_MODEL') or 'gemini-pro').strip() or 'gemini-pro'
         api_ver = 'v1' if model == 'gemini-pro' else 'v1beta'
         url = f'https://generativelanguage.googleapis.com/{api_ver}/models/{model}:generateContent?key={key}'
-        r = requests.post(url, headers={'Content-Type': 'application/json'}, json=body, timeout=60)
+        r = upstream.post(url, headers={'Content-Type': 'application/json'}, json=body, timeout=60)
         j = r.json()
         if r.status_code != 200:
             return None
@@ -285,15 +605,14 @@ def _analyze_with_gemini(path, prompt, crop=None):
     except Exception:
         return None
 
-def _analyze_with_openai(path, prompt, crop=None):
+def _analyze_with_openai(path, prompt, crop=None, mime=None):
     key = os.getenv('OPENAI_API_KEY')
     if not key:
         return None
     try:
         with open(path, 'rb') as f:
             b64 = base64.b64encode(f.read()).decode('ascii')
-        ext = os.path.splitext(path)[1]
-        mime = _mime_for_ext(ext)
+        mime = mime or image_prep.detect_mime(path)
         data_uri = f"data:{mime};base64,{b64}"
         disease_map = {
             'wheat': ['rust (stripe, leaf, stem)', 'powdery mildew', 'leaf blight', 'aphids'],
@@ -327,7 +646,7 @@ def _analyze_with_openai(path, prompt, crop=None):
             ],
             'response_format': {'type': 'json_object'},
         }
-        r = requests.post('https://api.openai.com/v1/chat/completions', headers={
+        r = upstream.post('https://api.openai.com/v1/chat/completions', headers={
             'Authorization': f'Bearer {key}',
             'Content-Type': 'application/json',
         }, json=body, timeout=60)
@@ -343,28 +662,49 @@ def _analyze_with_openai(path, prompt, crop=None):
     except Exception:
         return None
 
-@app.route('/api/crop-analysis', methods=['POST'])
-def crop_analysis():
-    if 'image' not in request.files:
-        return jsonify({'error': 'No image provided'}), 400
-    image = request.files['image']
-    if image.filename == '':
-        return jsonify({'error': 'No image selected'}), 400
-    ext = os.path.splitext(image.filename)[1]
-    unique = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
-    image.save(path)
-    data = request.form.to_dict() if request.form else {}
-    prompt = data.get('prompt')
-    crop = data.get('crop')
-    ai = _analyze_with_gemini(path, prompt, crop)
-    if not ai or not isinstance(ai, dict):
-        ai = _analyze_with_openai(path, prompt, crop)
+def _image_provider(name, fn, enabled):
+    breaker = CircuitBreaker(
+        failure_threshold=int(os.getenv('AI_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.getenv('AI_BREAKER_RESET_SECONDS', 30)),
+    )
+    return Provider(name, fn, enabled=enabled, breaker=breaker)
+
+_providers = {
+    'gemini': _image_provider('gemini', _analyze_with_gemini,
+                              lambda: bool((os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip())),
+    'openai': _image_provider('openai', _analyze_with_openai, lambda: bool(os.getenv('OPENAI_API_KEY'))),
+}
+_primary = (os.getenv('AI_PRIMARY_PROVIDER') or 'gemini').strip().lower()
+# The secondary provider starts once the primary is slower than its usual p95, or as soon as it fails
+image_providers = HedgedCaller(
+    sorted(_providers.values(), key=lambda p: p.name != _primary),
+    is_valid=lambda result: isinstance(result, dict) and bool(result),
+    hedge_quantile=float(os.getenv('AI_HEDGE_QUANTILE', 0.95)),
+    default_delay=float(os.getenv('AI_HEDGE_DEFAULT_DELAY', 8)),
+    timeout=60,
+    max_workers=sum(upstream.limit_for(h) for h in AI_PROVIDER_HOSTS.values()),  # a hedged call can hold one of each
+)
+
+def _analyze_image(path, prompt, crop=None):
+    """Gemini and OpenAI raced with hedging (see hedging.py). Results are cached by image SHA-256 + crop + prompt."""
+    key = make_key('crop-analysis', blobs.digest_of(path) or file_sha256(path), normalize_text(crop), normalize_text(prompt))
+    ai = crop_cache.get(key)
+    if isinstance(ai, dict):
+        return ai
+    img = image_prep.prepare(path)
+    ai = image_providers.call(img['path'], prompt, crop, img['mime'])
+    if ai and isinstance(ai, dict):
+        crop_cache.set(key, ai)
+        return ai
+    return None
+
+def _crop_analysis_result(path, prompt=None, crop=None):
+    ai = _analyze_image(path, prompt, crop)
     if ai and isinstance(ai, dict):
         quality_score = ai.get('qualityScore')
         if quality_score is None:
             quality_score = 7
-        return jsonify({
+        return {
             'summary': ai.get('summary') or 'Analysis available',
             'details': ai.get('details') or '',
             'confidence': ai.get('confidence') or 'Medium',
@@ -372,8 +712,8 @@ def crop_analysis():
             'issues': ai.get('issues') or [],
             'observations': ai.get('observations') or [],
             'recommendations': ai.get('recommendations') or [],
-        }), 200
-    return jsonify({
+        }
+    return {
         'summary': 'Likely healthy',
         'details': 'Leaves appear normal. No obvious signs of damage or disease detected.',
         'confidence': 'Medium',
@@ -381,30 +721,32 @@ def crop_analysis():
         'issues': [],
         'observations': [],
         'recommendations': [],
-    }), 200
+    }
 
-@app.route('/api/stage-verify', methods=['POST'])
-def stage_verify():
+@app.route('/api/crop-analysis', methods=['POST'])
+def crop_analysis():
     if 'image' not in request.files:
         return jsonify({'error': 'No image provided'}), 400
     image = request.files['image']
     if image.filename == '':
         return jsonify({'error': 'No image selected'}), 400
-    stage = (request.form.get('stage') or '').strip()
-    crop = (request.form.get('crop') or '').strip()
-    ext = os.path.splitext(image.filename)[1]
-    unique = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
-    image.save(path)
+    path, _ = _store_upload(image)
+    image_prep.prepare_async(path)
+    data = request.form.to_dict() if request.form else {}
+    prompt = data.get('prompt')
+    crop = data.get('crop')
+    if _wants_async():
+        return _submit_job('crop-analysis', path, {'prompt': prompt, 'crop': crop})
+    return jsonify(_crop_analysis_result(path, prompt, crop)), 200
+
+def _stage_verify_result(path, stage, crop=None):
     prompts = {
         '1': 'Verify this is seeds/sowing stage (seed packets, seeds in soil, early seedlings).',
         '2': 'Verify this is growth stage (green crops, leaves, stems, field with growing plants).',
         '3': 'Verify this is harvest stage (harvested crop, grain, bundles, transport).',
     }
     pfx = prompts.get(stage, 'Assess crop stage (seed, growth, harvest).')
-    ai = _analyze_with_gemini(path, pfx, crop)
-    if not ai or not isinstance(ai, dict):
-        ai = _analyze_with_openai(path, pfx, crop)
+    ai = _analyze_image(path, pfx, crop)
     awarded = 0
     reason = 'No points'
     if ai and isinstance(ai, dict):
@@ -429,7 +771,7 @@ def stage_verify():
         else:
             awarded = 5
             reason = 'Stage unclear, partial points'
-        return jsonify({
+        return {
             'stage': stage,
             'awardedPoints': awarded,
             'reason': reason,
@@ -441,8 +783,8 @@ def stage_verify():
                 'observations': ai.get('observations'),
                 'recommendations': ai.get('recommendations'),
             }
-        }), 200
-    return jsonify({
+        }
+    return {
         'stage': stage,
         'awardedPoints': 10,
         'reason': 'Demo award',
@@ -454,120 +796,215 @@ def stage_verify():
             'observations': [],
             'recommendations': [],
         }
-    }), 200
+    }
 
-def _count_small_transactions_csv(path, threshold=500.0):
-    count = 0
-    total = 0.0
-    lines = 0
-    try:
-        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                amount = row.get('amount') or row.get('Amount') or row.get('AMOUNT')
-                if amount is None:
-                    continue
-                try:
-                    val = float(str(amount).replace(',', '').strip())
-                except Exception:
-                    continue
-                total += abs(val)
-                lines += 1
-                if abs(val) <= threshold:
-                    count += 1
-    except Exception:
-        pass
-    return count, total, lines
+@app.route('/api/stage-verify', methods=['POST'])
+def stage_verify():
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image provided'}), 400
+    image = request.files['image']
+    if image.filename == '':
+        return jsonify({'error': 'No image selected'}), 400
+    stage = (request.form.get('stage') or '').strip()
+    crop = (request.form.get('crop') or '').strip()
+    path, _ = _store_upload(image)
+    image_prep.prepare_async(path)
+    if _wants_async():
+        return _submit_job('stage-verify', path, {'stage': stage, 'crop': crop})
+    return jsonify(_stage_verify_result(path, stage, crop)), 200
 
-def _count_small_transactions_xlsx(path, threshold=500.0):
-    count = 0
-    total = 0.0
-    lines = 0
-    try:
-        wb = load_workbook(path, data_only=True)
-        ws = wb.active
-        headers = []
-        for i, row in enumerate(ws.iter_rows(values_only=True)):
-            if i == 0:
-                headers = [str(h).lower() if h is not None else '' for h in row]
-                continue
-            # find amount-like column
-            idx = None
-            for j, h in enumerate(headers):
-                if 'amount' in h or 'amt' in h or h in ('debit', 'credit'):
-                    idx = j
-                    break
-            if idx is None:
-                continue
-            val = row[idx]
-            try:
-                num = float(str(val).replace(',', '').strip())
-            except Exception:
-                continue
-            total += abs(num)
-            lines += 1
-            if abs(num) <= threshold:
-                count += 1
-    except Exception:
-        pass
-    return count, total, lines
+JOB_HANDLERS = {
+    'crop-analysis': lambda path, p: _crop_analysis_result(path, p.get('prompt'), p.get('crop')),
+    'stage-verify': lambda path, p: _stage_verify_result(path, p.get('stage') or '', p.get('crop')),
+}
 
-def _count_small_transactions_json(path, threshold=500.0):
-    count = 0
-    total = 0.0
-    lines = 0
+def _wants_async():
+    """Clients opt in with ?async=1, an 'async' form field, or 'Prefer: respond-async'."""
+    flag = request.args.get('async') or request.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes') or 'respond-async' in (request.headers.get('Prefer') or '')
+
+def _job_json(job):
+    out = {
+        'jobId': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'createdAt': job.created_at.isoformat() if job.created_at else None,
+        'finishedAt': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == 'done' and job.result:
+        out['result'] = json.loads(job.result)
+    if job.status == 'failed':
+        out['error'] = job.error or 'Analysis failed'
+    return out
+
+def _submit_job(kind, path, params):
+    callback_url = (request.form.get('callbackUrl') or request.args.get('callbackUrl') or '').strip() or None
+    if callback_url:
+        problem = 'is too long' if len(callback_url) > 500 else public_url_error(callback_url, CALLBACK_ALLOWED_HOSTS)
+        if problem:
+            return jsonify({'error': f'callbackUrl {problem}'}), 400
+    if AnalysisJob.query.filter(AnalysisJob.status.in_(JOB_ACTIVE)).count() >= ANALYSIS_MAX_QUEUED:
+        return jsonify({'error': 'Analysis queue is full, try again shortly'}), 503
+    job = AnalysisJob(kind=kind, file_path=path, params=json.dumps(params), callback_url=callback_url)
+    _leased(job)
+    db.session.add(job)
+    db.session.commit()
+    analysis_pool.submit(_run_job, job.id)
+    resp = jsonify({'jobId': job.id, 'status': job.status, 'statusUrl': f'/api/jobs/{job.id}'})
+    resp.headers['Location'] = f'/api/jobs/{job.id}'
+    return resp, 202
+
+def _lease_owner():
+    """Identity of this process; re-made after fork so every worker holds its own leases."""
+    if _lease.get('pid') != os.getpid():
+        _lease.update(pid=os.getpid(), owner=f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}')
+    return _lease['owner']
+
+def _leased(row):
+    """Mark a job or file as held by this process."""
+    row.lease_owner = _lease_owner()
+    row.lease_until = datetime.utcnow() + timedelta(seconds=WORK_LEASE)
+
+def _stale(model, statuses):
+    """Unfinished rows no live process holds: lease expired, or queued before leases existed."""
+    return db.select(model.id).where(
+        model.status.in_(statuses),
+        db.or_(model.lease_until.is_(None), model.lease_until < datetime.utcnow()),
+    )
+
+def _claim(model, row_id, statuses):
+    """Take over a stale row; False when another process claimed it first."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(model)
+        .where(model.id == row_id, model.status.in_(statuses),
+               db.or_(model.lease_until.is_(None), model.lease_until < now))
+        .values(lease_owner=_lease_owner(), lease_until=now + timedelta(seconds=WORK_LEASE))
+    ).rowcount == 1
+    db.session.commit()
+    return claimed
+
+def _renew_leases():
+    until = datetime.utcnow() + timedelta(seconds=WORK_LEASE)
+    for model, statuses in ((AnalysisJob, JOB_ACTIVE), (UploadedFile, FILE_ACTIVE)):
+        db.session.execute(
+            db.update(model)
+            .where(model.lease_owner == _lease_owner(), model.status.in_(statuses))
+            .values(lease_until=until)
+        )
+    db.session.commit()
+
+def _lease_loop():
+    while True:
+        time.sleep(max(1, WORK_LEASE // 3))
+        try:
+            with app.app_context():
+                _renew_leases()
+                _resume_pending_jobs()
+                _resume_pending_files()
+        except Exception as e:
+            app.logger.warning('Work lease heartbeat failed: %s', e)
+
+_heartbeat = []
+_heartbeat_lock = threading.Lock()
+
+def resume_background_work():
+    """Claim unfinished jobs and files nobody holds, then keep this process's leases alive. Runs in
+    every serving process (create_app, or each gunicorn worker). Returns (jobs, files) resumed."""
+    jobs = _resume_pending_jobs()
+    files = _resume_pending_files()
+    with _heartbeat_lock:
+        if not _heartbeat or _heartbeat[0][0] != os.getpid():
+            thread = threading.Thread(target=_lease_loop, name='work-lease', daemon=True)
+            _heartbeat[:] = [(os.getpid(), thread)]
+            thread.start()
+    return jobs, files
+
+def _notify_callback(url, payload):
+    # Checked again when sending: the name may resolve somewhere else by now. Redirects are not followed
+    # for the same reason.
+    problem = public_url_error(url, CALLBACK_ALLOWED_HOSTS)
+    if problem:
+        app.logger.warning('Job callback not sent: %s %s', url, problem)
+        return
     try:
-        data = json.loads(open(path, 'r', encoding='utf-8').read())
-        def walk(x):
-            nonlocal count, total, lines
-            if isinstance(x, dict):
-                for k, v in x.items():
-                    if k.lower() in ('amount', 'amt', 'debit', 'credit') and isinstance(v, (int, float, str)):
-                        try:
-                            num = float(str(v).replace(',', '').strip())
-                        except Exception:
-                            continue
-                        total += abs(num)
-                        lines += 1
-                        if abs(num) <= threshold:
-                            count += 1
-                    else:
-                        walk(v)
-            elif isinstance(x, list):
-                for v in x:
-                    walk(v)
-        walk(data)
+        upstream.post(url, json=payload, timeout=10, allow_redirects=False)
     except Exception:
         pass
-    return count, total, lines
 
-def _count_small_transactions_pdf(path, threshold=500.0):
-    count = 0
-    total = 0.0
-    lines = 0
-    try:
-        # Best-effort text extraction without external libs: decode bytes and regex amounts
-        raw = open(path, 'rb').read()
+def _run_job(job_id):
+    """Worker: run one analysis job and persist its result (or error)."""
+    with app.app_context():
+        job = db.session.get(AnalysisJob, job_id)
+        if job is None or job.status not in JOB_ACTIVE:
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        _leased(job)
+        db.session.commit()
         try:
-            text = raw.decode('utf-8', errors='ignore')
-        except Exception:
-            text = raw.decode('latin-1', errors='ignore')
-        import re
-        # Match currency-like numbers: optional ₹/Rs/INR, commas, decimals, optional sign
-        pattern = re.compile(r"(?:₹\s*|Rs\.?\s*|INR\s*)?(-?\d{1,3}(?:,\d{3})*(?:\.\d+)?|-?\d+(?:\.\d+)?)")
-        matches = pattern.findall(text)
-        for m in matches:
-            try:
-                num = float(str(m).replace(',', '').strip())
-            except Exception:
-                continue
-            total += abs(num)
-            lines += 1
-            if abs(num) <= threshold:
-                count += 1
+            result = JOB_HANDLERS[job.kind](blobs.local(job.file_path), json.loads(job.params or '{}'))
+            job.result = json.dumps(result)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)[:500]
+            job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        payload = _job_json(job)
+        callback_url = job.callback_url
+    if callback_url:
+        _notify_callback(callback_url, payload)
+
+def _resume_pending_jobs():
+    """Re-queue jobs left queued or running by a process that is gone (their lease ran out)."""
+    resumed = 0
+    for job_id in db.session.execute(_stale(AnalysisJob, JOB_ACTIVE)).scalars().all():
+        if _claim(AnalysisJob, job_id, JOB_ACTIVE):
+            analysis_pool.submit(_run_job, job_id)
+            resumed += 1
+    return resumed
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_json(job)), 200
+
+STATEMENT_EXTS = ('.csv', '.xlsx', '.xlsm', '.xltx', '.xltm', '.json', '.txt', '.pdf')
+# Whole-statement cap for chunked uploads (the route is unauthenticated)
+STATEMENT_UPLOAD_MAX = int(float(os.getenv('STATEMENT_UPLOAD_MAX_MB', 200)) * 1024 * 1024)
+
+def _summarize_statement(path, ext):
+    """Score a saved statement file with the columnar engine. Returns None for unsupported types."""
+    if ext not in STATEMENT_EXTS:
+        return None
+    # Deferred: NumPy and pypdf are loaded by the first statement upload, not at start-up
+    from statement_analytics import compute_features, empty_columns, load_statement
+    from pdf_statement import load_pdf_statement
+    try:
+        cols = load_pdf_statement(path, cache=pdf_page_cache) if ext == '.pdf' else load_statement(path, ext)
+        features = compute_features(cols)
     except Exception:
-        pass
-    return count, total, lines
+        features = compute_features(empty_columns())
+    small = features['smallTransactions']
+    ratio = features['activityRatio']
+    active = (
+        (small >= 15) or (ratio >= 0.5)
+        # Regular use over several months, or standing payments (EMIs, bills), also counts as active
+        or (features['activeMonths'] >= 3 and features['transactionsPerMonth'] >= 8)
+        or bool(features['recurringPayments'])
+    )
+    delta = 20 if active else 0
+    return {
+        'active': active,
+        'smallTransactions': small,
+        'totalTransactions': features['totalTransactions'],
+        'activityRatio': round(ratio, 2),
+        'trustDelta': delta,
+        'features': features,
+    }
 
 @app.route('/api/bank-statement', methods=['POST'])
 def bank_statement():
@@ -577,366 +1014,91 @@ def bank_statement():
     if f.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     ext = os.path.splitext(f.filename)[1].lower()
-    unique = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
-    f.save(path)
-    small = 0
-    total = 0.0
-    lines = 0
-    if ext in ('.csv',):
-        small, total, lines = _count_small_transactions_csv(path)
-    elif ext in ('.xlsx', '.xlsm', '.xltx', '.xltm'):
-        small, total, lines = _count_small_transactions_xlsx(path)
-    elif ext in ('.json', '.txt'):
-        small, total, lines = _count_small_transactions_json(path)
-    elif ext in ('.pdf',):
-        small, total, lines = _count_small_transactions_pdf(path)
-    else:
+    if ext not in STATEMENT_EXTS:
         return jsonify({'error': 'Unsupported file type'}), 400
-    ratio = (small / lines) if lines else 0.0
-    active = (small >= 15) or (ratio >= 0.5)
-    delta = 20 if active else 0
-    return jsonify({
-        'active': active,
-        'smallTransactions': small,
-        'totalTransactions': lines,
-        'activityRatio': round(ratio, 2),
-        'trustDelta': delta,
-    }), 200
+    path, _ = _store_upload(f, ext)
+    return jsonify(_summarize_statement(path, ext)), 200
 
-def _normalize_metric(key, value):
-    try:
-        v = float(value)
-    except Exception:
-        return None
-    k = (key or '').lower()
-    if 'soil' in k and 'moist' in k:
-        return max(0.0, min(10.0, v / 10.0))
-    if k in ('ph',) or 'ph' in k:
-        return max(0.0, min(10.0, 10.0 - abs(v - 6.5) * (10.0 / 6.5)))
-    if 'humid' in k:
-        return max(0.0, min(10.0, v / 10.0))
-    if 'temp' in k:
-        return max(0.0, min(10.0, (50.0 - abs(v - 25.0)) / 5.0))
-    if 'rain' in k or 'precip' in k:
-        return max(0.0, min(10.0, 10.0 - max(0.0, v - 20.0) * 0.5))
-    if 'wind' in k:
-        return max(0.0, min(10.0, 10.0 - v * 0.5))
-    if 0.0 <= v <= 100.0:
-        return v / 10.0
-    return max(0.0, min(10.0, v / 10.0))
-
-def _extract_address_and_coords(data):
-    addr = None
-    lat = None
-    lon = None
-    def _try_get(obj, keys):
-        for k in keys:
-            if isinstance(obj, dict) and k in obj and obj[k] is not None:
-                return obj[k]
+# Chunked uploads for statements larger than MAX_CONTENT_LENGTH: start, PUT chunks in order, complete.
+# Each chunk is stored as its own part under partial/<id>/ in upload storage, so any node can take the next one.
+def _partial_upload(upload_id):
+    """(ext, [(part key, size)] in offset order) for a chunked upload in progress, or None."""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
         return None
-    if isinstance(data, dict):
-        raw = _try_get(data, ['address', 'location', 'field_address'])
-        lat = _try_get(data, ['lat', 'latitude'])
-        lon = _try_get(data, ['lon', 'lng', 'longitude'])
-        # Handle nested location object e.g. {"place": "Manaus, Brazil", "latitude": -3.1, "longitude": -60}
-        if isinstance(raw, dict):
-            addr_str = raw.get('place') or raw.get('name') or raw.get('address') or str(raw)
-            if not lat and raw.get('latitude') is not None:
-                try:
-                    lat = float(raw['latitude'])
-                except (TypeError, ValueError):
-                    pass
-            if not lon and raw.get('longitude') is not None:
-                try:
-                    lon = float(raw['longitude'])
-                except (TypeError, ValueError):
-                    pass
-            addr = addr_str if isinstance(addr_str, str) else (addr or raw)
-        else:
-            addr = raw
-    if isinstance(lat, str):
-        try:
-            lat = float(lat)
-        except Exception:
-            lat = None
-    if isinstance(lon, str):
-        try:
-            lon = float(lon)
-        except Exception:
-            lon = None
-    if (not lat or not lon) and addr and isinstance(addr, str):
-        try:
-            r = requests.get('https://nominatim.openstreetmap.org/search', params={'q': addr, 'format': 'json', 'limit': 1}, headers={'User-Agent': 'krishimitra-app'})
-            j = r.json()
-            if isinstance(j, list) and j:
-                lat = float(j[0]['lat'])
-                lon = float(j[0]['lon'])
-        except Exception:
-            pass
-    return addr, lat, lon
-
-def _extract_text_from_pdf(path):
-    """Extract text from PDF using pypdf or PyPDF2. Optimized for sensor/soil reports."""
-    for mod in ('pypdf', 'PyPDF2'):
-        try:
-            if mod == 'pypdf':
-                from pypdf import PdfReader
-            else:
-                from PyPDF2 import PdfReader
-            reader = PdfReader(path)
-            text_parts = []
-            for page in reader.pages:
-                t = page.extract_text()
-                if t:
-                    text_parts.append(t.strip())
-            if not text_parts:
-                return ''
-            # Normalize: collapse multiple spaces, preserve newlines for structure
-            full = '\n'.join(text_parts)
-            full = re.sub(r'[ \t]+', ' ', full)  # collapse horizontal whitespace
-            full = re.sub(r'\n{3,}', '\n\n', full)  # max 2 consecutive newlines
-            return full.strip()
-        except Exception:
-            continue
-    return ''
-
-def _flatten_numeric(obj):
-    nums = []
-    metrics = {'ph': None, 'moisture': None, 'nitrogen': None}
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            if isinstance(v, (int, float)):
-                n = _normalize_metric(k, v)
-                if n is not None:
-                    nums.append(n)
-            elif isinstance(v, (dict, list)):
-                nums.extend(_flatten_numeric(v))
-    elif isinstance(obj, list):
-        for v in obj:
-            if isinstance(v, (int, float)):
-                n = _normalize_metric('', v)
-                if n is not None:
-                    nums.append(n)
-            elif isinstance(v, (dict, list)):
-                nums.extend(_flatten_numeric(v))
-    return nums
-
-def _collect_metrics(obj, ph_vals, moist_vals, n_vals):
-    """Recursively collect ph, moisture, nitrogen from nested JSON."""
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            lk = str(k).lower()
-            if isinstance(v, (int, float)):
-                if 'ph' in lk:
-                    ph_vals.append(float(v))
-                if 'moist' in lk or 'humidity' in lk:
-                    moist_vals.append(float(v))
-                if 'nitrogen' in lk or lk == 'n':
-                    n_vals.append(float(v))
-            else:
-                _collect_metrics(v, ph_vals, moist_vals, n_vals)
-    elif isinstance(obj, list):
-        for v in obj:
-            _collect_metrics(v, ph_vals, moist_vals, n_vals)
-
-
-def _collect_rainfall(obj, rain_vals):
-    """Recursively collect rainfall values from nested JSON (keys: rainfall, rainfall_mm, precipitation, precip)."""
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            lk = str(k).lower()
-            if isinstance(v, (int, float)):
-                if 'rain' in lk or 'precip' in lk:
-                    try:
-                        rain_vals.append(float(v))
-                    except (TypeError, ValueError):
-                        pass
-            else:
-                _collect_rainfall(v, rain_vals)
-    elif isinstance(obj, list):
-        for v in obj:
-            _collect_rainfall(v, rain_vals)
-
-
-def _parse_sensor_metrics(path, ext):
-    """Parse file and extract metrics + content. Returns (metrics, addr, lat, lon, content_str, nums, rainfall_total)."""
-    nums = []
-    metrics = {'ph': None, 'moisture': None, 'nitrogen': None}
-    addr = None
-    lat = None
-    lon = None
-    content_str = ''
-    rainfall_total = None
+    ext, parts = None, []
+    for key, size, _ in upload_storage.list(f'partial/{upload_id}/'):
+        name = key.rsplit('/', 1)[1]
+        if name.startswith('part-'):
+            parts.append((key, size))
+        elif name.startswith('upload'):
+            ext = name[len('upload'):]
+    return (ext, sorted(parts)) if ext is not None else None
 
-    try:
-        if ext in ('.json', '.txt'):
-            content_str = open(path, 'r', encoding='utf-8', errors='ignore').read()
-            data = json.loads(content_str)
-            nums = _flatten_numeric(data)
-            addr, lat, lon = _extract_address_and_coords(data)
-            ph_vals, moist_vals, n_vals = [], [], []
-            _collect_metrics(data, ph_vals, moist_vals, n_vals)
-            rain_vals = []
-            _collect_rainfall(data, rain_vals)
-            if rain_vals:
-                rainfall_total = round(sum(rain_vals), 1)
-            if ph_vals:
-                metrics['ph'] = sum(ph_vals) / len(ph_vals)
-            if moist_vals:
-                metrics['moisture'] = sum(moist_vals) / len(moist_vals)
-            if n_vals:
-                metrics['nitrogen'] = sum(n_vals) / len(n_vals)
-        elif ext in ('.csv',):
-            content_str = open(path, 'r', encoding='utf-8', errors='ignore').read()
-            reader = csv.DictReader(StringIO(content_str))
-            rain_vals = []
-            for row in reader:
-                for k, v in row.items():
-                    try:
-                        n = _normalize_metric(k, float(v))
-                        if n is not None:
-                            nums.append(n)
-                        lk = str(k).lower()
-                        fv = float(v)
-                        if 'rain' in lk or 'precip' in lk:
-                            rain_vals.append(fv)
-                        if metrics['ph'] is None and 'ph' in lk:
-                            metrics['ph'] = fv
-                        if metrics['moisture'] is None and ('moist' in lk or 'humidity' in lk):
-                            metrics['moisture'] = fv
-                        if metrics['nitrogen'] is None and ('nitrogen' in lk or lk == 'n'):
-                            metrics['nitrogen'] = fv
-                    except Exception:
-                        pass
-            if rain_vals:
-                rainfall_total = round(sum(rain_vals), 1)
-        elif ext in ('.xlsx', '.xlsm', '.xltx', '.xltm'):
-            wb = load_workbook(path, data_only=True)
-            ws = wb.active
-            rows = list(ws.iter_rows(values_only=True))
-            content_str = '\n'.join([','.join([str(c) if c is not None else '' for c in r]) for r in rows])
-            headers = []
-            rain_vals = []
-            for i, row in enumerate(rows):
-                if i == 0:
-                    headers = [str(h) if h is not None else '' for h in row]
-                    continue
-                for k, v in zip(headers, row):
-                    try:
-                        n = _normalize_metric(k, float(v))
-                        if n is not None:
-                            nums.append(n)
-                        lk = str(k).lower()
-                        fv = float(v)
-                        if 'rain' in lk or 'precip' in lk:
-                            rain_vals.append(fv)
-                        if metrics['ph'] is None and 'ph' in lk:
-                            metrics['ph'] = fv
-                        if metrics['moisture'] is None and ('moist' in lk or 'humidity' in lk):
-                            metrics['moisture'] = fv
-                        if metrics['nitrogen'] is None and ('nitrogen' in lk or lk == 'n'):
-                            metrics['nitrogen'] = fv
-                    except Exception:
-                        pass
-            if rain_vals:
-                rainfall_total = round(sum(rain_vals), 1)
-        elif ext == '.pdf':
-            content_str = _extract_text_from_pdf(path)
-            if not content_str:
-                content_str = open(path, 'rb').read().decode('utf-8', errors='ignore')[:10000]
-            rain_vals = []
-            # Extract metrics from PDF text: look for key: value and "key value" patterns
-            for line in content_str.splitlines():
-                stripped = line.strip()
-                if not stripped:
-                    continue
-                lower = stripped.lower()
-                if metrics['ph'] is None and ('ph' in lower or 'p.h' in lower):
-                    m = re.search(r'ph[:\s=]*(-?\d+(?:\.\d+)?)|(-?\d+(?:\.\d+)?)\s*(?:ph|pH)', lower, re.I)
-                    val = (m.group(1) or m.group(2)) if m else None
-                    if not val:
-                        m = re.search(r'(-?\d+(?:\.\d+)?)', stripped)
-                        val = m.group(1) if m else None
-                    if val:
-                        metrics['ph'] = float(val)
-                        n = _normalize_metric('ph', metrics['ph'])
-                        if n is not None:
-                            nums.append(n)
-                if metrics['moisture'] is None and ('moist' in lower or 'humidity' in lower or '%' in stripped):
-                    m = re.search(r'(\d+(?:\.\d+)?)\s*%|moisture[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*moisture', lower, re.I)
-                    val = (m.group(1) or m.group(2) or m.group(3)) if m else None
-                    if not val:
-                        m = re.search(r'(-?\d+(?:\.\d+)?)', stripped)
-                        val = m.group(1) if m else None
-                    if val:
-                        metrics['moisture'] = float(val)
-                        n = _normalize_metric('soil moisture', metrics['moisture'])
-                        if n is not None:
-                            nums.append(n)
-                if metrics['nitrogen'] is None and ('nitrogen' in lower or 'n ' in lower or ' ppm' in lower or 'mg/kg' in lower):
-                    m = re.search(r'nitrogen[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:ppm|mg/kg|mg kg)|n[:\s=]*(\d+(?:\.\d+)?)', lower, re.I)
-                    val = (m.group(1) or m.group(2) or m.group(3)) if m else None
-                    if not val:
-                        m = re.search(r'(-?\d+(?:\.\d+)?)', stripped)
-                        val = m.group(1) if m else None
-                    if val:
-                        metrics['nitrogen'] = float(val)
-                        n = _normalize_metric('nitrogen', metrics['nitrogen'])
-                        if n is not None:
-                            nums.append(n)
-                if addr is None and ('address' in lower or 'location' in lower):
-                    parts = stripped.split(':', 1)
-                    addr = parts[1].strip() if len(parts) == 2 and parts[1].strip() else stripped
-                if 'rain' in lower or 'precip' in lower:
-                    m = re.search(r'rainfall[:\s=]*(\d+(?:\.\d+)?)|precipitation[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:mm|mm\.?)', lower, re.I)
-                    val = (m.group(1) or m.group(2) or m.group(3)) if m else None
-                    if not val:
-                        m = re.search(r'(\d+(?:\.\d+)?)', stripped)
-                        val = m.group(1) if m else None
-                    if val:
-                        try:
-                            rain_vals.append(float(val))
-                        except (TypeError, ValueError):
-                            pass
-            if rain_vals:
-                rainfall_total = round(sum(rain_vals), 1)
-            if addr:
-                try:
-                    _, lat, lon = _extract_address_and_coords({'address': addr})
-                except Exception:
-                    pass
-    except json.JSONDecodeError as e:
-        raise ValueError(f'Invalid JSON: {e}') from e
-    except Exception as e:
-        raise ValueError(f'Failed to parse file: {e}') from e
-
-    return metrics, addr, lat, lon, content_str, nums, rainfall_total
-
-
-@app.route('/api/sensor-readings', methods=['POST'])
-def sensor_readings():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    f = request.files['file']
-    if f.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    ext = os.path.splitext(f.filename)[1].lower()
-    if ext not in ('.json', '.txt', '.csv', '.xlsx', '.xlsm', '.xltx', '.xltm', '.pdf'):
-        return jsonify({'error': 'Unsupported file type. Use JSON, PDF, CSV, or Excel.'}), 400
+@app.route('/api/bank-statement/chunks', methods=['POST'])
+def bank_statement_chunks_start():
+    data = request.get_json() or {}
+    ext = os.path.splitext((data.get('filename') or '').strip())[1].lower()
+    if ext not in STATEMENT_EXTS:
+        return jsonify({'error': 'Unsupported file type'}), 400
+    upload_id = uuid.uuid4().hex
+    upload_storage.put_stream(f'partial/{upload_id}/upload{ext}', io.BytesIO(b''))
+    return jsonify({
+        'uploadId': upload_id,
+        'received': 0,
+        'maxChunkSize': app.config['MAX_CONTENT_LENGTH'],
+        'maxSize': STATEMENT_UPLOAD_MAX,
+    }), 201
 
-    unique = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
+@app.route('/api/bank-statement/chunks/<upload_id>', methods=['PUT'])
+def bank_statement_chunk(upload_id):
+    upload = _partial_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    received = sum(size for _, size in upload[1])
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        # Without it a retried PUT would append the same bytes twice
+        return jsonify({'error': 'offset is required', 'received': received}), 400
+    if offset != received:
+        # Client resumes from `received` after a dropped connection
+        return jsonify({'error': 'Offset mismatch', 'received': received}), 409
+    room = STATEMENT_UPLOAD_MAX - received
+    too_large = jsonify({'error': f'Statement larger than {STATEMENT_UPLOAD_MAX} bytes', 'received': received}), 413
+    if request.content_length is not None and request.content_length > room:
+        return too_large
+    # A part is only stored once complete, so a dropped connection leaves nothing behind
     try:
-        f.save(path)
-    except Exception as e:
-        return jsonify({'error': f'Failed to save file: {e}'}), 500
+        received += upload_storage.put_stream(f'partial/{upload_id}/part-{received:012d}',
+                                              CappedStream(request.stream, room))
+    except TooLarge:
+        return too_large
+    return jsonify({'uploadId': upload_id, 'received': received}), 200
 
-    try:
-        metrics, addr, lat, lon, content_str, nums, rainfall_total = _parse_sensor_metrics(path, ext)
-    except ValueError as e:
-        return jsonify({'error': str(e)}), 400
+@app.route('/api/bank-statement/chunks/<upload_id>/complete', methods=['POST'])
+def bank_statement_chunks_complete(upload_id):
+    upload = _partial_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    ext, parts = upload
+    path, _, _ = blobs.save_chunks((chunk for key, _ in parts for chunk in upload_storage.stream(key)), ext)
+    for key, _ in parts:
+        upload_storage.delete(key)
+    upload_storage.delete(f'partial/{upload_id}/upload{ext}')
+    return jsonify(_summarize_statement(path, ext)), 200
+
+def _geocode_if_missing(addr, lat, lon):
+    """Fill in coordinates from the address when the report did not carry them (left empty while the
+    geocoder is busy)."""
+    if (not lat or not lon) and addr and isinstance(addr, str):
+        try:
+            g_lat, g_lon = geocoder.lookup(addr)
+        except GeocoderBusy:
+            return lat, lon
+        if g_lat is not None:
+            lat, lon = g_lat, g_lon
+    return lat, lon
 
+def _sensor_trust(metrics, score_mean):
     # Rule-based trust score (no AI): same logic style as bank statement
     # pH 6.0-7.5 = 10, moisture 20-60 = 10, nitrogen in range = 10; total 0-30
     ph, moist, nitro = metrics.get('ph'), metrics.get('moisture'), metrics.get('nitrogen')
@@ -948,43 +1110,433 @@ def sensor_readings():
     # Nitrogen: accept 40-80 mg/kg or 240-480 ppm
     if nitro is not None and (40 <= nitro <= 80 or 240 <= nitro <= 480):
         points += 10
-    if points == 0 and nums:
-        trust = round(sum(nums) / max(1, len(nums)), 1) * 3
-        trust = max(0, min(30, trust))
-    else:
-        trust = float(points)
+    if points == 0 and score_mean is not None:
+        trust = round(score_mean, 1) * 3
+        return max(0, min(30, trust))
+    return float(points)
 
+def _sensor_report(unique, original_filename, path, parsed, lat, lon):
+    """(unsaved SensorReport, response dict without reportId) for a parsed sensor file."""
+    metrics, addr, _, _, score_mean, rainfall_total = parsed
+    trust = _sensor_trust(metrics, score_mean)
     summary = None  # No AI used; rule-based only
     addr_text = None
     if addr is not None:
         addr_text = json.dumps(addr, ensure_ascii=False) if isinstance(addr, (dict, list)) else str(addr)
-
     sr = SensorReport(
         filename=unique,
-        original_filename=f.filename,
+        original_filename=original_filename,
         file_path=path,
+        content_hash=blobs.digest_of(path),
         trust_score_10=trust,
         address_text=addr_text,
         lat=lat,
         lon=lon,
         ai_summary=summary
     )
-    db.session.add(sr)
-    db.session.commit()
-
     out = {
         'trustScore': trust,
         'address': addr,
         'lat': lat,
         'lon': lon,
-        'reportId': sr.id,
         'metrics': metrics,
         'aiSummary': summary
     }
     if rainfall_total is not None:
         out['rainfallTotal'] = rainfall_total
+    return sr, out
+
+def _farm_target(form):
+    """(farm id or None, reading time or None, error) from the optional farmId / takenAt form fields.
+    takenAt (ISO-8601 or epoch) is when the report's readings were taken; the upload time otherwise."""
+    farm_id = (form.get('farmId') or '').strip() or None
+    if farm_id and not FARM_ID.match(farm_id):
+        return None, None, 'Invalid farmId'
+    taken_at = parse_timestamp(form.get('takenAt'))
+    if form.get('takenAt') and taken_at is None:
+        return None, None, 'takenAt must be an ISO-8601 time or epoch seconds'
+    return farm_id, taken_at, None
+
+def _ingest_report(sr, parsed, taken_at=None):
+    """Feed a saved report's readings into its farm's time series and rainfall windows. The same file
+    uploaded again for the same farm adds nothing: only the earliest such report is ingested."""
+    if sr.content_hash and db.session.execute(
+        db.select(SensorReport.id).where(SensorReport.farm_id == sr.farm_id,
+                                         SensorReport.content_hash == sr.content_hash,
+                                         SensorReport.id < sr.id).limit(1)
+    ).first() is not None:
+        return 0
+    metrics, rainfall_total = parsed[0], parsed[5]
+    ts = taken_at or sr.created_at
+    samples = [(name, ts, float(v)) for name, v in metrics.items() if v is not None]
+    if rainfall_total is not None:
+        samples.append(('rainfall', ts, float(rainfall_total)))
+    return _ingest_samples(sr.farm_id, samples, report_id=sr.id)
+
+@app.route('/api/sensor-readings', methods=['POST'])
+def sensor_readings():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    f = request.files['file']
+    if f.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    ext = os.path.splitext(f.filename)[1].lower()
+    if ext not in SENSOR_EXTS:
+        return jsonify({'error': 'Unsupported file type. Use JSON, PDF, CSV, or Excel.'}), 400
+
+    farm_id, taken_at, problem = _farm_target(request.form)
+    if problem:
+        return jsonify({'error': problem}), 400
+
+    try:
+        path, _ = _store_upload(f, ext)
+    except Exception as e:
+        return jsonify({'error': f'Failed to save file: {e}'}), 500
+    unique = os.path.basename(path)
+
+    try:
+        parsed = parse_sensor_file(path, ext)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    addr, lat, lon = parsed[1], parsed[2], parsed[3]
+    lat, lon = _geocode_if_missing(addr, lat, lon)
+
+    sr, out = _sensor_report(unique, f.filename, path, parsed, lat, lon)
+    sr.farm_id = farm_id
+    db.session.add(sr)
+    db.session.commit()
+    if farm_id:
+        out.update(farmId=farm_id, samplesAdded=_ingest_report(sr, parsed, taken_at))
+
+    out['reportId'] = sr.id
     return jsonify(out), 200
 
+@app.route('/api/sensor-readings/batch', methods=['POST'])
+def sensor_readings_batch():
+    """Many reports in one request: repeated 'files' parts and/or .zip archives of reports.
+    Parsed in parallel, each distinct address geocoded once, all rows inserted in one transaction.
+    farmId / takenAt apply to every report, like the single-file route; farmIds ({"file name": farm id})
+    overrides the farm per report. Reports with a farm feed its time series and rainfall windows."""
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f and f.filename]
+    if not uploads:
+        return jsonify({'error': 'No files provided'}), 400
+    if len(uploads) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} reports per batch'}), 413
+    default_farm, taken_at, problem = _farm_target(request.form)
+    try:
+        farm_ids = json.loads(request.form.get('farmIds') or '{}')
+    except ValueError:
+        farm_ids = None
+    if not isinstance(farm_ids, dict) or not all(isinstance(v, str) and FARM_ID.match(v) for v in farm_ids.values()):
+        problem = problem or 'farmIds must be an object of file name -> farm id'
+    if problem:
+        return jsonify({'error': problem}), 400
+
+    # Count every report (archives unpacked to temp files) before anything is kept in the blob store
+    name_for = lambda ext: f"{uuid.uuid4().hex}{ext}"
+    staged = []  # (original name, upload / unpacked temp path / None, error or None)
+    for f in uploads:
+        ext = os.path.splitext(f.filename)[1].lower()
+        if ext == '.zip':
+            archive = os.path.join(blobs.tmp, name_for('.zip'))
+            f.save(archive)
+            try:
+                staged.extend(unpack_reports(archive, blobs.tmp, name_for))
+            except zipfile.BadZipFile:
+                staged.append((f.filename, None, 'Invalid zip archive'))
+            finally:
+                os.remove(archive)
+        elif ext not in SENSOR_EXTS:
+            staged.append((f.filename, None, 'Unsupported file type. Use JSON, PDF, CSV, or Excel.'))
+        else:
+            staged.append((f.filename, f, None))
+        if len(staged) > BATCH_MAX_FILES:
+            for _, item, _ in staged:
+                if isinstance(item, str):
+                    os.remove(item)
+            return jsonify({'error': f'At most {BATCH_MAX_FILES} reports per batch'}), 413
+    entries = [(name, (blobs.adopt(item)[0] if isinstance(item, str) else _store_upload(item)[0]) if item else None, error)
+               for name, item, error in staged]
+
+    saved = [(i, path) for i, (_, path, error) in enumerate(entries) if path]
+    parsed = dict(zip([i for i, _ in saved],
+                      parse_many([(path, os.path.splitext(path)[1]) for _, path in saved])))
+
+    coords = {}
+    for result, _ in parsed.values():
+        if result:
+            addr, lat, lon = result[1], result[2], result[3]
+            if (not lat or not lon) and addr and isinstance(addr, str) and addr not in coords:
+                coords[addr] = _geocode_if_missing(addr, None, None)
+
+    results, reports = [], []
+    for i, (name, path, error) in enumerate(entries):
+        result, parse_error = parsed.get(i, (None, error))
+        if result is None:
+            results.append({'filename': name, 'ok': False, 'error': parse_error or error})
+            continue
+        addr, lat, lon = result[1], result[2], result[3]
+        if (not lat or not lon) and isinstance(addr, str) and coords.get(addr, (None, None))[0] is not None:
+            lat, lon = coords[addr]
+        sr, out = _sensor_report(os.path.basename(path), name, path, result, lat, lon)
+        sr.farm_id = farm_ids.get(name, default_farm)
+        reports.append((sr, result))
+        results.append(dict(out, filename=name, ok=True))
+    if reports:
+        db.session.add_all(sr for sr, _ in reports)
+        db.session.commit()
+    ingested = iter([(sr.id, sr.farm_id, _ingest_report(sr, result, taken_at) if sr.farm_id else None)
+                     for sr, result in reports])
+    for r in results:
+        if r['ok']:
+            r['reportId'], farm_id, added = next(ingested)
+            if farm_id:
+                r.update(farmId=farm_id, samplesAdded=added)
+    return jsonify({
+        'processed': len(reports),
+        'failed': len(results) - len(reports),
+        'results': results,
+    }), 200
+
+def _update_rainfall_windows(farm_id, samples):
+    """Add a batch's rainfall to its season windows: one increment per (season, year) touched, usually one."""
+    for (season, year), (n, total, first_ts, last_ts) in rainfall_windows(samples).items():
+        updated = db.session.execute(
+            db.update(RainfallWindow).where(
+                RainfallWindow.farm_id == farm_id,
+                RainfallWindow.season == season,
+                RainfallWindow.season_year == year,
+            ).values(
+                total_mm=RainfallWindow.total_mm + total,
+                readings=RainfallWindow.readings + n,
+                first_ts=db.case((RainfallWindow.first_ts > first_ts, first_ts), else_=RainfallWindow.first_ts),
+                last_ts=db.case((RainfallWindow.last_ts < last_ts, last_ts), else_=RainfallWindow.last_ts),
+            )
+        ).rowcount
+        if not updated:
+            db.session.add(RainfallWindow(farm_id=farm_id, season=season, season_year=year, total_mm=total,
+                                          readings=n, first_ts=first_ts, last_ts=last_ts))
+            db.session.flush()
+
+def _insert_new_samples(farm_id, samples, report_id):
+    """Insert the samples not stored yet; returns the (metric, ts, value) rows actually inserted. A
+    (farm, metric, ts) already present is left as it is, so a retried batch inserts nothing."""
+    first = {}
+    for m, ts, v in samples:
+        first.setdefault((m, ts), v)  # the same reading twice in one batch counts once
+    rows = [{'farm_id': farm_id, 'metric': m, 'ts': ts, 'value': v, 'report_id': report_id} for (m, ts), v in first.items()]
+    dialect = db.engine.dialect
+    if dialect.name in ('sqlite', 'postgresql') and dialect.insert_returning:
+        insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        stmt = (insert(SensorSample)
+                .on_conflict_do_nothing(index_elements=['farm_id', 'metric', 'ts'])
+                .returning(SensorSample.metric, SensorSample.ts, SensorSample.value))
+        return [tuple(r) for r in db.session.execute(stmt, rows).all()]
+    # Other databases: skip what is stored; a concurrent insert of the same key raises IntegrityError
+    stored = set()
+    for name in {m for m, _ in first}:
+        times = [ts for m, ts in first if m == name]
+        stored.update((name, ts) for ts in db.session.execute(
+            db.select(SensorSample.ts).where(SensorSample.farm_id == farm_id, SensorSample.metric == name,
+                                             SensorSample.ts.between(min(times), max(times)))
+        ).scalars())
+    rows = [r for r in rows if (r['metric'], r['ts']) not in stored]
+    if rows:
+        db.session.execute(db.insert(SensorSample), rows)
+    return [(r['metric'], r['ts'], r['value']) for r in rows]
+
+def _ingest_samples(farm_id, samples, report_id=None):
+    """Store (metric, ts, value) samples and fold the ones that were new into the hourly/daily rollups
+    and rainfall windows, in one transaction. Returns how many were new.
+    Rollups are incremented in SQL, so concurrent batches for the same bucket do not lose updates."""
+    if not samples:
+        return 0
+    for attempt in range(3):
+        try:
+            samples_added = _insert_new_samples(farm_id, samples, report_id)
+            if not samples_added:
+                db.session.commit()
+                return 0
+            batch = rollup_batch(samples_added)
+            metrics = {k[0] for k in batch}
+            buckets = [k[2] for k in batch]
+            existing = set(db.session.execute(
+                db.select(SensorRollup.metric, SensorRollup.resolution, SensorRollup.bucket).where(
+                    SensorRollup.farm_id == farm_id,
+                    SensorRollup.metric.in_(metrics),
+                    SensorRollup.bucket.between(min(buckets), max(buckets)),
+                )
+            ).all())
+            updates = [{'b_metric': k[0], 'b_resolution': k[1], 'b_bucket': k[2], 'n': a[0], 's': a[1], 'lo': a[2], 'hi': a[3]}
+                       for k, a in batch.items() if k in existing]
+            inserts = [{'farm_id': farm_id, 'metric': k[0], 'resolution': k[1], 'bucket': k[2],
+                        'count': a[0], 'total': a[1], 'min_value': a[2], 'max_value': a[3]}
+                       for k, a in batch.items() if k not in existing]
+            if updates:
+                db.session.connection().execute(
+                    db.update(SensorRollup).where(
+                        SensorRollup.farm_id == farm_id,
+                        SensorRollup.metric == db.bindparam('b_metric'),
+                        SensorRollup.resolution == db.bindparam('b_resolution'),
+                        SensorRollup.bucket == db.bindparam('b_bucket'),
+                    ).values(
+                        count=SensorRollup.count + db.bindparam('n'),
+                        total=SensorRollup.total + db.bindparam('s'),
+                        min_value=db.case((SensorRollup.min_value > db.bindparam('lo'), db.bindparam('lo')),
+                                          else_=SensorRollup.min_value),
+                        max_value=db.case((SensorRollup.max_value < db.bindparam('hi'), db.bindparam('hi')),
+                                          else_=SensorRollup.max_value),
+                    ),
+                    updates,
+                )
+            if inserts:
+                db.session.execute(db.insert(SensorRollup), inserts)
+            _update_rainfall_windows(farm_id, samples_added)
+            db.session.commit()
+            return len(samples_added)
+        except IntegrityError:
+            db.session.rollback()  # another batch stored one of our samples or buckets first; retry
+    raise RuntimeError('could not update sensor rollups')
+
+@app.route('/api/farms/<farm_id>/readings', methods=['POST'])
+def ingest_readings(farm_id):
+    """Batch ingestion for IoT feeds: {"readings": [{"ts": ..., "metric": "ph", "value": 6.8} | {"ts": ..., "ph": 6.8, ...}]}"""
+    if not FARM_ID.match(farm_id):
+        return jsonify({'error': 'Invalid farm id'}), 400
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': 'JSON body required'}), 400
+    samples, errors = parse_readings(payload)
+    if len(samples) > MAX_BATCH:
+        return jsonify({'error': f'At most {MAX_BATCH} readings per request'}), 413
+    if not samples:
+        return jsonify({'error': 'No valid readings', 'rejected': errors}), 400
+    accepted = _ingest_samples(farm_id, samples)
+    # Readings already stored (a retried request) are not counted again
+    return jsonify({'farmId': farm_id, 'accepted': accepted, 'duplicates': len(samples) - accepted,
+                    'rejected': errors}), 201
+
+@app.route('/api/farms/<farm_id>/readings', methods=['GET'])
+def query_readings(farm_id):
+    """Range query: ?metric=ph,moisture&from=<iso|epoch>&to=...&resolution=raw|hour|day&limit=N"""
+    if not FARM_ID.match(farm_id):
+        return jsonify({'error': 'Invalid farm id'}), 400
+    names = [metric_name(m) for m in (request.args.get('metric') or '').split(',') if m.strip()]
+    if not names or None in names:
+        return jsonify({'error': 'metric is required'}), 400
+    resolution = (request.args.get('resolution') or 'raw').lower()
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({'error': 'resolution must be raw, hour or day'}), 400
+    end = parse_timestamp(request.args.get('to'), default=datetime.utcnow())
+    start = parse_timestamp(request.args.get('from'), default=end - timedelta(days=30) if end else None)
+    if start is None or end is None:
+        return jsonify({'error': 'Invalid from/to'}), 400
+    limit = max(1, min(MAX_BATCH, request.args.get('limit', 1000, type=int)))
+    series = {}
+    for name in names:
+        if resolution == 'raw':
+            rows = db.session.execute(
+                db.select(SensorSample.ts, SensorSample.value).where(
+                    SensorSample.farm_id == farm_id, SensorSample.metric == name,
+                    SensorSample.ts >= start, SensorSample.ts <= end,
+                ).order_by(SensorSample.ts).limit(limit)
+            ).all()
+            series[name] = [{'ts': ts.isoformat(), 'value': v} for ts, v in rows]
+        else:
+            rows = db.session.execute(
+                db.select(SensorRollup.bucket, SensorRollup.count, SensorRollup.total,
+                          SensorRollup.min_value, SensorRollup.max_value).where(
+                    SensorRollup.farm_id == farm_id, SensorRollup.metric == name,
+                    SensorRollup.resolution == resolution,
+                    SensorRollup.bucket >= start, SensorRollup.bucket <= end,
+                ).order_by(SensorRollup.bucket).limit(limit)
+            ).all()
+            series[name] = [{'ts': b.isoformat(), 'count': n, 'sum': t, 'avg': t / n if n else None, 'min': lo, 'max': hi}
+                            for b, n, t, lo, hi in rows]
+    return jsonify({
+        'farmId': farm_id,
+        'resolution': resolution,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'series': series,
+    }), 200
+
+def _window_json(w, season, year):
+    start, end = season_bounds(season, year)
+    return {
+        'season': season,
+        'year': year,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'totalMm': round(w.total_mm, 1) if w else 0.0,
+        'readings': w.readings if w else 0,
+    }
+
+def _season_args(now):
+    """(season, year, error) from ?season= and ?year=, defaulting to the season in progress."""
+    season, year = season_of(now)
+    season = (request.args.get('season') or season).lower()
+    year = request.args.get('year', year, type=int)
+    if season not in SEASON_MONTHS:
+        return season, year, 'season must be kharif, rabi or zaid'
+    if not SEASON_YEARS[0] <= year <= SEASON_YEARS[1]:
+        return season, year, f'year must be between {SEASON_YEARS[0]} and {SEASON_YEARS[1]}'
+    return season, year, None
+
+@app.route('/api/farms/<farm_id>/rainfall', methods=['GET'])
+def farm_rainfall(farm_id):
+    """Insurance check for one farm: trailing-window total from daily rollups plus the season window."""
+    if not FARM_ID.match(farm_id):
+        return jsonify({'error': 'Invalid farm id'}), 400
+    threshold = request.args.get('threshold', DROUGHT_MM, type=float)
+    days = max(1, min(366, request.args.get('days', 30, type=int)))
+    now = datetime.utcnow()
+    season, year, problem = _season_args(now)
+    if problem:
+        return jsonify({'error': problem}), 400
+    since = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    recent, count = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(SensorRollup.total), 0.0), db.func.coalesce(db.func.sum(SensorRollup.count), 0))
+        .where(SensorRollup.farm_id == farm_id, SensorRollup.metric == 'rainfall',
+               SensorRollup.resolution == 'day', SensorRollup.bucket >= since)
+    ).one()
+    window = RainfallWindow.query.filter_by(farm_id=farm_id, season=season, season_year=year).first()
+    recent = round(recent, 1)
+    return jsonify({
+        'farmId': farm_id,
+        'windowDays': days,
+        'rainfallTotal': recent if count else None,
+        'readings': count,
+        'thresholdMm': threshold,
+        'triggered': bool(count) and recent < threshold,
+        'status': rainfall_status(recent, threshold) if count else None,
+        'season': _window_json(window, season, year),
+    }), 200
+
+@app.route('/api/rainfall/eligible', methods=['GET'])
+def rainfall_eligible():
+    """Payout run: farms whose season rainfall is below the threshold (index range scan on the window table).
+    Only farms that reported rainfall in the season are considered."""
+    season, year, problem = _season_args(datetime.utcnow())
+    if problem:
+        return jsonify({'error': problem}), 400
+    threshold = request.args.get('threshold', type=float)
+    if threshold is None:
+        return jsonify({'error': 'threshold (mm) is required'}), 400
+    limit = max(1, min(10000, request.args.get('limit', 1000, type=int)))
+    rows = RainfallWindow.query.filter(
+        RainfallWindow.season == season,
+        RainfallWindow.season_year == year,
+        RainfallWindow.total_mm < threshold,
+    ).order_by(RainfallWindow.total_mm).limit(limit).all()
+    return jsonify({
+        'season': season,
+        'year': year,
+        'thresholdMm': threshold,
+        'farms': [{'farmId': w.farm_id, 'totalMm': round(w.total_mm, 1), 'readings': w.readings,
+                   'lastReadingAt': w.last_ts.isoformat() if w.last_ts else None} for w in rows],
+    }), 200
+
 @app.route('/api/weather', methods=['GET'])
 def weather():
     address = request.args.get('address')
@@ -992,33 +1544,34 @@ def weather():
     lon = request.args.get('lon')
     if address and (not lat or not lon):
         try:
-            r = requests.get('https://nominatim.openstreetmap.org/search', params={'q': address, 'format': 'json', 'limit': 1}, headers={'User-Agent': 'krishimitra-app'})
-            j = r.json()
-            if isinstance(j, list) and j:
-                lat = j[0]['lat']
-                lon = j[0]['lon']
-        except Exception:
-            pass
+            g_lat, g_lon = geocoder.lookup(address)
+        except GeocoderBusy as e:
+            resp = jsonify({'error': str(e)})
+            resp.headers['Retry-After'] = '2'
+            return resp, 503
+        if g_lat is not None:
+            lat, lon = g_lat, g_lon
     if not lat or not lon:
         return jsonify({'error': 'lat/lon or address required'}), 400
     try:
-        wx = requests.get('https://api.open-meteo.com/v1/forecast', params={
-            'latitude': lat,
-            'longitude': lon,
-            'current_weather': 'true',
-            'hourly': 'temperature_2m,precipitation,wind_speed_10m'
-        })
-        data = wx.json()
-        current = data.get('current_weather') or {}
-        hourly = data.get('hourly') or {}
-        return jsonify({
-            'current': current,
-            'hourly': hourly,
-            'lat': float(lat),
-            'lon': float(lon)
-        }), 200
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'lat/lon must be numbers'}), 400
+    hours = request.args.get('hours', type=int)
+    try:
+        data, (cell_lat, cell_lon) = forecasts.get(lat, lon)
     except Exception:
         return jsonify({'error': 'weather fetch failed'}), 500
+    hourly = data['hourly']
+    if hours and hours > 0:
+        hourly = trim_hourly(hourly, hours)
+    return jsonify({
+        'current': data['current'],
+        'hourly': hourly,
+        'lat': lat,
+        'lon': lon,
+        'gridCell': {'lat': cell_lat, 'lon': cell_lon}
+    }), 200
 
 @app.route('/api/upload', methods=['POST'])
 @jwt_required()
@@ -1033,20 +1586,16 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    
-    # Save file
-    file.save(file_path)
+    # Save file (hashed while it is written; identical content is stored once)
+    file_path, content_hash = _store_upload(file)
     
     # Create file record in database
     uploaded_file = UploadedFile(
-        filename=unique_filename,
+        filename=os.path.basename(file_path),
         original_filename=file.filename,
         file_path=file_path,
-        user_id=current_user_id
+        user_id=current_user_id,
+        content_hash=content_hash,
     )
     
     db.session.add(uploaded_file)
@@ -1058,52 +1607,366 @@ def upload_file():
         'filename': uploaded_file.original_filename
     }), 201
 
+# --- /api/process: background pipeline for uploaded files ---
+# Photos go to the crop analysers, reports with soil/sensor readings to the sensor parser and other
+# tables/PDFs to the bank statement scorer. Each stage is committed as soon as it finishes, so
+# GET /api/files/<id> shows partial results while the slower stages (geocoding, model calls) run.
+PIPELINE_KINDS = ('sensor', 'statement', 'image')
+PIPELINE_VERSION = 1  # part of result_key; bump when pipeline output changes so old results are not reused
+_pipeline_waiting = {}  # result_key -> ids of identical files waiting for the run in progress in this process
+_pipeline_counts = {'deduplicated': 0}
+_pipeline_lock = threading.Lock()
+
+def _is_image(path):
+    return image_prep.sniff_format(blobs.read_range(path, 0, 31)) is not None
+
+def _sensor_stages(parsed):
+    metrics, addr, lat, lon, score_mean, rainfall_total = parsed
+    result = {'kind': 'sensor', 'metrics': metrics, 'address': addr}
+    if rainfall_total is not None:
+        result['rainfallTotal'] = rainfall_total
+    yield 'parsed', result
+    result['lat'], result['lon'] = _geocode_if_missing(addr, lat, lon)
+    yield 'located', result
+    result['trustScore'] = _sensor_trust(metrics, score_mean)
+    yield 'scored', result
+
+def _statement_stages(path, ext):
+    yield 'scored', dict(_summarize_statement(path, ext), kind='statement')
+
+def _image_stages(path, params):
+    img = image_prep.prepare(path)
+    result = {'kind': 'image', 'image': {'mime': img['mime'], 'bytes': img['bytes'], 'derived': img['derived']}}
+    yield 'prepared', result
+    if params.get('stage'):
+        result['stageVerification'] = _stage_verify_result(path, params['stage'], params.get('crop'))
+    else:
+        result['analysis'] = _crop_analysis_result(path, params.get('prompt'), params.get('crop'))
+    yield 'analyzed', result
+
+def _pipeline_stages(path, params):
+    """(kind, iterator of (stage, result so far)). Without a type hint, files with sensor readings are
+    sensor reports and other tables/PDFs are bank statements."""
+    kind = params.get('type')
+    ext = os.path.splitext(path)[1].lower()
+    if kind == 'image':
+        return kind, _image_stages(path, params)
+    if kind == 'statement':
+        return kind, _statement_stages(path, ext)
+    try:
+        parsed = parse_sensor_file(path, ext)
+    except ValueError:
+        if kind == 'sensor':
+            raise
+        parsed = None
+    # Every number gets a 0-10 score, so only named readings (pH, moisture, nitrogen, rainfall) mark a sensor report
+    if kind == 'sensor' or (parsed and (any(v is not None for v in parsed[0].values()) or parsed[5] is not None)):
+        return 'sensor', _sensor_stages(parsed)
+    return 'statement', _statement_stages(path, ext)
+
+def _file_json(uf):
+    out = {
+        'id': uf.id,
+        'filename': uf.original_filename,
+        'uploaded_at': uf.uploaded_at.isoformat() if uf.uploaded_at else None,
+        'processed': uf.processed,
+        'status': uf.status or ('done' if uf.processed else 'uploaded'),
+        'kind': uf.kind,
+        'stage': uf.stage,
+        'processed_at': uf.processed_at.isoformat() if uf.processed_at else None,
+    }
+    if uf.ai_response:
+        try:
+            out['result'] = json.loads(uf.ai_response)
+        except ValueError:
+            out['ai_response'] = uf.ai_response  # written before the pipeline existed
+    if uf.status == 'failed':
+        out['error'] = uf.error or 'Processing failed'
+    return out
+
+def _copy_result(uf, source):
+    """Give uf the outcome of an identical file's run instead of processing it again."""
+    uf.kind = source.kind
+    uf.stage = source.stage
+    uf.ai_response = source.ai_response
+    uf.error = source.error
+    uf.status = source.status
+    uf.processed = source.status == 'done'
+    uf.processed_at = datetime.utcnow()
+    with _pipeline_lock:
+        _pipeline_counts['deduplicated'] += 1
+
+def _finished_twin(result_key, exclude_id):
+    return db.session.execute(
+        db.select(UploadedFile)
+        .where(UploadedFile.result_key == result_key, UploadedFile.status == 'done', UploadedFile.id != exclude_id)
+        .limit(1)
+    ).scalar()
+
+def _queue_file(file_id, result_key, priority):
+    """Submit a file to the pipeline, unless identical content is already being processed here: then it
+    waits for that run and gets a copy of its result. Raises QueueFull."""
+    with _pipeline_lock:
+        if result_key in _pipeline_waiting:
+            _pipeline_waiting[result_key].append(file_id)
+            return
+        _pipeline_waiting[result_key] = []
+    try:
+        file_pipeline.submit(priority, _run_file, file_id, result_key)
+    except QueueFull:
+        with _pipeline_lock:
+            _pipeline_waiting.pop(result_key, None)
+        raise
+
+def _release_waiting(result_key, source):
+    """Hand the finished run's result to the files that were waiting on it (or re-queue them if it never ran)."""
+    with _pipeline_lock:
+        waiting = _pipeline_waiting.pop(result_key, [])
+    if not waiting:
+        return
+    if source is None:
+        unqueued = []
+        for file_id in waiting:
+            try:
+                _queue_file(file_id, result_key, 'normal')
+            except QueueFull:
+                unqueued.append(file_id)
+        if unqueued:
+            # Left queued without a lease: the next heartbeat, here or in another process, queues them again
+            db.session.execute(
+                db.update(UploadedFile)
+                .where(UploadedFile.id.in_(unqueued), UploadedFile.status == 'queued')
+                .values(lease_until=None)
+            )
+            db.session.commit()
+        return
+    for uf in UploadedFile.query.filter(UploadedFile.id.in_(waiting), UploadedFile.status == 'queued').all():
+        _copy_result(uf, source)
+    db.session.commit()
+
+def _run_file(file_id, result_key):
+    """Worker: run the pipeline for one uploaded file, committing after every stage."""
+    with app.app_context():
+        uf = db.session.get(UploadedFile, file_id)
+        if uf is None or uf.status not in FILE_ACTIVE:
+            _release_waiting(result_key, None)
+            return
+        # Another app process may have finished the same content since this file was queued
+        twin = _finished_twin(result_key, uf.id)
+        if twin is not None:
+            _copy_result(uf, twin)
+        else:
+            uf.status = 'processing'
+            uf.error = None
+            _leased(uf)
+            db.session.commit()
+            try:
+                uf.kind, stages = _pipeline_stages(blobs.local(uf.file_path), json.loads(uf.params or '{}'))
+                for stage, result in stages:
+                    uf.stage = stage
+                    uf.ai_response = json.dumps(result, ensure_ascii=False)
+                    db.session.commit()
+                uf.status = 'done'
+                uf.processed = True
+            except Exception as e:
+                db.session.rollback()
+                uf.error = str(e)[:500]
+                uf.status = 'failed'
+            uf.processed_at = datetime.utcnow()
+        db.session.commit()
+        _release_waiting(result_key, uf)
+
+def _resume_pending_files():
+    """Re-queue files left queued or processing by a process that is gone (their lease ran out)."""
+    resumed = 0
+    for file_id in db.session.execute(_stale(UploadedFile, FILE_ACTIVE)).scalars().all():
+        if not _claim(UploadedFile, file_id, FILE_ACTIVE):
+            continue
+        uf = db.session.get(UploadedFile, file_id)
+        try:
+            _queue_file(file_id, uf.result_key or f'file:{file_id}', json.loads(uf.params or '{}').get('priority', 'normal'))
+        except QueueFull:
+            uf.lease_until = None  # the rest stay queued for the next heartbeat, here or elsewhere
+            db.session.commit()
+            break
+        resumed += 1
+    return resumed
+
+def _text_field(data, key):
+    """Stripped string value of a JSON field, None when missing or empty. Numbers are accepted as text
+    ({"stage": 2} is stage '2')."""
+    value = data.get(key)
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value).strip() or None
+
 @app.route('/api/process/<int:file_id>', methods=['POST'])
 @jwt_required()
 def process_file(file_id):
+    """Queue an uploaded file for processing; poll GET /api/files/<id>. Optional JSON body: type
+    (sensor / statement / image, detected when omitted), prompt and crop for photos, stage ('1'-'3') to
+    verify a crop stage, priority (high / normal / low). Content processed before is answered at once."""
     current_user_id = get_jwt_identity()
     
     uploaded_file = UploadedFile.query.filter_by(id=file_id, user_id=current_user_id).first()
     
     if not uploaded_file:
         return jsonify({'error': 'File not found'}), 404
-    
-    # Get processing prompt from request
-    data = request.get_json()
-    prompt = data.get('prompt', 'Analyze this agricultural data and provide insights.')
-    
-    # TODO: Integrate with AI API (OpenAI, Gemini, etc.)
-    # This is where you'll call your AI service
-    ai_response = f"Processed file: {uploaded_file.original_filename}\nPrompt: {prompt}\n\nAI Response: This is a placeholder response. Integrate with actual AI API."
-    
-    # Update file record
-    uploaded_file.processed = True
-    uploaded_file.ai_response = ai_response
+    if uploaded_file.status in FILE_ACTIVE:
+        return jsonify(dict(_file_json(uploaded_file), status_url=f'/api/files/{file_id}')), 202
+    path = uploaded_file.file_path
+    if not blobs.exists(path):
+        return jsonify({'error': 'File content is no longer available'}), 410
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON body must be an object'}), 400
+    kind = (_text_field(data, 'type') or '').lower() or None
+    if kind is not None and kind not in PIPELINE_KINDS:
+        return jsonify({'error': f"type must be one of: {', '.join(PIPELINE_KINDS)}"}), 400
+    if kind is None and _is_image(path):
+        kind = 'image'
+    if kind != 'image' and os.path.splitext(path)[1].lower() not in SENSOR_EXTS:
+        return jsonify({'error': 'Unsupported file type. Use a photo, JSON, PDF, CSV, or Excel.'}), 400
+    priority = (_text_field(data, 'priority') or ('low' if kind == 'image' else 'normal')).lower()
+    if priority not in PRIORITIES:
+        return jsonify({'error': f"priority must be one of: {', '.join(PRIORITIES)}"}), 400
+    params = {'type': kind, 'priority': priority}
+    if kind == 'image':
+        params.update(prompt=_text_field(data, 'prompt'), crop=_text_field(data, 'crop'), stage=_text_field(data, 'stage'))
+
+    if not uploaded_file.content_hash:
+        uploaded_file.content_hash = blobs.digest_of(path) or file_sha256(blobs.local(path))
+    result_key = make_key('process', PIPELINE_VERSION, uploaded_file.content_hash, kind,
+                          normalize_text(params.get('prompt')), normalize_text(params.get('crop')), params.get('stage'))
+    if uploaded_file.status == 'done' and uploaded_file.result_key == result_key:
+        return jsonify(_file_json(uploaded_file)), 200
+    uploaded_file.result_key = result_key
+    uploaded_file.params = json.dumps(params)
+    twin = _finished_twin(result_key, uploaded_file.id)
+    if twin is not None:
+        _copy_result(uploaded_file, twin)
+        db.session.commit()
+        return jsonify(_file_json(uploaded_file)), 200
+
+    uploaded_file.status = 'queued'
+    uploaded_file.processed = False
+    uploaded_file.stage = uploaded_file.error = uploaded_file.ai_response = None
+    _leased(uploaded_file)
     db.session.commit()
-    
-    return jsonify({
-        'message': 'File processed successfully',
-        'response': ai_response
-    }), 200
+    try:
+        _queue_file(uploaded_file.id, result_key, priority)
+    except QueueFull:
+        uploaded_file.status = 'uploaded'
+        db.session.commit()
+        return jsonify({'error': 'Processing queue is full, try again shortly'}), 503
+    resp = jsonify(dict(_file_json(uploaded_file), status_url=f'/api/files/{file_id}'))
+    resp.headers['Location'] = f'/api/files/{file_id}'
+    return resp, 202
+
+@app.route('/api/files/<int:file_id>', methods=['GET'])
+@jwt_required()
+def get_user_file(file_id):
+    uploaded_file = UploadedFile.query.filter_by(id=file_id, user_id=get_jwt_identity()).first()
+    if not uploaded_file:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify(_file_json(uploaded_file)), 200
+
+@app.route('/api/files/<int:file_id>/content', methods=['GET'])
+@jwt_required()
+def get_user_file_content(file_id):
+    """The uploaded bytes, streamed from upload storage. A single 'Range: bytes=' gets a 206 with just
+    that span, so clients can resume downloads or preview the start of a large statement."""
+    uploaded_file = UploadedFile.query.filter_by(id=file_id, user_id=get_jwt_identity()).first()
+    if not uploaded_file:
+        return jsonify({'error': 'File not found'}), 404
+    path = uploaded_file.file_path
+    try:
+        size = blobs.size(path)
+    except FileNotFoundError:
+        return jsonify({'error': 'File content is no longer available'}), 410
+    start, end, status = 0, size - 1, 200
+    if request.range is not None and len(request.range.ranges) == 1:
+        span = request.range.range_for_length(size)
+        if span is None:
+            resp = jsonify({'error': 'Range not satisfiable'})
+            resp.headers['Content-Range'] = f'bytes */{size}'
+            return resp, 416
+        start, end, status = span[0], span[1] - 1, 206
+    resp = Response(blobs.stream(path, start, end), status=status, direct_passthrough=True,
+                    mimetype=mimetypes.guess_type(uploaded_file.original_filename)[0] or 'application/octet-stream')
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Content-Length'] = str(end - start + 1)
+    if status == 206:
+        resp.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    resp.headers.set('Content-Disposition', 'attachment', filename=uploaded_file.original_filename)
+    return resp
+
+# Columns /api/files can return; ai_response can be large, so it is only read when asked for (?fields=)
+FILE_FIELDS = {
+    'id': UploadedFile.id,
+    'filename': UploadedFile.original_filename,
+    'uploaded_at': UploadedFile.uploaded_at,
+    'processed': UploadedFile.processed,
+    'status': UploadedFile.status,
+    'kind': UploadedFile.kind,
+    'ai_response': UploadedFile.ai_response,
+}
+DEFAULT_FILE_FIELDS = ('id', 'filename', 'uploaded_at', 'processed', 'status')
+FILES_PAGE_MAX = 200
+
+def _encode_cursor(uploaded_at, file_id):
+    raw = json.dumps([uploaded_at.isoformat(), file_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor):
+    """(uploaded_at, id) of the last file on the previous page, or None when the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ts, file_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(file_id)
+    except (ValueError, TypeError):
+        return None
 
 @app.route('/api/files', methods=['GET'])
 @jwt_required()
 def get_user_files():
+    """Newest first, one page at a time: ?limit= (max 200), ?cursor= from the previous page's nextCursor,
+    ?fields=id,filename,uploaded_at,processed,status,kind,ai_response. Responses carry an ETag for conditional GETs."""
     current_user_id = get_jwt_identity()
-    
-    files = UploadedFile.query.filter_by(user_id=current_user_id).order_by(UploadedFile.uploaded_at.desc()).all()
-    
+    limit = max(1, min(FILES_PAGE_MAX, request.args.get('limit', 50, type=int)))
+    fields = [f.strip() for f in (request.args.get('fields') or '').split(',') if f.strip()] or list(DEFAULT_FILE_FIELDS)
+    unknown = [f for f in fields if f not in FILE_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}", 'fields': list(FILE_FIELDS)}), 400
+
+    query = db.select(UploadedFile.id, UploadedFile.uploaded_at, *[FILE_FIELDS[f] for f in fields]).where(
+        UploadedFile.user_id == current_user_id
+    )
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        # Keyset: continue strictly after the last (uploaded_at, id) seen; served by ix_uploaded_file_user_uploaded
+        query = query.where(db.tuple_(UploadedFile.uploaded_at, UploadedFile.id) < after)
+    rows = db.session.execute(
+        query.order_by(UploadedFile.uploaded_at.desc(), UploadedFile.id.desc()).limit(limit + 1)
+    ).all()
+
+    page = rows[:limit]
     files_data = []
-    for file in files:
-        files_data.append({
-            'id': file.id,
-            'filename': file.original_filename,
-            'uploaded_at': file.uploaded_at.isoformat(),
-            'processed': file.processed,
-            'ai_response': file.ai_response
-        })
-    
-    return jsonify({'files': files_data}), 200
+    for row in page:
+        item = dict(zip(fields, row[2:]))
+        if 'uploaded_at' in item and item['uploaded_at'] is not None:
+            item['uploaded_at'] = item['uploaded_at'].isoformat()
+        files_data.append(item)
+    next_cursor = _encode_cursor(page[-1][1], page[-1][0]) if len(rows) > limit else None
+
+    resp = jsonify({'files': files_data, 'nextCursor': next_cursor})
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 @app.route('/api/profile', methods=['GET'])
 @jwt_required()
@@ -1124,60 +1987,24 @@ def get_profile():
 
 
 # ---- Chatbot: Gemini with full Krishimitra knowledge; fallback when API unavailable ----
+CHAT_FAQ_DIRECT = os.getenv('CHAT_FAQ_DIRECT', '1').strip().lower() not in ('0', 'false', 'no')
+_GREETING = re.compile(r'\b(hi|hii+|hello|hey|namaste|namaskar)\b|नमस्ते|नमस्कार')
+
 def _chat_fallback(message):
     """When Gemini is unavailable, return a helpful reply so the chat never feels broken."""
     m = (message or '').strip().lower()
     if not m:
         return None
-    if any(w in m for w in ('hi', 'hello', 'hey', 'namaste')):
+    reply = knowledge.best_reply(m)
+    if reply:
+        return reply
+    if _GREETING.search(m):
         return (
             "Hello! I'm Krishimitra Support. You can ask about Trust Score, bank/sensor uploads, "
             "Crop Analysis, Weather Insurance, Vouchers, or Pay-as-you-Grow. Use the **Feedback** button above "
             "for complaints or ratings. Need to reach us? Check **Contact Us** in the sidebar — phone 083903 12345, "
             "toll-free 1800 123 4567, email support@krishimitra.in, WhatsApp +91 91234 56789. Helpline: Mon–Sat, 9 AM – 6 PM."
         )
-    if any(w in m for w in ('trust score', 'trustscore', 'score', 'eligib', 'loan')):
-        return (
-            "**Trust Score (0–100)** is built by completing: Profile, Bank Statement, Sensor Readings, "
-            "Crop Analysis, Financial Quiz, and Weather Insurance. Score 80+ unlocks loans, Vouchers, and Pay-as-you-Grow. "
-            "Complete tasks on the Home dashboard and click **Evaluate my score** to see your score."
-        )
-    if any(w in m for w in ('contact', 'phone', 'email', 'call', 'help', 'support', 'reach')):
-        return (
-            "**Contact Krishimitra:** Telephone 083903 12345, Mobile 091234 56789, Toll-free 1800 123 4567, "
-            "Email support@krishimitra.in, WhatsApp +91 91234 56789, Instagram @krishimitra. Helpline: Mon–Sat, 9 AM – 6 PM. "
-            "You can also use the **Feedback** button above to send a message."
-        )
-    if any(w in m for w in ('bank', 'statement', 'upload')):
-        return (
-            "Upload your **bank statement** (PDF, CSV, Excel, or JSON) from the Bank Statement page. "
-            "Active accounts can earn up to +20 Trust Score. Go to the sidebar → Bank Statement."
-        )
-    if any(w in m for w in ('sensor', 'soil', 'ph', 'moisture', 'nitrogen')):
-        return (
-            "Upload **sensor/field data** (JSON, CSV, Excel, or PDF) from Sensor Readings. "
-            "Include pH, moisture, and nitrogen for up to 30 Trust Score. Rainfall data is used for Weather Insurance."
-        )
-    if any(w in m for w in ('crop', 'photo', 'image', 'analysis')):
-        return (
-            "Use **Crop Analysis** (sidebar or Explore) to upload a crop photo. AI will analyse health, "
-            "diseases, and pests and suggest recommendations. You can also attach an image in this chat for quick analysis."
-        )
-    if any(w in m for w in ('weather', 'rain', 'insurance')):
-        return (
-            "**Weather Insurance** gives automatic payouts when rainfall in your area is below a threshold. "
-            "Upload sensor data with rainfall first, then check the Weather Insurance page. Uses data from your Sensor Readings."
-        )
-    if any(w in m for w in ('voucher', 'pay-as-you-grow', 'milestone')):
-        return (
-            "**Vouchers** (QR/PIN) and **Pay-as-you-Grow** (funds in stages: Seeds → Labor → Harvest) unlock when your Trust Score is 80+. "
-            "Complete the dashboard tasks and evaluate your score to qualify."
-        )
-    if any(w in m for w in ('feedback', 'complaint', 'rating')):
-        return (
-            "Use the **Feedback** button at the top of this chat to send general feedback, a complaint, or a star rating. "
-            "Our team will get back to you."
-        )
     # Default: friendly prompt to try Feedback or contact
     return (
         "I'm here for Krishimitra support. Try asking about **Trust Score**, **contact details**, **bank/sensor uploads**, "
@@ -1195,17 +2022,81 @@ def chat():
     history = data.get('history')
     if not isinstance(history, list):
         history = []
+    # FAQ-style questions are answered from the local knowledge index without a model call
+    hit = knowledge.answer(message) if CHAT_FAQ_DIRECT else None
+    if hit:
+        return jsonify({'reply': hit['reply'], 'source': 'faq', 'section': hit['section']})
+    # Only opening questions are cached: later turns depend on the conversation so far
+    language = (data.get('language') or 'en').strip()[:8]
+    if not history:
+        cached, tier = chat_responses.get(message, language)
+        if cached:
+            return jsonify({'reply': cached, 'source': 'cache', 'cacheTier': tier})
     key = (os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip()
     if not key:
         reply = _chat_fallback(message)
         return jsonify({'reply': reply or 'Please use the Feedback button above or contact support@krishimitra.in. Helpline: Mon–Sat, 9 AM – 6 PM.'})
-    reply, err = _chat_with_gemini_rest(message, history)
+    reply, err, usage = _chat_with_gemini_rest(message, history)
     if reply:
-        return jsonify({'reply': reply})
+        if not history:
+            chat_responses.set(message, language, reply)
+        return jsonify({'reply': reply, 'usage': usage})
     fallback = _chat_fallback(message)
     return jsonify({'reply': fallback or 'Something went wrong. Use the Feedback button above or email support@krishimitra.in. We\'ll get back to you.'})
 
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same request as /api/chat, answered as Server-Sent Events: 'token' events with {"text"} as the
+    model generates, then one 'done' event with the full {"reply"}. Falls back to the canned replies
+    if Gemini is unavailable before the first token."""
+    data = request.get_json() or {}
+    message = (data.get('message') or '').strip()
+    if not message:
+        return jsonify({'error': 'Message is required'}), 400
+    history = data.get('history')
+    if not isinstance(history, list):
+        history = []
+    key = (os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or '').strip()
+    hit = knowledge.answer(message) if CHAT_FAQ_DIRECT else None
+    language = (data.get('language') or 'en').strip()[:8]
+    cached, tier = chat_responses.get(message, language) if not (hit or history) else (None, None)
+
+    def generate():
+        if hit:
+            yield _sse('done', {'reply': hit['reply'], 'source': 'faq', 'section': hit['section']})
+            return
+        if cached:
+            yield _sse('done', {'reply': cached, 'source': 'cache', 'cacheTier': tier})
+            return
+        parts = []
+        usage = {}
+        if key:
+            try:
+                for text in _stream_chat_with_gemini(message, history, usage):
+                    parts.append(text)
+                    yield _sse('token', {'text': text})
+            except Exception:
+                pass  # keep whatever already streamed; fall back only if nothing did
+        if parts:
+            reply = ''.join(parts).strip()
+            if not history and usage:  # usage is only filled in when the stream completed
+                chat_responses.set(message, language, reply)
+            yield _sse('done', {'reply': reply, 'usage': usage or None})
+            return
+        reply = _chat_fallback(message) or 'Please use the Feedback button above or contact support@krishimitra.in. Helpline: Mon–Sat, 9 AM – 6 PM.'
+        yield _sse('token', {'text': reply})
+        yield _sse('done', {'reply': reply, 'fallback': True})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx: flush each event instead of buffering the response
+    })
+
+
 @app.route('/api/feedback', methods=['POST'])
 def feedback():
     data = request.get_json() or {}
@@ -1224,7 +2115,92 @@ def feedback():
     return jsonify({'success': True, 'id': entry.id})
 
 
-if __name__ == '__main__':
+# Heavy modules the upload parsers load on first use. A preforking server (gunicorn preload_app) warms
+# them in create_app so they are imported once, before fork, and the workers share the pages.
+WARM_MODULES = ('numpy', 'openpyxl', ('pypdf', 'PyPDF2'), 'PIL.Image', 'PIL.ImageOps', 'statement_analytics',
+                'pdf_statement')
+_started = False
+
+# Indexes superseded by a later one (dropped by _migrate_schema)
+RETIRED_INDEXES = {'sensor_sample': ('ix_sensor_sample_farm_metric_ts',)}
+
+def _rebuild_sensor_aggregates():
+    """Recompute rollups and rainfall windows from the stored samples, farm by farm (after duplicate
+    samples were removed, the running totals built from them are too high)."""
+    db.session.execute(db.delete(SensorRollup))
+    db.session.execute(db.delete(RainfallWindow))
+    for farm_id in db.session.execute(db.select(SensorSample.farm_id).distinct()).scalars().all():
+        samples = db.session.execute(
+            db.select(SensorSample.metric, SensorSample.ts, SensorSample.value).where(SensorSample.farm_id == farm_id)
+        ).all()
+        rollups = [{'farm_id': farm_id, 'metric': k[0], 'resolution': k[1], 'bucket': k[2], 'count': a[0],
+                    'total': a[1], 'min_value': a[2], 'max_value': a[3]} for k, a in rollup_batch(samples).items()]
+        if rollups:
+            db.session.execute(db.insert(SensorRollup), rollups)
+        windows = [{'farm_id': farm_id, 'season': season, 'season_year': year, 'total_mm': total, 'readings': n,
+                    'first_ts': first_ts, 'last_ts': last_ts}
+                   for (season, year), (n, total, first_ts, last_ts) in rainfall_windows(samples).items()]
+        if windows:
+            db.session.execute(db.insert(RainfallWindow), windows)
+    db.session.commit()
+
+def _migrate_schema():
+    """Additive schema changes for databases created by an older version: create_all only creates
+    missing tables, so columns and indexes added to existing models are created here. Safe to run on
+    every start."""
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        # New columns are nullable, so a plain ADD COLUMN works on SQLite and Postgres alike
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} '
+                                         f'{column.type.compile(db.engine.dialect)}'))
+                created.append(f'{table.name}.{column.name}')
+        present = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                if index.unique:
+                    # Rows stored before the key was unique: keep the first of each duplicate
+                    cols = ', '.join(quote(c.name) for c in index.columns)
+                    with db.engine.begin() as conn:
+                        removed = conn.execute(db.text(
+                            f'DELETE FROM {quote(table.name)} WHERE id NOT IN '
+                            f'(SELECT keep FROM (SELECT MIN(id) AS keep FROM {quote(table.name)} GROUP BY {cols}) AS firsts)'
+                        )).rowcount
+                    if removed and table.name == 'sensor_sample':
+                        _rebuild_sensor_aggregates()
+                        created.append('rebuilt sensor rollups and rainfall windows')
+                index.create(db.engine)
+                created.append(index.name)
+        for name in RETIRED_INDEXES.get(table.name, ()):
+            if name in present:
+                on_table = f' ON {quote(table.name)}' if db.engine.dialect.name == 'mysql' else ''
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'DROP INDEX {quote(name)}{on_table}'))
+    return created
+
+def create_app(resume_jobs=True, warm=False):
+    """Start-up work for every entry point (dev server, wsgi.py, serve_async.py): tables, optionally warm
+    imports and, unless a process manager does it per worker, resuming unfinished jobs and files."""
+    global _started
     with app.app_context():
+        _migrate_schema()
         db.create_all()
+        if resume_jobs:
+            resume_background_work()
+    if warm:
+        lazy_imports.preload(WARM_MODULES)
+    _started = True
+    return app
+
+
+if __name__ == '__main__':
+    create_app()
     app.run(debug=True, port=5000)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Start-up profile of the API. Imports the app in fresh interpreters and reports the median time to
+import it and to answer the first request, plus the slowest imports (python -X importtime).
+
+Run: python bench_imports.py [--runs 5] [--top 15] [--warm]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COLD_START = '''
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app(resume_jobs=False, warm={warm})
+t2 = time.perf_counter()
+app.app.test_client().get('/healthz/ready')
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t0, t3 - t0)
+'''
+
+
+def _run(args, env):
+    return subprocess.run([sys.executable] + args, cwd=HERE, env=env, capture_output=True, text=True, check=True)
+
+
+def cold_starts(runs, warm, env):
+    samples = []
+    for _ in range(runs):
+        out = _run(['-c', COLD_START.format(warm=warm)], env).stdout.split()
+        samples.append([float(v) for v in out[-3:]])
+    return [statistics.median(col) for col in zip(*samples)]
+
+
+def slowest_imports(top, env):
+    """[(cumulative ms, self ms, module)] for modules imported directly or one level below app."""
+    stderr = _run(['-X', 'importtime', '-c', 'import app'], env).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 2:
+            rows.append((int(cum_us) / 1000, int(self_us) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--warm', action='store_true', help='also preload the heavy parsers (as wsgi.py does)')
+    args = parser.parse_args()
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')  # in-memory: measure imports, not disk
+
+    imported, started, first = cold_starts(args.runs, args.warm, env)
+    print(f'median of {args.runs} cold starts ({"warm" if args.warm else "lazy"} imports)')
+    print(f'  import app         {imported * 1000:8.1f} ms')
+    print(f'  create_app         {started * 1000:8.1f} ms')
+    print(f'  first request      {first * 1000:8.1f} ms')
+    print('\nslowest imports (cumulative / self ms)')
+    for cum, own, name in slowest_imports(args.top, env):
+        print(f'  {cum:8.1f} {own:8.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
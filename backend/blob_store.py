@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for uploads. A file is hashed while it is written, then kept once under its
+SHA-256 (blobs/ab/cd/<sha256><ext>), so the same photo, statement or report uploaded again takes no
+more space and later steps get the hash without reading the file again. The bytes live in a storage
+backend (storage.py); parsers open the local copy at uploads/blobs/..., which on a remote backend is
+only a cache. Blobs no longer referenced by any row are removed by sweep() once they are older than
+the retention period.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+
+from storage import iter_file, iter_stream
+
+_BLOB_NAME = re.compile(r'^([0-9a-f]{64})(\.[0-9a-z]{1,10})?$')
+
+
+def clean_ext(ext):
+    """Lowercase extension safe to use in a file name ('' when it is not)."""
+    ext = (ext or '').lower()
+    return ext if re.fullmatch(r'\.[0-9a-z]{1,10}', ext) else ''
+
+
+class BlobStore:
+    def __init__(self, storage, prefix='blobs'):
+        self.storage = storage
+        self.prefix = prefix
+        self.root = os.path.join(storage.local_root, prefix)
+        self.tmp = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+        self._lock = threading.Lock()
+        self._saved = 0
+        self._deduplicated = 0
+        self._bytes_saved = 0
+        self._last_sweep = None
+
+    def key_for(self, digest, ext=''):
+        return f'{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{clean_ext(ext)}'
+
+    def path_for(self, digest, ext=''):
+        return self.storage.local_path(self.key_for(digest, ext))
+
+    def key_of(self, path):
+        """Storage key for a blob's local path, or None for paths outside the store (older uploads)."""
+        match = _BLOB_NAME.match(os.path.basename(path or ''))
+        if not match:
+            return None
+        key = self.key_for(match.group(1), match.group(2))
+        if os.path.abspath(path) != os.path.abspath(self.storage.local_path(key)):
+            return None
+        return key
+
+    def digest_of(self, path):
+        """SHA-256 encoded in a blob's file name, or None for paths outside the store."""
+        return os.path.basename(path)[:64] if self.key_of(path) else None
+
+    def save_chunks(self, chunks, ext=''):
+        """Spool chunks to a local file, hashing as they are written, then commit the blob.
+        Returns (path, digest, size)."""
+        tmp_path = os.path.join(self.tmp, uuid.uuid4().hex)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in chunks:
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            return self._commit(tmp_path, h.hexdigest(), size, ext)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save_stream(self, stream, ext=''):
+        return self.save_chunks(iter_stream(stream), ext)
+
+    def save_file(self, storage, ext=None):
+        """Store a werkzeug FileStorage (request.files[...])."""
+        if ext is None:
+            ext = os.path.splitext(storage.filename or '')[1]
+        return self.save_stream(storage.stream, ext)
+
+    def adopt(self, path, ext=None):
+        """Move a file already on disk (an unzipped report) into the store."""
+        if ext is None:
+            ext = os.path.splitext(path)[1]
+        h = hashlib.sha256()
+        size = 0
+        for chunk in iter_file(path):
+            h.update(chunk)
+            size += len(chunk)
+        try:
+            return self._commit(path, h.hexdigest(), size, ext)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _commit(self, src, digest, size, ext):
+        key = self.key_for(digest, ext)
+        path = self.storage.local_path(key)
+        if self.storage.exists(key):
+            self.storage.touch(key)  # a re-upload restarts the retention clock
+            with self._lock:
+                self._deduplicated += 1
+                self._bytes_saved += size
+        else:
+            if self.storage.remote:
+                self.storage.put_file(key, src)
+            with self._lock:
+                self._saved += 1
+        if not os.path.exists(path):
+            # The blob itself on local storage; this node's cached copy on a remote backend
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src, path)
+        return path, digest, size
+
+    def local(self, path):
+        """A path parsers can open: fetched from the backend when this node has no copy yet."""
+        key = self.key_of(path)
+        if key is None or os.path.exists(path):
+            return path
+        return self.storage.fetch(key)
+
+    def exists(self, path):
+        if os.path.exists(path):
+            return True
+        key = self.key_of(path)
+        return key is not None and self.storage.exists(key)
+
+    def size(self, path):
+        key = self.key_of(path)
+        if key is None or os.path.exists(path):
+            return os.path.getsize(path)
+        return self.storage.stat(key)[0]
+
+    def stream(self, path, start=0, end=None):
+        """Bytes start..end (inclusive) from the local copy, or a ranged read from the backend."""
+        key = self.key_of(path)
+        if key is None or os.path.exists(path):
+            return iter_file(path, start, end)
+        return self.storage.stream(key, start, end)
+
+    def read_range(self, path, start=0, end=None):
+        return b''.join(self.stream(path, start, end))
+
+    def sweep(self, refcounts, retention, companions=None, batch=500):
+        """Delete blobs older than retention seconds that no row references. refcounts(paths) returns
+        {path: count} for the paths still in use; companions(path) lists derived files to remove with a
+        blob. Abandoned spool files go after the same period, and on a remote backend so do local
+        copies nobody has used for that long (they are fetched again on demand)."""
+        cutoff = time.time() - retention
+        removed = freed = kept = 0
+        candidates = []
+
+        def flush():
+            nonlocal removed, freed, kept
+            if not candidates:
+                return
+            counts = refcounts([path for path, _ in candidates])
+            for path, key in candidates:
+                try:
+                    # Re-check: an upload may have matched this blob since it was listed
+                    size, mtime = self.storage.stat(key)
+                except FileNotFoundError:
+                    continue
+                if counts.get(path) or mtime > cutoff:
+                    kept += 1
+                    continue
+                self.storage.delete(key)
+                if os.path.exists(path):
+                    os.remove(path)
+                removed += 1
+                freed += size
+                for extra in (companions(path) if companions else ()):
+                    if os.path.exists(extra):
+                        os.remove(extra)
+            candidates.clear()
+
+        for key, _, mtime in self.storage.list(self.prefix + '/'):
+            if mtime > cutoff:
+                continue
+            path = self.storage.local_path(key)
+            if self.key_of(path) != key:
+                continue  # spool and derived files
+            candidates.append((path, key))
+            if len(candidates) >= batch:
+                flush()
+        flush()
+
+        local_files = [os.path.join(self.tmp, name) for name in os.listdir(self.tmp)]
+        if self.storage.remote:
+            tmp = os.path.abspath(self.tmp)
+            local_files += [os.path.join(folder, name) for folder, _, names in os.walk(self.root)
+                            if os.path.abspath(folder) != tmp for name in names]
+        evicted = 0
+        for path in local_files:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    evicted += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._last_sweep = {'at': time.time(), 'removed': removed, 'freedBytes': freed, 'kept': kept,
+                                'localFilesRemoved': evicted}
+        return self._last_sweep
+
+    def stats(self):
+        with self._lock:
+            return dict(self.storage.stats(), saved=self._saved, deduplicated=self._deduplicated,
+                        bytesSaved=self._bytes_saved, lastSweep=self._last_sweep)
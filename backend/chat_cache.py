@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache for first-turn chatbot questions. Replies are stored in a ResultCache (shared by workers,
+LRU/TTL) under the normalized question, the UI language and a hash of the knowledge base, so editing
+KRISHIMITRA_KNOWLEDGE retires every old reply. A lexical similarity tier matches rephrasings of
+questions that were already answered.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from chat_context import content_hash
+from knowledge_index import tokenize
+from result_cache import make_key
+
+_PUNCT = re.compile('[^0-9a-z\u0900-\u0963\u0966-\u097f]+')
+# Question words reduced to their intent and kept as terms, so 'why is my score low' does not match
+# 'how is my score low' while 'what'/'which'/'kya' phrasings still do
+QUESTION_WORDS = {}
+for intent, words in (
+    ('what', 'what which kya kaunsa क्या कौनसा काय कोणता'),
+    ('why', 'why kyon kyu क्यों'),
+    ('how', 'how kaise कैसे कसे कसा'),
+    ('when', 'when kab कब केव्हा'),
+    ('where', 'where kahan कहाँ कहां कुठे'),
+    ('who', 'who whom kaun कौन कोण'),
+):
+    QUESTION_WORDS.update(dict.fromkeys(words.split(), '?' + intent))
+
+
+def normalize_question(message):
+    """Lowercase, punctuation dropped, whitespace collapsed: 'What is Trust Score??' -> 'what is trust score'."""
+    return ' '.join(_PUNCT.sub(' ', (message or '').lower()).split())
+
+
+def question_terms(message):
+    intents = {QUESTION_WORDS[w] for w in normalize_question(message).split() if w in QUESTION_WORDS}
+    return frozenset(tokenize(message)) | frozenset(intents)
+
+
+class ChatResponseCache:
+    """Exact lookups go straight to the store; the similarity index covers questions answered by this
+    process and only points at store keys, so the store's TTL and LRU eviction apply to both tiers."""
+
+    def __init__(self, store, knowledge_text, similarity=0.8, max_indexed=5000):
+        self.store = store
+        self.version = content_hash(knowledge_text)[:16]
+        self.similarity = similarity
+        self.max_indexed = max_indexed
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._index = OrderedDict()  # key -> (language, terms) of answered questions, oldest first
+        self._postings = {}  # term -> set of keys
+        self._lock = threading.Lock()
+
+    def key(self, message, language):
+        return make_key('chat', self.version, (language or 'en').lower(), normalize_question(message))
+
+    def _similar_key(self, terms, language):
+        """Key of the most similar answered question (Jaccard over question terms), or None."""
+        if not terms:
+            return None
+        best, best_score = None, self.similarity
+        with self._lock:
+            candidates = set()
+            for term in terms:
+                candidates |= self._postings.get(term, set())
+            for key in candidates:
+                lang, other = self._index[key]
+                if lang != language:
+                    continue
+                score = len(terms & other) / len(terms | other)
+                if score >= best_score:
+                    best, best_score = key, score
+        return best
+
+    def _index_add(self, key, terms, language):
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+                return
+            self._index[key] = (language, terms)
+            for term in terms:
+                self._postings.setdefault(term, set()).add(key)
+            while len(self._index) > self.max_indexed:
+                self._index_drop(next(iter(self._index)))
+
+    def _index_drop(self, key):
+        _, terms = self._index.pop(key)
+        for term in terms:
+            keys = self._postings.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[term]
+
+    def get(self, message, language=None):
+        """(reply, 'exact' | 'similar') for a question answered before, or (None, None)."""
+        language = (language or 'en').lower()
+        reply = self.store.get(self.key(message, language))
+        if reply is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return reply, 'exact'
+        if self.similarity:
+            key = self._similar_key(question_terms(message), language)
+            if key is not None:
+                reply = self.store.get(key)
+                if reply is not None:
+                    with self._lock:
+                        self.similar_hits += 1
+                    return reply, 'similar'
+                with self._lock:
+                    if key in self._index:
+                        self._index_drop(key)  # expired or evicted from the store
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def set(self, message, language, reply):
+        language = (language or 'en').lower()
+        key = self.key(message, language)
+        self.store.set(key, reply)
+        self._index_add(key, question_terms(message), language)
+        with self._lock:
+            self.stored += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            out = {
+                'exactHits': self.exact_hits,
+                'similarHits': self.similar_hits,
+                'misses': self.misses,
+                'hitRate': round(hits / lookups, 3) if lookups else 0.0,
+                'stored': self.stored,
+                'indexed': len(self._index),
+                'knowledgeVersion': self.version,
+            }
+        store = self.store.stats()
+        out.update(entries=store['entries'], maxEntries=store['maxEntries'], ttlSeconds=store['ttlSeconds'])
+        return out
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Context management for the support chat: the static knowledge base is uploaded once as Gemini
+cached content (or a local stand-in), long histories are trimmed to a token budget with older turns
+condensed into a short summary, and token usage is accounted per request.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from http_client import client
+from result_cache import MemoryCache
+
+GEMINI_API = 'https://generativelanguage.googleapis.com/v1beta'
+CHARS_PER_TOKEN = 4  # rough estimate for English/Hinglish text; only used for budgeting
+SUMMARY_TOKENS = 200
+
+CHAT_CONTEXT_CACHE = (os.getenv('CHAT_CONTEXT_CACHE') or 'gemini').strip().lower()  # gemini, local or off
+CHAT_CONTEXT_TTL = int(os.getenv('CHAT_CONTEXT_TTL', 3600))
+CHAT_HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', 1500))
+
+
+def estimate_tokens(text):
+    return (len(text or '') + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _clip(text, limit):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+def trim_history(history, budget_tokens):
+    """Most recent turns that fit in budget_tokens, oldest first. Turns that do not fit are condensed
+    into one leading summary turn (what the farmer asked earlier), so context is kept without resending it."""
+    turns = []
+    for msg in history or []:
+        content = (msg.get('content') or '').strip() if isinstance(msg, dict) else ''
+        if content:
+            turns.append({'role': (msg.get('role') or '').strip().lower(), 'content': content})
+    kept = []
+    used = 0
+    for msg in reversed(turns):
+        cost = estimate_tokens(msg['content'])
+        if used + cost > budget_tokens:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    dropped = turns[:len(turns) - len(kept)]
+    if not dropped:
+        return kept
+    asked = [_clip(m['content'], 120) for m in dropped if m['role'] != 'assistant']
+    summary = _clip('Earlier in this conversation the user asked: ' + ' | '.join(asked), SUMMARY_TOKENS * CHARS_PER_TOKEN)
+    return [{'role': 'user', 'content': summary}] + kept
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class GeminiContextCache:
+    """Uploads a system instruction once as Gemini cachedContents and hands out its name until shortly
+    before it expires. Creation failures (e.g. content below the provider's minimum size) are remembered
+    for a while so chat requests simply send the instruction inline."""
+
+    provider_side = True
+
+    def __init__(self, api_key_fn, ttl=3600, retry_after=600, timeout=(3.05, 20), http=None):
+        self.api_key_fn = api_key_fn
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self.created = 0
+        self.failures = 0
+        self._names = MemoryCache(max_entries=16)
+        self._failed_until = {}
+        self.http = http or client
+
+    def _key(self, model, text):
+        return f'{model}:{content_hash(text)}'
+
+    def _create(self, model, text):
+        r = self.http.post(f'{GEMINI_API}/cachedContents', params={'key': self.api_key_fn()}, json={
+            'model': f'models/{model}',
+            'systemInstruction': {'parts': [{'text': text}]},
+            'ttl': f'{self.ttl}s',
+        }, timeout=self.timeout)
+        r.raise_for_status()
+        self.created += 1
+        return r.json()['name']
+
+    def get(self, model, text):
+        """Cached content name for (model, text), or None when it cannot be used right now."""
+        key = self._key(model, text)
+        if self._failed_until.get(key, 0) > time.time():
+            return None
+        try:
+            # Refresh a few minutes early so a request never references an expired cache
+            return self._names.get_or_load(key, lambda: self._create(model, text), ttl=max(60, self.ttl - 300))
+        except Exception:
+            self.failures += 1
+            self._failed_until[key] = time.time() + self.retry_after
+            return None
+
+    def invalidate(self, model, text):
+        self._names.delete(self._key(model, text))
+
+    def stats(self):
+        return {'mode': 'gemini', 'created': self.created, 'failures': self.failures, **self._names.stats()}
+
+
+class LocalContextCache(GeminiContextCache):
+    """Stand-in for local development and tests: same naming, TTL and invalidation behaviour, no provider
+    calls. Names are not known to Gemini, so requests still carry the instruction inline."""
+
+    provider_side = False
+
+    def _create(self, model, text):
+        self.created += 1
+        return f'local/{content_hash(text)[:16]}'
+
+    def stats(self):
+        return dict(super().stats(), mode='local')
+
+
+class TokenLedger:
+    """Running token totals across chat requests (provider counts when available, estimates otherwise)."""
+
+    FIELDS = ('promptTokenCount', 'cachedContentTokenCount', 'candidatesTokenCount', 'totalTokenCount')
+
+    def __init__(self):
+        self.requests = 0
+        self.estimated_prompt_tokens = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, usage, estimated_prompt_tokens):
+        """Add one request; returns the per-request usage dict that is sent back to the client."""
+        usage = usage or {}
+        out = {k: int(usage.get(k) or 0) for k in self.FIELDS}
+        out['estimatedPromptTokens'] = estimated_prompt_tokens
+        with self._lock:
+            self.requests += 1
+            self.estimated_prompt_tokens += estimated_prompt_tokens
+            for k in self.FIELDS:
+                self.totals[k] += out[k]
+        return out
+
+    def stats(self):
+        with self._lock:
+            n = self.requests
+            return {
+                'requests': n,
+                'estimatedPromptTokens': self.estimated_prompt_tokens,
+                **self.totals,
+                'avgPromptTokens': round(self.totals['promptTokenCount'] / n, 1) if n else 0.0,
+            }
+
+
+def make_context_cache(mode, api_key_fn, ttl):
+    """'gemini' (provider cached content), 'local' (stand-in) or 'off'."""
+    if mode == 'gemini':
+        return GeminiContextCache(api_key_fn, ttl=ttl)
+    if mode == 'local':
+        return LocalContextCache(api_key_fn, ttl=ttl)
+    return None
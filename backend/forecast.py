@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Open-Meteo forecasts shared by nearby farms. Requests are bucketed into lat/lon grid cells,
+cached in memory until the next hourly model update, and concurrent requests for the same
+cell wait on a single upstream fetch.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+
+from http_client import client
+from result_cache import MemoryCache
+
+FORECAST_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+HOURLY_VARS = 'temperature_2m,precipitation,wind_speed_10m'
+UPDATE_INTERVAL = 3600  # Open-Meteo refreshes its forecast hourly
+UPDATE_DELAY = 300  # allow a few minutes after the hour for the new run to be published
+
+
+def seconds_until_next_update(now=None):
+    now = time.time() if now is None else now
+    next_update = (int(now) // UPDATE_INTERVAL + 1) * UPDATE_INTERVAL + UPDATE_DELAY
+    if next_update - now > UPDATE_INTERVAL:
+        next_update -= UPDATE_INTERVAL  # still before this hour's publish time
+    return max(60, int(next_update - now))
+
+
+class ForecastService:
+    def __init__(self, grid_step=0.1, max_cells=10000, timeout=(3.05, 15), http=None):
+        self.grid_step = grid_step
+        self.timeout = timeout
+        self.cache = MemoryCache(max_entries=max_cells)
+        self.upstream_calls = 0
+        self.http = http or client
+
+    def cell(self, lat, lon):
+        """Centre of the grid cell containing (lat, lon); 0.1 deg is roughly 11 km."""
+        step = self.grid_step
+        return round(round(lat / step) * step, 4), round(round(lon / step) * step, 4)
+
+    def _fetch(self, lat, lon):
+        self.upstream_calls += 1
+        r = self.http.get(FORECAST_URL, params={
+            'latitude': lat,
+            'longitude': lon,
+            'current_weather': 'true',
+            'hourly': HOURLY_VARS,
+        }, timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        return {'current': data.get('current_weather') or {}, 'hourly': data.get('hourly') or {}}
+
+    def get(self, lat, lon):
+        """(forecast dict, (cell_lat, cell_lon)). Raises requests exceptions when the upstream fetch fails."""
+        c_lat, c_lon = self.cell(lat, lon)
+        data = self.cache.get_or_load(
+            f'{c_lat},{c_lon}', lambda: self._fetch(c_lat, c_lon), lambda _: seconds_until_next_update()
+        )
+        return data, (c_lat, c_lon)
+
+    def stats(self):
+        return dict(self.cache.stats(), upstreamCalls=self.upstream_calls, gridStep=self.grid_step)
+
+
+def trim_hourly(hourly, hours, now=None):
+    """Only the next `hours` entries of each hourly array, starting at the current (UTC) hour."""
+    now = now or datetime.now(timezone.utc)
+    current_hour = now.strftime('%Y-%m-%dT%H:00')
+    times = hourly.get('time') or []
+    start = next((i for i, t in enumerate(times) if t >= current_hour), len(times))
+    return {k: (v[start:start + hours] if isinstance(v, list) else v) for k, v in hourly.items()}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Address -> (lat, lon) via Nominatim, with a persistent cache so repeat village addresses never
+hit the network. Follows the Nominatim usage policy: identifying User-Agent, at most one request
+per second from all workers together, and results cached locally. A lookup that would have to wait
+more than a few seconds for its turn raises GeocoderBusy instead of holding the request.
+"""
+
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+
+import requests
+
+from http_client import client
+
+NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+USER_AGENT = os.getenv('NOMINATIM_USER_AGENT', 'krishimitra-app/1.0 (support@krishimitra.in)')
+HIT_TTL = 90 * 24 * 3600
+MISS_TTL = 24 * 3600  # "no such place" answers are cached too, but retried daily
+
+_PUNCT = re.compile(r'[^\w,]+')
+
+
+def normalize_address(address):
+    """'  Nashik,  Maharashtra. ' and 'nashik, maharashtra' share one cache entry."""
+    s = unicodedata.normalize('NFKC', str(address or '')).casefold()
+    s = _PUNCT.sub(' ', s)
+    parts = [' '.join(p.split()) for p in s.split(',')]
+    return ', '.join(p for p in parts if p)
+
+
+class GeocoderBusy(Exception):
+    """Every request slot for the next max_wait seconds is taken; try again shortly."""
+
+
+class RateLimiter:
+    """Keeps calls at least min_interval seconds apart across every process that shares the SQLite
+    file (the workers' cache DB). A caller reserves the next free slot in one short write transaction
+    and sleeps until it; when that slot is more than max_wait away, acquire() returns False at once."""
+
+    def __init__(self, path, name, min_interval, max_wait=3.0):
+        self.path = path
+        self.name = name
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self.rejected = 0
+        with sqlite3.connect(path, timeout=10) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY, next_at REAL NOT NULL)')
+
+    def acquire(self):
+        conn = sqlite3.connect(self.path, timeout=self.max_wait, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT next_at FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+            now = time.time()
+            start = max(now, row[0] if row else 0.0)
+            if start - now > self.max_wait:
+                conn.execute('ROLLBACK')
+                self.rejected += 1
+                return False
+            conn.execute('INSERT OR REPLACE INTO rate_limits (name, next_at) VALUES (?, ?)',
+                         (self.name, start + self.min_interval))
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError:
+            self.rejected += 1  # the lock itself stayed busy for max_wait
+            return False
+        finally:
+            conn.close()
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+
+class Geocoder:
+    def __init__(self, cache, min_interval=1.0, max_wait=3.0, timeout=(3.05, 10), http=None):
+        self.cache = cache
+        self.timeout = timeout
+        self.limiter = RateLimiter(cache.path, 'nominatim', min_interval, max_wait)
+        self.network_calls = 0
+        self.http = http or client
+
+    def lookup(self, address):
+        """(lat, lon) floats, or (None, None) when the address is unknown or the service is unreachable.
+        Raises GeocoderBusy when no request slot is free within max_wait (nothing is cached)."""
+        key = normalize_address(address)
+        if not key:
+            return None, None
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.get('lat'), cached.get('lon')
+        if not self.limiter.acquire():
+            raise GeocoderBusy('geocoding is busy, try again shortly')
+        self.network_calls += 1
+        try:
+            r = self.http.get(NOMINATIM_URL, params={'q': str(address).strip(), 'format': 'json', 'limit': 1},
+                              headers={'User-Agent': USER_AGENT}, timeout=self.timeout)
+            r.raise_for_status()
+            j = r.json()
+        except (requests.exceptions.RequestException, ValueError):
+            return None, None  # transient: not cached
+        if isinstance(j, list) and j:
+            try:
+                lat, lon = float(j[0]['lat']), float(j[0]['lon'])
+            except (KeyError, TypeError, ValueError):
+                lat, lon = None, None
+        else:
+            lat, lon = None, None
+        self.cache.set(key, {'lat': lat, 'lon': lon}, ttl=HIT_TTL if lat is not None else MISS_TTL)
+        return lat, lon
+
+    def stats(self):
+        return dict(self.cache.stats(), networkCalls=self.network_calls, throttled=self.limiter.rejected)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Production launcher settings: gunicorn -c gunicorn.conf.py wsgi:app
+The app and its heavy parsers are loaded once in the master (preload_app) and shared copy-on-write by
+the forked workers. GUNICORN_WORKER_CLASS=gevent gives cooperative upstream I/O (see serve_async.py).
+"""
+
+import multiprocessing
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Must happen before the app (and ssl) is imported by preload_app
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('ASYNC_MAX_CONNECTIONS', 1000))  # gevent only
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))  # synchronous crop analysis can wait ~60s on a model
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers to bound memory growth; work a recycled worker still held is picked up by the
+# others once its lease (WORK_LEASE_SECONDS) runs out
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master during create_app must not be shared with the children
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Every worker, including ones started to replace a recycled worker, claims queued/running jobs and
+    # files whose lease has run out and keeps its own leases alive (app.resume_background_work)
+    from app import app, resume_background_work
+    with app.app_context():
+        jobs, files = resume_background_work()
+    if jobs or files:
+        worker.log.info('Resumed %d analysis jobs and %d queued files', jobs, files)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Hedged calls across interchangeable AI providers. The primary provider starts first; if it has not
+answered by its own latency percentile (or it fails), the next healthy provider is started and the
+first valid result wins. Each provider has a circuit breaker and a latency histogram.
+"""
+
+import bisect
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Histogram bucket upper bounds in seconds; the last bucket catches everything slower
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 12, 20, 30, 45, 60)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.total += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None until there are samples)."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = q * self.total
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) else self.buckets[-1] * 2
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+        labels = [f'le{b:g}s' for b in self.buckets] + ['inf']
+        return {
+            'count': self.total,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip(labels, counts)),
+        }
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_timeout` seconds one trial
+    call is let through (half-open) and its outcome closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial_running = False
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class Provider:
+    def __init__(self, name, fn, enabled=None, breaker=None):
+        self.name = name
+        self.fn = fn
+        self.enabled = enabled or (lambda: True)
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.failures = 0
+        self.wins = 0
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'calls': self.calls,
+            'failures': self.failures,
+            'wins': self.wins,
+            'latency': self.latency.snapshot(),
+        }
+
+
+class HedgedCaller:
+    """Run `fn(*args)` on providers in order, hedging to the next one after the current provider's
+    `hedge_quantile` latency (or `default_delay` until it has `min_samples` observations).
+    `max_workers` caps provider calls in flight in this process, so size it to the connection limits
+    of the provider APIs (threads are only started when needed, and are greenlets under gevent)."""
+
+    def __init__(self, providers, is_valid=None, hedge_quantile=0.95, default_delay=8.0, min_delay=0.5,
+                 min_samples=20, timeout=60.0, max_workers=None):
+        self.providers = providers
+        self.is_valid = is_valid or (lambda result: result is not None)
+        self.hedge_quantile = hedge_quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.timeout = timeout
+        self.hedged = 0
+        self.exhausted = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+
+    def hedge_delay(self, provider):
+        if provider.latency.total < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, provider.latency.percentile(self.hedge_quantile) or self.default_delay)
+
+    def _run(self, provider, args):
+        start = time.monotonic()
+        try:
+            result = provider.fn(*args)
+            ok = self.is_valid(result)
+        except Exception:
+            result, ok = None, False
+        provider.latency.observe(time.monotonic() - start)
+        if ok:
+            provider.breaker.record_success()
+        else:
+            provider.failures += 1
+            provider.breaker.record_failure()
+        return provider, result, ok
+
+    def call(self, *args):
+        """First valid result, or None when every healthy provider failed or the timeout passed.
+        Losing calls finish in the background; their latency and outcome are still recorded."""
+        queue = [p for p in self.providers if p.enabled()]
+        deadline = time.monotonic() + self.timeout
+        running = set()
+
+        def start_next():
+            while queue:
+                provider = queue.pop(0)
+                if provider.breaker.allow():
+                    provider.calls += 1
+                    running.add(self._pool.submit(self._run, provider, args))
+                    return provider
+            return None
+
+        current = start_next()
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = min(remaining, self.hedge_delay(current)) if queue and current else remaining
+            done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                current = start_next()
+                if current is not None:
+                    self.hedged += 1
+                continue
+            for fut in done:
+                running.discard(fut)
+                provider, result, ok = fut.result()
+                if ok:
+                    provider.wins += 1
+                    return result
+            current = start_next() or current  # a provider failed: fail over without waiting
+        self.exhausted += 1
+        return None
+
+    def stats(self):
+        return {
+            'hedged': self.hedged,
+            'exhausted': self.exhausted,
+            'providers': {p.name: p.stats() for p in self.providers},
+        }
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+One pooled HTTP client for every upstream API (Gemini, OpenAI, Open-Meteo, Nominatim, job webhooks).
+Each host gets a cap on concurrent requests, so a slow provider queues its own callers instead of
+holding every worker. Under the gevent server (serve_async.py) these calls only park the calling
+greenlet, and one process can keep hundreds of upstream requests in flight.
+"""
+
+import ipaddress
+import os
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_PER_HOST = int(os.getenv('UPSTREAM_MAX_PER_HOST', 64))
+QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', 10))
+
+
+def parse_host_limits(value):
+    """'api.openai.com=16,nominatim.openstreetmap.org=1' -> {host: limit}."""
+    limits = {}
+    for item in (value or '').split(','):
+        host, _, limit = item.partition('=')
+        if host.strip() and limit.strip().isdigit():
+            limits[host.strip().lower()] = max(1, int(limit))
+    return limits
+
+
+def public_url_error(url, allowed_hosts=()):
+    """Why url must not be requested on a client's behalf (webhooks), or None when it may be. With an
+    allowlist only those hosts pass; otherwise every address the host resolves to must be public, so a
+    callback cannot reach loopback, private networks or the cloud metadata endpoint (169.254.169.254)."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return 'is not a valid URL'
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return 'must be an http(s) URL'
+    host = parts.hostname.lower().rstrip('.')
+    if allowed_hosts:
+        return None if host in allowed_hosts else 'host is not allowed'
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        return 'host does not resolve'
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return 'must not point to a private, loopback or reserved address'
+    return None
+
+
+class HostBusy(requests.exceptions.ConnectionError):
+    """The host's concurrency cap stayed full for the whole queue timeout."""
+
+
+class _HostSlot:
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.rejected = 0
+
+
+class HttpClient:
+    def __init__(self, max_per_host=MAX_PER_HOST, host_limits=None, queue_timeout=QUEUE_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.host_limits = host_limits or {}
+        self.queue_timeout = queue_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_per_host)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, host):
+        """Concurrent requests allowed to host (UPSTREAM_HOST_LIMITS, else UPSTREAM_MAX_PER_HOST)."""
+        return self.host_limits.get(host.lower(), self.max_per_host)
+
+    def _slot(self, host):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = _HostSlot(self.limit_for(host))
+            return slot
+
+    def _release(self, slot):
+        with self._lock:
+            slot.in_flight -= 1
+        slot.semaphore.release()
+
+    def request(self, method, url, **kwargs):
+        """requests.Session.request with the host's concurrency cap. A streamed response holds its slot
+        until it is closed (use it as a context manager)."""
+        slot = self._slot((urlsplit(url).hostname or '').lower())
+        if not slot.semaphore.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                slot.rejected += 1
+            raise HostBusy(f'too many concurrent requests to {urlsplit(url).hostname}')
+        with self._lock:
+            slot.in_flight += 1
+            slot.requests += 1
+            slot.peak = max(slot.peak, slot.in_flight)
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except BaseException:
+            self._release(slot)
+            raise
+        if not kwargs.get('stream'):
+            self._release(slot)
+            return r
+        close = r.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release(slot)
+        r.close = close_and_release
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {'limit': s.limit, 'inFlight': s.in_flight, 'peak': s.peak, 'requests': s.requests,
+                       'rejected': s.rejected}
+                for host, s in self._slots.items()
+            }
+
+
+client = HttpClient(host_limits=parse_host_limits(os.getenv('UPSTREAM_HOST_LIMITS')))
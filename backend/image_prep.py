@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Crop photos are prepared before they are sent to the vision models: the real format is detected from
+the file header, the image is downscaled to what the models actually use, EXIF (GPS, camera serial)
+is dropped, and it is re-encoded as a compact JPEG. The original upload is kept untouched; the derived
+copy goes to a 'derived' folder next to it.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_imports import optional
+from result_cache import MemoryCache
+
+MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1536))  # vision models tile/downsample beyond this anyway
+JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+PREP_VERSION = 1  # part of the derived file name; bump when the output changes
+
+MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tiff': 'image/tiff',
+    'heic': 'image/heic',
+}
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_PREP_WORKERS', 2)), thread_name_prefix='image-prep')
+_prepared = MemoryCache(max_entries=2000)
+
+
+def sniff_format(head):
+    """Image format from the first bytes of a file, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:2] == b'BM':
+        return 'bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1', b'msf1', b'hevc'):
+        return 'heic'
+    return None
+
+
+def detect_mime(path):
+    with open(path, 'rb') as f:
+        fmt = sniff_format(f.read(32))
+    return MIME_TYPES.get(fmt, 'application/octet-stream')
+
+
+def derived_path(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, 'derived', f'{os.path.splitext(name)[0]}.v{PREP_VERSION}.jpg')
+
+
+def _prepare(path):
+    original = {'path': path, 'mime': detect_mime(path), 'bytes': os.path.getsize(path), 'derived': False}
+    Image, ImageOps = optional('PIL.Image'), optional('PIL.ImageOps')
+    if Image is None or ImageOps is None:
+        return original
+    out = derived_path(path)
+    if not os.path.exists(out):
+        try:
+            with Image.open(path) as img:
+                img.draft('RGB', (MAX_SIDE, MAX_SIDE))  # JPEG: decode at reduced scale, much faster
+                img = ImageOps.exif_transpose(img)
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    img = img.convert('RGBA')
+                    background = Image.new('RGB', img.size, (255, 255, 255))
+                    background.paste(img, mask=img.getchannel('A'))
+                    img = background
+                elif img.mode != 'RGB':
+                    img = img.convert('RGB')
+                img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                tmp = f'{out}.{os.getpid()}.tmp'
+                img.save(tmp, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp, out)
+        except Exception:
+            return original  # unreadable or unsupported (e.g. HEIC without a plugin): send as uploaded
+    return {'path': out, 'mime': 'image/jpeg', 'bytes': os.path.getsize(out), 'derived': True,
+            'originalBytes': original['bytes'], 'originalMime': original['mime']}
+
+
+def prepare(path):
+    """{'path', 'mime', 'bytes', 'derived', ...} for the model-ready copy of an image.
+    Concurrent callers for the same file share one conversion."""
+    return _prepared.get_or_load(os.path.abspath(path), lambda: _prepare(path), ttl=3600)
+
+
+def prepare_async(path):
+    """Start preparing right after upload so the work overlaps with request handling."""
+    return _pool.submit(prepare, path)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+In-process retrieval over the Krishimitra knowledge base. The knowledge text is split into its
+markdown sections and indexed with BM25 at import time; Hindi, Marathi and Hinglish words are mapped
+onto the English index terms. FAQ-style questions whose every word is covered by one clearly best
+section are answered directly; complaints, error reports and everything else go to the model.
+"""
+
+import math
+import os
+import re
+
+from krishimitra_knowledge import KRISHIMITRA_KNOWLEDGE
+
+K1 = 1.5
+B = 0.75
+DIRECT_MIN_SCORE = float(os.getenv('CHAT_FAQ_MIN_SCORE', 2.5))
+DIRECT_MARGIN = 1.3    # best section must outscore the runner-up by this factor
+DIRECT_MIN_TERMS = 2   # a single keyword is too little to pick a canned answer
+DIRECT_MAX_TERMS = 12  # longer messages are real questions, not FAQs
+
+# Sections that describe the assistant rather than the product
+SKIP_SECTIONS = {'How you should answer', 'Features (for answering “how do I…?” and “what is…?”)'}
+
+# Latin and Devanagari letters/digits incl. vowel signs; the danda (U+0964/65) ends a word
+_TOKEN = re.compile('[0-9a-z\u0900-\u0963\u0966-\u097f]+(?:-[0-9a-z\u0900-\u0963\u0966-\u097f]+)*')
+
+STOPWORDS = frozenset('''
+a an the is are am was be been do does did i me my mine we our you your it its to of in on at for
+from by with and or how what which who when where why can could should would will shall please tell
+about this that these those there here any some get got want need know use using
+kya hai hain kaise kaisa kaun kab kahan mera meri mere mujhe main ka ki ke ko me mein se aur bhi
+kare karna karu batao bataye
+क्या है हैं कैसे कैसा कौन कब कहाँ कहां मेरा मेरी मेरे मुझे मैं का की के को में से और भी करें करना बताएं बताइए
+काय आहे आहेत कसे कसा कोण केव्हा कुठे माझा माझी माझे मला मी चा ची चे ला मध्ये आणि पण करा सांगा
+'''.split())
+
+# Words that mark a complaint or a failure report ('upload failed', 'not working', 'refund'); those
+# need the model (or a person), never a canned section
+COMPLAINT_WORDS = frozenset('''
+not never cannot unable didn doesn isn wasn won wouldn couldn stuck wrong broken
+nahi nahin galat kharab wapas
+नहीं नही गलत खराब वापस नाही चुकीचे चुकीचा बंद
+'''.split())
+COMPLAINT_PREFIXES = ('fail', 'error', 'refund', 'delet', 'deactivat', 'cancel', 'deduct', 'crash', 'fraud', 'hack')
+
+# Non-English words mapped to the English terms used in the knowledge base
+ALIASES = {
+    # Hindi
+    'बैंक': 'bank', 'स्टेटमेंट': 'statement', 'खाता': 'bank', 'विवरण': 'statement',
+    'फसल': 'crop', 'फोटो': 'photo', 'तस्वीर': 'photo', 'रोग': 'disease', 'बीमारी': 'disease', 'कीट': 'pest',
+    'मौसम': 'weather', 'बारिश': 'rainfall', 'वर्षा': 'rainfall', 'बीमा': 'insurance',
+    'संपर्क': 'contact', 'फोन': 'phone', 'नंबर': 'phone', 'ईमेल': 'email', 'मदद': 'support', 'सहायता': 'support',
+    'स्कोर': 'score', 'ट्रस्ट': 'trust', 'भरोसा': 'trust', 'अंक': 'score',
+    'ऋण': 'loan', 'लोन': 'loan', 'कर्ज': 'loan', 'कर्ज़': 'loan',
+    'वाउचर': 'voucher', 'कूपन': 'voucher', 'सेंसर': 'sensor', 'मिट्टी': 'soil', 'नमी': 'moisture', 'नाइट्रोजन': 'nitrogen',
+    'शिकायत': 'complaint', 'प्रतिक्रिया': 'feedback', 'रेटिंग': 'rating', 'प्रश्नोत्तरी': 'quiz', 'क्विज़': 'quiz',
+    'वीडियो': 'video', 'प्रोफाइल': 'profile', 'भुगतान': 'payout',
+    # Marathi
+    'पीक': 'crop', 'पिक': 'crop', 'पाऊस': 'rainfall', 'हवामान': 'weather', 'विमा': 'insurance',
+    'माती': 'soil', 'ओलावा': 'moisture', 'स्कोअर': 'score', 'व्हाउचर': 'voucher', 'सेन्सर': 'sensor',
+    'तक्रार': 'complaint', 'अभिप्राय': 'feedback', 'खाते': 'bank', 'मदत': 'support', 'प्रोफाईल': 'profile',
+    # Hinglish
+    'fasal': 'crop', 'fasl': 'crop', 'barish': 'rainfall', 'baarish': 'rainfall', 'mausam': 'weather',
+    'bima': 'insurance', 'beema': 'insurance', 'karz': 'loan', 'karj': 'loan', 'mitti': 'soil', 'nami': 'moisture',
+    'shikayat': 'complaint', 'sampark': 'contact', 'madad': 'support', 'paisa': 'payout',
+}
+
+# Hand-written replies for the busiest sections (exact contact numbers, next steps), with the words
+# farmers use for them that the knowledge text itself does not. Other sections answer with their own text.
+FAQS = {
+    'Trust Score (0–100)': ('trust score eligibility improve increase points', (
+        "**Trust Score (0–100)** is built by completing: Profile, Bank Statement, Sensor Readings, "
+        "Crop Analysis, Financial Quiz, and Weather Insurance. Score 80+ unlocks loans, Vouchers, and Pay-as-you-Grow. "
+        "Complete tasks on the Home dashboard and click **Evaluate my score** to see your score."
+    )),
+    'Contact and support': ('contact phone number call telephone mobile email whatsapp helpline reach customer care', (
+        "**Contact Krishimitra:** Telephone 083903 12345, Mobile 091234 56789, Toll-free 1800 123 4567, "
+        "Email support@krishimitra.in, WhatsApp +91 91234 56789, Instagram @krishimitra. Helpline: Mon–Sat, 9 AM – 6 PM. "
+        "You can also use the **Feedback** button above to send a message."
+    )),
+    'Bank Statement': ('bank statement account passbook transactions upload format', (
+        "Upload your **bank statement** (PDF, CSV, Excel, or JSON) from the Bank Statement page. "
+        "Active accounts can earn up to +20 Trust Score. Go to the sidebar → Bank Statement."
+    )),
+    'Sensor Readings': ('sensor soil ph moisture nitrogen field data upload readings', (
+        "Upload **sensor/field data** (JSON, CSV, Excel, or PDF) from Sensor Readings. "
+        "Include pH, moisture, and nitrogen for up to 30 Trust Score. Rainfall data is used for Weather Insurance."
+    )),
+    'Crop Analysis (Crop Quality Analysis)': ('crop photo image picture analysis disease pest leaf', (
+        "Use **Crop Analysis** (sidebar or Explore) to upload a crop photo. AI will analyse health, "
+        "diseases, and pests and suggest recommendations. You can also attach an image in this chat for quick analysis."
+    )),
+    'Weather Insurance (Parametric Weather Insurance)': ('weather insurance rainfall rain drought payout claim', (
+        "**Weather Insurance** gives automatic payouts when rainfall in your area is below a threshold. "
+        "Upload sensor data with rainfall first, then check the Weather Insurance page. Uses data from your Sensor Readings."
+    )),
+    'Vouchers (Redeemable Vouchers)': ('voucher coupon qr pin redeem dealer shop', (
+        "**Vouchers** (QR/PIN) and **Pay-as-you-Grow** (funds in stages: Seeds → Labor → Harvest) unlock when your Trust Score is 80+. "
+        "Complete the dashboard tasks and evaluate your score to qualify."
+    )),
+    'Feedback, complaints, and ratings': ('feedback complaint rating review problem issue', (
+        "Use the **Feedback** button at the top of this chat to send general feedback, a complaint, or a star rating. "
+        "Our team will get back to you."
+    )),
+    'Financial Quests (Level Up: Financial Quests)': ('financial quest quiz video literacy learn', None),
+    'Pay-as-you-Grow (Smart Milestones)': ('pay-as-you-grow milestone stage instalment disbursement', None),
+}
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Index terms: lowercased words, aliases resolved, stopwords dropped, plurals folded."""
+    terms = []
+    for word in _TOKEN.findall((text or '').lower()):
+        if word in STOPWORDS:
+            continue
+        word = ALIASES.get(word, word)
+        terms.extend(_stem(w) for w in word.split('-') if w and w not in STOPWORDS)
+    return terms
+
+
+def is_complaint(text):
+    """True when the message reports a problem rather than asking how something works."""
+    return any(w in COMPLAINT_WORDS or w.startswith(COMPLAINT_PREFIXES) for w in _TOKEN.findall((text or '').lower()))
+
+
+def split_sections(text):
+    """[(title, body)] for each markdown section with content; the title is the nearest heading."""
+    sections = []
+    title, lines = None, []
+    for line in text.splitlines():
+        heading = re.match(r'^#{1,6}\s+(.*)$', line.strip())
+        if heading:
+            if title and ''.join(lines).strip():
+                sections.append((title, '\n'.join(lines).strip()))
+            title, lines = heading.group(1).strip(), []
+        elif title:
+            lines.append(line)
+    if title and ''.join(lines).strip():
+        sections.append((title, '\n'.join(lines).strip()))
+    return [(t, body) for t, body in sections if t not in SKIP_SECTIONS]
+
+
+def _section_reply(title, body):
+    reply = FAQS.get(title, ('', None))[1]
+    return reply or f'**{title}**\n' + body
+
+
+class KnowledgeIndex:
+    """BM25 over knowledge sections. Title and FAQ keywords count three times so a question about
+    'vouchers' ranks the Vouchers section above every section that merely mentions them."""
+
+    def __init__(self, text):
+        sections = split_sections(text)
+        self.sections = [{'title': t, 'reply': _section_reply(t, body),
+                          'topic': frozenset(tokenize(t + ' ' + FAQS.get(t, ('',))[0]))} for t, body in sections]
+        self.postings = {}
+        self.lengths = []
+        for i, (title, body) in enumerate(sections):
+            terms = list(self.sections[i]['topic']) * 3 + tokenize(body)
+            self.lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+        n = len(self.sections)
+        self.avg_length = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self.postings.items()}
+        self.answered = 0
+        self.escalated = 0
+
+    def search(self, query, limit=3):
+        """[(score, section index, matched query terms)] best first."""
+        terms = set(tokenize(query))
+        scores, matched = {}, {}
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * self.lengths[i] / self.avg_length))
+                scores[i] = scores.get(i, 0.0) + idf * norm
+                matched[i] = matched.get(i, 0) + 1
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [(scores[i], i, matched[i]) for i in ranked]
+
+    def answer(self, query):
+        """{'reply', 'section', 'score'} when one section clearly answers a short FAQ-style question,
+        else None (ambiguous or too specific: ask the model)."""
+        hit = self._direct(query)
+        if hit:
+            self.answered += 1
+        else:
+            self.escalated += 1
+        return hit
+
+    def _direct(self, query):
+        if is_complaint(query):
+            return None
+        terms = set(tokenize(query))
+        if not DIRECT_MIN_TERMS <= len(terms) <= DIRECT_MAX_TERMS:
+            return None
+        hits = self.search(query, limit=2)
+        if not hits:
+            return None
+        score, i, matched = hits[0]
+        if matched < len(terms):
+            return None  # a word the section says nothing about ('5mm', 'account') is the actual question
+        runner_up = hits[1][0] if len(hits) > 1 else 0.0
+        # Every word names the section's topic ('trust score?'), or one section is clearly ahead
+        on_topic = terms <= self.sections[i]['topic']
+        confident = score >= DIRECT_MIN_SCORE and score >= DIRECT_MARGIN * runner_up
+        if not (on_topic or confident):
+            return None
+        return {'reply': self.sections[i]['reply'], 'section': self.sections[i]['title'], 'score': round(score, 2)}
+
+    def best_reply(self, query):
+        """Reply of the best-matching section regardless of confidence (offline fallback), or None."""
+        hits = self.search(query, limit=1)
+        return self.sections[hits[0][1]]['reply'] if hits else None
+
+    def stats(self):
+        total = self.answered + self.escalated
+        return {
+            'sections': len(self.sections),
+            'terms': len(self.postings),
+            'answered': self.answered,
+            'escalated': self.escalated,
+            'answerRate': round(self.answered / total, 3) if total else 0.0,
+        }
+
+
+knowledge = KnowledgeIndex(KRISHIMITRA_KNOWLEDGE)
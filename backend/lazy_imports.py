@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Heavy optional dependencies (openpyxl, pypdf, Pillow, NumPy) are imported the first time a request
+needs them instead of when the app starts, and resolved once per process. Load times are recorded
+so the start-up profile is visible in /api/metrics; bench_imports.py measures the cold start.
+"""
+
+import importlib
+import threading
+import time
+
+_modules = {}  # spec -> module or None (not installed)
+_load_ms = {}
+_lock = threading.Lock()
+
+
+def optional(*names):
+    """The first of names that can be imported (e.g. optional('pypdf', 'PyPDF2')), or None.
+    Resolved once; later calls are a dict lookup."""
+    try:
+        return _modules[names]
+    except KeyError:
+        pass
+    with _lock:
+        if names not in _modules:
+            start = time.perf_counter()
+            module = None
+            for name in names:
+                try:
+                    module = importlib.import_module(name)
+                    break
+                except ImportError:
+                    continue
+            _modules[names] = module
+            if module is not None:
+                _load_ms[module.__name__] = round((time.perf_counter() - start) * 1000, 1)
+        return _modules[names]
+
+
+def require(*names):
+    """Like optional, but raises ImportError naming the missing package."""
+    module = optional(*names)
+    if module is None:
+        raise ImportError(f"{' or '.join(names)} is required for this file type; pip install -r requirements.txt")
+    return module
+
+
+def preload(specs):
+    """Import everything in specs now (tuples of alternatives or names); returns the modules loaded."""
+    loaded = []
+    for spec in specs:
+        module = optional(*((spec,) if isinstance(spec, str) else spec))
+        if module is not None:
+            loaded.append(module.__name__)
+    return loaded
+
+
+def stats():
+    with _lock:
+        return {
+            'loaded': dict(_load_ms),
+            'missing': [' / '.join(names) for names, module in _modules.items() if module is None],
+        }
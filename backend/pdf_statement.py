@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+PDF bank statement extraction. Pages are extracted with pypdf (layout mode, so table columns stay
+aligned) across a process pool, each page's parse is cached by a hash of everything it draws (content
+stream plus resolved fonts and XObjects), and the amount/balance columns are detected from the table
+header positions.
+"""
+
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from lazy_imports import optional
+from result_cache import make_key
+from statement_analytics import columns_from_table, empty_columns, resolve_columns
+
+PARSER_VERSION = 2  # bump when page parsing changes so cached pages are re-extracted
+INLINE_PAGES = 2  # statements this short are parsed in-process; the pool start-up is not worth it
+
+_DATE_AT_START = re.compile(
+    r'^\s*(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}[ -][A-Za-z]{3}[ -]\d{2,4})\b'
+)
+# Money always has two decimals (1,00,000.00 / 250.00 / -75.50 Cr); this skips page numbers,
+# account numbers and dates, which the old raw-bytes regex counted as transactions.
+_MONEY = re.compile(r'(?<![\w./-])(-?\d{1,3}(?:,\d{2,3})*(?:,\d{3})*\.\d{2}|-?\d+\.\d{2})(?:\s*(Cr|Dr|CR|DR)\b)?(?![\w/])')
+_CELL = re.compile(r'\S+(?: \S+)*')  # layout text separates columns by 2+ spaces
+_NUMERIC_ROLES = ('amount', 'debit', 'credit', 'balance')
+
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', 0)) or min(4, os.cpu_count() or 1)
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _pool
+
+
+def _pdf_reader():
+    """pypdf's PdfReader (PyPDF2 as a fallback), imported on first use; None when neither is installed."""
+    module = optional('pypdf', 'PyPDF2')
+    return module.PdfReader if module is not None else None
+
+
+def page_texts(path, layout=False):
+    """Text of every page (empty strings when the page has no text layer)."""
+    PdfReader = _pdf_reader()
+    if PdfReader is None:
+        return []
+    reader = PdfReader(path)
+    return [_page_text(page, layout) for page in reader.pages]
+
+
+def _page_text(page, layout):
+    if layout:
+        try:
+            text = page.extract_text(extraction_mode='layout') or ''
+        except TypeError:
+            text = ''  # PyPDF2 / old pypdf have no layout mode
+        # Layout mode skips text drawn inside Form XObjects (q /Fx Do Q pages); plain extraction does not
+        if text.strip():
+            return text
+    return page.extract_text() or ''
+
+
+def parse_page(text):
+    """Header column spans plus candidate transaction lines from one page of layout text.
+    Output is plain lists so it can be cached as JSON and sent between processes."""
+    header = None
+    rows = []
+    for line in text.splitlines():
+        lower = line.lower()
+        if header is None and 'date' in lower and ('balance' in lower or 'amount' in lower or 'debit' in lower
+                                                    or 'withdrawal' in lower):
+            cells = [(m.group(0), m.start(), m.end()) for m in _CELL.finditer(line)]
+            roles = resolve_columns([c[0] for c in cells])
+            spans = [[role, cells[j][1], cells[j][2]] for role, j in roles.items() if role in _NUMERIC_ROLES]
+            if spans:
+                header = spans
+            continue
+        m = _DATE_AT_START.match(line)
+        if not m:
+            continue
+        tokens = [[t.group(1), t.start(), t.end(), t.group(2) or ''] for t in _MONEY.finditer(line, m.end())]
+        if tokens:
+            rows.append([m.group(1), tokens])
+    return {'header': header, 'rows': rows}
+
+
+def _parse_pages(path, indices):
+    """Process-pool task: extract and parse a batch of pages."""
+    reader = _pdf_reader()(path)
+    return [parse_page(_page_text(reader.pages[i], layout=True)) for i in indices]
+
+
+def _digest(obj, memo, depth=0):
+    """SHA-256 of a PDF object with indirect references resolved, so two pages that both just say
+    '/Fx Do' only match when their Fx forms (and fonts) match too. memo caches indirect objects across
+    the pages of one document; parent links are not followed."""
+    if hasattr(obj, 'idnum'):  # indirect reference
+        ref = (obj.idnum, obj.generation)
+        if ref not in memo:
+            memo[ref] = 'cycle'
+            memo[ref] = _digest(obj.get_object(), memo, depth + 1)
+        return memo[ref]
+    h = hashlib.sha256(type(obj).__name__.encode())
+    if depth > 32:
+        h.update(b'deep')
+    elif isinstance(obj, dict):
+        for k in sorted(obj):
+            if k not in ('/Parent', '/P'):
+                h.update(str(k).encode())
+                h.update(_digest(obj.raw_get(k) if hasattr(obj, 'raw_get') else obj[k], memo, depth + 1).encode())
+        if hasattr(obj, 'get_data'):
+            h.update(obj.get_data())
+    elif isinstance(obj, list):
+        for item in obj:
+            h.update(_digest(item, memo, depth + 1).encode())
+    else:
+        h.update(repr(obj).encode())
+    return h.hexdigest()
+
+
+def _page_key(page, memo=None):
+    try:
+        contents = page.get_contents()
+        data = contents.get_data() if contents is not None else b''
+        resources = _digest(page.get('/Resources', {}), {} if memo is None else memo)
+    except Exception:
+        return None
+    return make_key('pdf-page', PARSER_VERSION, hashlib.sha256(data).hexdigest(), resources)
+
+
+def extract_pages(path, cache=None):
+    """Parsed pages in order. Cached pages are reused; the rest are spread across the process pool."""
+    PdfReader = _pdf_reader()
+    if PdfReader is None:
+        return []
+    reader = PdfReader(path)
+    memo = {}
+    keys = [_page_key(p, memo) for p in reader.pages]
+    results = [None] * len(keys)
+    if cache is not None:
+        for i, k in enumerate(keys):
+            if k is not None:
+                results[i] = cache.get(k)
+    missing = [i for i, r in enumerate(results) if r is None]
+    if len(missing) <= INLINE_PAGES:
+        parsed = [parse_page(_page_text(reader.pages[i], layout=True)) for i in missing]
+    else:
+        n = PDF_WORKERS
+        batches = [missing[k::n] for k in range(n) if missing[k::n]]
+        parsed_by_index = {}
+        for batch, out in zip(batches, _get_pool().map(_parse_pages, [path] * len(batches), batches)):
+            parsed_by_index.update(zip(batch, out))
+        parsed = [parsed_by_index[i] for i in missing]
+    for i, page in zip(missing, parsed):
+        results[i] = page
+        if cache is not None and keys[i] is not None:
+            cache.set(keys[i], page)
+    return results
+
+
+def _assign(tokens, header):
+    """Map a line's money tokens to roles: by nearest header column, else balance = last, amount = the one before."""
+    if header:
+        out = {}
+        for value, start, end, suffix in tokens:
+            centre = (start + end) / 2
+            role = min(header, key=lambda h: abs((h[1] + h[2]) / 2 - centre))[0]
+            out.setdefault(role, (value, suffix))
+        return out
+    if len(tokens) == 1:
+        return {'amount': (tokens[0][0], tokens[0][3])}
+    return {'amount': (tokens[-2][0], tokens[-2][3]), 'balance': (tokens[-1][0], tokens[-1][3])}
+
+
+def load_pdf_statement(path, cache=None):
+    """Column arrays (see statement_analytics) for a PDF statement."""
+    pages = extract_pages(path, cache)
+    header = next((p['header'] for p in pages if p and p.get('header')), None)
+    amount, date, balance, kind = [], [], [], []
+    for page in pages:
+        for date_str, tokens in page['rows']:
+            cells = _assign(tokens, header)
+            value, suffix = cells.get('debit') or cells.get('credit') or cells.get('amount') or (None, '')
+            if value is None:
+                continue
+            if 'debit' in cells:
+                suffix = 'dr'
+            elif 'credit' in cells:
+                suffix = 'cr'
+            amount.append(value)
+            date.append(date_str)
+            balance.append(cells['balance'][0] if 'balance' in cells else None)
+            kind.append(suffix.lower() or None)
+    if not amount:
+        return empty_columns()
+    return columns_from_table({'amount': amount, 'date': date, 'balance': balance, 'type': kind},
+                              infer_from_balance=True)
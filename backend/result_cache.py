@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Result caches for expensive backend calls (AI image analysis, lookups, forecasts).
+ResultCache persists entries in a SQLite file so they survive restarts and are shared by all workers;
+MemoryCache keeps hot, short-lived entries in process.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+def make_key(*parts):
+    """Stable cache key from any number of string parts."""
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(str(p if p is not None else '').encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file on disk, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def normalize_text(value):
+    """Lowercase and collapse whitespace so equivalent prompts share a key."""
+    return ' '.join((value or '').lower().split())
+
+
+class ResultCache:
+    """SQLite-backed JSON cache with per-entry TTL and size-bounded LRU eviction. Hits do not write:
+    last-used times are buffered and flushed in batches, and the size is only checked every
+    evict_every inserts, so lookups never queue behind SQLite's write lock."""
+
+    TOUCH_RESOLUTION = 60  # seconds; LRU order only needs to be roughly right
+    TOUCH_BATCH = 256
+
+    def __init__(self, path, table='results', ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last used, not yet written
+        self._inserts = 0
+        self.evict_every = max(1, max_entries // 20)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')  # persistent per file; lets workers read while one writes
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_last_used ON {table} (last_used)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on miss/expiry."""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    f'SELECT value, expires_at, last_used FROM {self.table} WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None or row[1] < now:
+                    if row is not None:
+                        conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                    self._count(hit=False)
+                    return default
+            self._count(hit=True)
+            if now - row[2] > self.TOUCH_RESOLUTION:
+                with self._lock:
+                    self._touched[key] = now
+                    flush = len(self._touched) >= self.TOUCH_BATCH
+                if flush:
+                    with self._connect() as conn:
+                        self._flush_touched(conn)
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError):
+            self._count(hit=False)
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a JSON-serialisable value. ttl overrides the cache default (seconds)."""
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {self.table} (key, value, created_at, expires_at, last_used) VALUES (?, ?, ?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), now, expires, now),
+                )
+                self._flush_touched(conn)
+                with self._lock:
+                    self._inserts += 1
+                    evict = self._inserts >= self.evict_every
+                    if evict:
+                        self._inserts = 0
+                if evict:
+                    self._evict(conn, now)
+        except sqlite3.Error:
+            pass
+
+    def _flush_touched(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany(
+                f'UPDATE {self.table} SET last_used = MAX(last_used, ?) WHERE key = ?',
+                [(ts, key) for key, ts in touched.items()],
+            )
+
+    def _evict(self, conn, now):
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (now,))
+        (count,) = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)',
+                (overflow,),
+            )
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Hit/miss counters for this process plus current entry count."""
+        try:
+            with self._connect() as conn:
+                (entries,) = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()
+        except sqlite3.Error:
+            entries = None
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'entries': entries,
+            'maxEntries': self.max_entries,
+            'ttlSeconds': self.ttl,
+        }
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry expiry. Concurrent misses for the same key share a single load."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Future of the load in progress
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        if item[0] < now:
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, item[1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            found, value = self._lookup(key, time.time())
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl):
+        """Cached value, or loader() run once for all concurrent callers. ttl may be a callable(value).
+        Failed loads are not cached; every waiting caller gets the exception."""
+        with self._lock:
+            found, value = self._lookup(key, time.time())
+            if found:
+                self.hits += 1
+                return value
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                self.misses += 1
+                fut = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return fut.result()
+        try:
+            value = loader()
+            self.set(key, value, ttl(value) if callable(ttl) else ttl)
+            fut.set_result(value)
+            return value
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hitRate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            'entries': len(self._data),
+            'maxEntries': self.max_entries,
+        }
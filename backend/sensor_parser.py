@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Sensor / soil report parsing in a single pass. Every numeric reading is visited once and fed to an
+accumulator that collects the 0-10 scores, pH / moisture / nitrogen and rainfall together. CSV and
+Excel files are streamed row by row, and batches of reports are parsed across a process pool.
+No network calls here: coordinates are only what the file has.
+"""
+
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from statement_parser import iter_rows_csv, iter_rows_xlsx
+
+SENSOR_EXTS = ('.json', '.txt', '.csv', '.xlsx', '.xlsm', '.xltx', '.xltm', '.pdf')
+
+
+def _clamp10(v):
+    return max(0.0, min(10.0, v))
+
+
+_NORMALIZERS = {
+    'ph': lambda v: _clamp10(10.0 - abs(v - 6.5) * (10.0 / 6.5)),
+    'temp': lambda v: _clamp10((50.0 - abs(v - 25.0)) / 5.0),
+    'rain': lambda v: _clamp10(10.0 - max(0.0, v - 20.0) * 0.5),
+    'wind': lambda v: _clamp10(10.0 - v * 0.5),
+    'percent': lambda v: _clamp10(v / 10.0),  # soil moisture, humidity and anything unrecognised
+}
+
+
+@lru_cache(maxsize=4096)
+def classify_key(key):
+    """(normalizer, metric names, is_rain) for a column / JSON key. Computed once per distinct key."""
+    k = str(key or '').lower()
+    if 'soil' in k and 'moist' in k:
+        norm = 'percent'
+    elif 'ph' in k:
+        norm = 'ph'
+    elif 'humid' in k:
+        norm = 'percent'
+    elif 'temp' in k:
+        norm = 'temp'
+    elif 'rain' in k or 'precip' in k:
+        norm = 'rain'
+    elif 'wind' in k:
+        norm = 'wind'
+    else:
+        norm = 'percent'
+    metrics = tuple(name for name, hit in (('ph', 'ph' in k),
+                                           ('moisture', 'moist' in k or 'humidity' in k),
+                                           ('nitrogen', 'nitrogen' in k or k == 'n')) if hit)
+    return _NORMALIZERS[norm], metrics, ('rain' in k or 'precip' in k)
+
+
+def normalize_metric(key, value):
+    """0-10 health score for one reading, or None when it is not a number."""
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return classify_key(key)[0](v)
+
+
+class SensorAccumulator:
+    """Collects everything the trust score needs from a stream of (key, value) readings.
+    JSON reports average repeated metrics; tables keep the first reading, as before."""
+
+    def __init__(self, average_metrics):
+        self.average_metrics = average_metrics
+        self.score_sum = 0.0
+        self.score_count = 0
+        self.rain_sum = 0.0
+        self.rain_count = 0
+        self._metric_sum = {'ph': 0.0, 'moisture': 0.0, 'nitrogen': 0.0}
+        self._metric_count = {'ph': 0, 'moisture': 0, 'nitrogen': 0}
+        self._metric_first = {'ph': None, 'moisture': None, 'nitrogen': None}
+
+    def add_score(self, score):
+        self.score_sum += score
+        self.score_count += 1
+
+    def add(self, key, value):
+        norm, metrics, is_rain = classify_key(key)
+        self.add_score(norm(value))
+        if is_rain:
+            self.rain_sum += value
+            self.rain_count += 1
+        for name in metrics:
+            self.set_metric(name, value)
+
+    def set_metric(self, name, value):
+        self._metric_sum[name] += value
+        self._metric_count[name] += 1
+        if self._metric_first[name] is None:
+            self._metric_first[name] = value
+
+    def has_metric(self, name):
+        return self._metric_count[name] > 0
+
+    def metrics(self):
+        if self.average_metrics:
+            return {k: (self._metric_sum[k] / n if n else None) for k, n in self._metric_count.items()}
+        return dict(self._metric_first)
+
+    def score_mean(self):
+        return self.score_sum / self.score_count if self.score_count else None
+
+    def rainfall_total(self):
+        return round(self.rain_sum, 1) if self.rain_count else None
+
+
+def _walk_json(data, acc):
+    """Depth-first visit of every numeric leaf. List items are keyed '' (scored, but not a named metric)."""
+    stack = [(None, data)]
+    while stack:
+        key, node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(reversed([(k, v) for k, v in node.items()]))
+        elif isinstance(node, list):
+            stack.extend(reversed([('', v) for v in node]))
+        elif isinstance(node, (int, float)) and key is not None:
+            acc.add(key, float(node))
+
+
+def _walk_rows(rows, acc):
+    """Header row, then data rows: each numeric cell is one reading keyed by its column name.
+    Columns are classified once, so the per-cell work is a float() and a few additions."""
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = [classify_key(str(h) if h is not None else '') for h in row]
+            continue
+        for (norm, metrics, is_rain), v in zip(columns, row):
+            try:
+                fv = float(v)
+            except (TypeError, ValueError):
+                continue
+            acc.score_sum += norm(fv)
+            acc.score_count += 1
+            if is_rain:
+                acc.rain_sum += fv
+                acc.rain_count += 1
+            for name in metrics:
+                acc.set_metric(name, fv)
+
+
+def address_and_coords(data):
+    """(address, lat, lon) from the top level of a JSON report; lat/lon are None when absent."""
+    addr = None
+    lat = None
+    lon = None
+    def _try_get(obj, keys):
+        for k in keys:
+            if isinstance(obj, dict) and k in obj and obj[k] is not None:
+                return obj[k]
+        return None
+    if isinstance(data, dict):
+        raw = _try_get(data, ['address', 'location', 'field_address'])
+        lat = _try_get(data, ['lat', 'latitude'])
+        lon = _try_get(data, ['lon', 'lng', 'longitude'])
+        # Handle nested location object e.g. {"place": "Manaus, Brazil", "latitude": -3.1, "longitude": -60}
+        if isinstance(raw, dict):
+            addr_str = raw.get('place') or raw.get('name') or raw.get('address') or str(raw)
+            if not lat and raw.get('latitude') is not None:
+                try:
+                    lat = float(raw['latitude'])
+                except (TypeError, ValueError):
+                    pass
+            if not lon and raw.get('longitude') is not None:
+                try:
+                    lon = float(raw['longitude'])
+                except (TypeError, ValueError):
+                    pass
+            addr = addr_str if isinstance(addr_str, str) else (addr or raw)
+        else:
+            addr = raw
+    if isinstance(lat, str):
+        try:
+            lat = float(lat)
+        except Exception:
+            lat = None
+    if isinstance(lon, str):
+        try:
+            lon = float(lon)
+        except Exception:
+            lon = None
+    return addr, lat, lon
+
+
+def pdf_text(path):
+    """Extract text from PDF using pypdf or PyPDF2. Optimized for sensor/soil reports."""
+    from pdf_statement import page_texts  # deferred: pulls in NumPy and pypdf, only PDF reports need them
+    try:
+        text_parts = [t.strip() for t in page_texts(path) if t]
+    except Exception:
+        return ''
+    if not text_parts:
+        return ''
+    # Normalize: collapse multiple spaces, preserve newlines for structure
+    full = '\n'.join(text_parts)
+    full = re.sub(r'[ \t]+', ' ', full)  # collapse horizontal whitespace
+    full = re.sub(r'\n{3,}', '\n\n', full)  # max 2 consecutive newlines
+    return full.strip()
+
+
+_PDF_PH = re.compile(r'ph[:\s=]*(-?\d+(?:\.\d+)?)|(-?\d+(?:\.\d+)?)\s*(?:ph|pH)', re.I)
+_PDF_MOISTURE = re.compile(r'(\d+(?:\.\d+)?)\s*%|moisture[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*moisture', re.I)
+_PDF_NITROGEN = re.compile(r'nitrogen[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:ppm|mg/kg|mg kg)|n[:\s=]*(\d+(?:\.\d+)?)', re.I)
+_PDF_RAIN = re.compile(r'rainfall[:\s=]*(\d+(?:\.\d+)?)|precipitation[:\s=]*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:mm|mm\.?)', re.I)
+_ANY_NUMBER = re.compile(r'(-?\d+(?:\.\d+)?)')
+_ANY_UNSIGNED = re.compile(r'(\d+(?:\.\d+)?)')
+
+
+def _first_group(pattern, lower, stripped, fallback=_ANY_NUMBER):
+    m = pattern.search(lower)
+    val = next((g for g in m.groups() if g), None) if m else None
+    if not val:
+        m = fallback.search(stripped)
+        val = m.group(1) if m else None
+    return val
+
+
+def _walk_pdf_lines(text, acc):
+    """Key/value lines of a soil report PDF. Returns the address line, if any."""
+    addr = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        lower = stripped.lower()
+        if not acc.has_metric('ph') and ('ph' in lower or 'p.h' in lower):
+            val = _first_group(_PDF_PH, lower, stripped)
+            if val:
+                acc.set_metric('ph', float(val))
+                acc.add_score(normalize_metric('ph', float(val)))
+        if not acc.has_metric('moisture') and ('moist' in lower or 'humidity' in lower or '%' in stripped):
+            val = _first_group(_PDF_MOISTURE, lower, stripped)
+            if val:
+                acc.set_metric('moisture', float(val))
+                acc.add_score(normalize_metric('soil moisture', float(val)))
+        if not acc.has_metric('nitrogen') and ('nitrogen' in lower or 'n ' in lower or ' ppm' in lower or 'mg/kg' in lower):
+            val = _first_group(_PDF_NITROGEN, lower, stripped)
+            if val:
+                acc.set_metric('nitrogen', float(val))
+                acc.add_score(normalize_metric('nitrogen', float(val)))
+        if addr is None and ('address' in lower or 'location' in lower):
+            parts = stripped.split(':', 1)
+            addr = parts[1].strip() if len(parts) == 2 and parts[1].strip() else stripped
+        if 'rain' in lower or 'precip' in lower:
+            val = _first_group(_PDF_RAIN, lower, stripped, fallback=_ANY_UNSIGNED)
+            if val:
+                acc.rain_sum += float(val)
+                acc.rain_count += 1
+    return addr
+
+
+def parse_sensor_file(path, ext):
+    """Parse a sensor report. Returns (metrics, addr, lat, lon, score_mean, rainfall_total);
+    score_mean is the average 0-10 score over all readings (None if there were none)."""
+    addr = lat = lon = None
+    try:
+        if ext in ('.json', '.txt'):
+            acc = SensorAccumulator(average_metrics=True)
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                data = json.load(f)
+            _walk_json(data, acc)
+            addr, lat, lon = address_and_coords(data)
+        elif ext == '.csv':
+            acc = SensorAccumulator(average_metrics=False)
+            _walk_rows(iter_rows_csv(path), acc)
+        elif ext in ('.xlsx', '.xlsm', '.xltx', '.xltm'):
+            acc = SensorAccumulator(average_metrics=False)
+            _walk_rows(iter_rows_xlsx(path), acc)
+        elif ext == '.pdf':
+            acc = SensorAccumulator(average_metrics=False)
+            text = pdf_text(path)
+            if not text:
+                with open(path, 'rb') as f:
+                    text = f.read(40000).decode('utf-8', errors='ignore')[:10000]
+            addr = _walk_pdf_lines(text, acc)
+        else:
+            acc = SensorAccumulator(average_metrics=False)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Invalid JSON: {e}') from e
+    except Exception as e:
+        raise ValueError(f'Failed to parse file: {e}') from e
+    return acc.metrics(), addr, lat, lon, acc.score_mean(), acc.rainfall_total()
+
+
+# --- Batches (field agents upload a village's reports at once) ---
+
+BATCH_MAX_FILES = int(os.getenv('SENSOR_BATCH_MAX_FILES', 200))
+BATCH_MAX_BYTES = int(os.getenv('SENSOR_BATCH_MAX_BYTES', 200 * 1024 * 1024))  # uncompressed, whole archive
+MEMBER_MAX_BYTES = 16 * 1024 * 1024
+SENSOR_WORKERS = int(os.getenv('SENSOR_WORKERS', 0)) or min(4, os.cpu_count() or 1)
+INLINE_FILES = 2  # batches this small are parsed in-process
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=SENSOR_WORKERS)
+    return _pool
+
+
+def unpack_reports(zip_path, dest_dir, name_for):
+    """Copy the report files out of a zip archive. Returns [(original_name, path or None, error or None)].
+    Member names are never used as paths (name_for(ext) picks the file name), sizes are enforced while
+    copying rather than trusted from the headers, and nested archives / hidden files are skipped."""
+    out = []
+    total = 0
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+        for info in members:
+            name = info.filename.replace('\\', '/').rsplit('/', 1)[-1]
+            if not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue
+            if len(out) >= BATCH_MAX_FILES:
+                out.append((name, None, f'Archive has more than {BATCH_MAX_FILES} reports'))
+                break
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in SENSOR_EXTS:
+                out.append((name, None, 'Unsupported file type. Use JSON, PDF, CSV, or Excel.'))
+                continue
+            path = os.path.join(dest_dir, name_for(ext))
+            written = 0
+            error = None
+            with zf.open(info) as src, open(path, 'wb') as dst:
+                while True:
+                    chunk = src.read(64 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    total += len(chunk)
+                    if written > MEMBER_MAX_BYTES or total > BATCH_MAX_BYTES:
+                        error = 'File too large'
+                        break
+                    dst.write(chunk)
+            if error:
+                os.remove(path)
+                out.append((name, None, error))
+                if total > BATCH_MAX_BYTES:
+                    break
+                continue
+            out.append((name, path, None))
+    return out
+
+
+def _parse_one(path, ext):
+    """Pool task: parse_sensor_file, with parse errors returned instead of raised."""
+    try:
+        return parse_sensor_file(path, ext), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def parse_many(items):
+    """[(path, ext)] -> [(parsed tuple or None, error or None)] in order, spread across the process pool."""
+    if len(items) <= INLINE_FILES:
+        return [_parse_one(path, ext) for path, ext in items]
+    paths = [p for p, _ in items]
+    exts = [e for _, e in items]
+    return list(_get_pool().map(_parse_one, paths, exts, chunksize=max(1, len(items) // (SENSOR_WORKERS * 4))))
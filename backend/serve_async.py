@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Cooperative server for the API. gevent patches sockets, ssl, threads and sleeps before the app is
+imported, so every blocking upstream call (Gemini, OpenAI, Open-Meteo, Nominatim) only parks its own
+greenlet: a slow provider no longer starves crop analysis, chat, weather or sensor uploads, and one
+process holds hundreds of in-flight requests without adding OS threads. Per-host limits come from
+http_client. Sensor batches still parse in worker processes (sensor_parser), so CPU work stays off the
+event loop.
+
+Run: python serve_async.py   (PORT, ASYNC_MAX_CONNECTIONS)
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os  # noqa: E402
+
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from app import create_app  # noqa: E402
+
+PORT = int(os.getenv('PORT', 5000))
+MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 1000))
+
+
+if __name__ == '__main__':
+    app = create_app()
+    server = WSGIServer(('0.0.0.0', PORT), app, spawn=Pool(MAX_CONNECTIONS))
+    print(f'Serving on http://0.0.0.0:{PORT} (gevent, up to {MAX_CONNECTIONS} concurrent requests)')
+    server.serve_forever()
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar bank statement analytics. Statements are loaded into NumPy arrays
+(amount, direction, date, balance) in fixed-size blocks, then all activity features are
+computed in batch instead of per-row Python loops.
+"""
+
+import csv
+from datetime import date, datetime
+from itertools import islice
+
+import numpy as np
+
+from statement_parser import iter_json_records, iter_rows_xlsx, parse_amount
+
+BLOCK_ROWS = 65536
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y',
+                '%d-%b-%Y', '%d %b %Y', '%d-%b-%y', '%d %b %y', '%m/%d/%Y', '%Y/%m/%d')
+DEBIT_WORDS = ('dr', 'debit', 'withdrawal', 'wdl', 'out')
+CREDIT_WORDS = ('cr', 'credit', 'deposit', 'dep', 'in')
+NAT = np.datetime64('NaT', 'D')
+# Typed fast path for clean CSVs (plain numbers, ISO dates); anything else is loaded as text first
+CSV_DTYPES = {'amount': 'f8', 'debit': 'f8', 'credit': 'f8', 'balance': 'f8', 'date': 'M8[D]', 'type': 'U16'}
+
+
+def resolve_columns(headers):
+    """Map header names to column roles, once per file (or once per distinct JSON key set)."""
+    cols = {}
+    for j, h in enumerate(headers):
+        h = str(h).strip().lower() if h is not None else ''
+        if not h:
+            continue
+        if 'balance' in h or h == 'bal':
+            role = 'balance'
+        elif 'date' in h:
+            role = 'date'
+        elif 'debit' in h or 'withdrawal' in h or h in ('dr', 'dr amount', 'wdl amt'):
+            role = 'debit'
+        elif 'credit' in h or 'deposit' in h or h in ('cr', 'cr amount', 'dep amt'):
+            role = 'credit'
+        elif 'amount' in h or 'amt' in h:
+            role = 'amount'
+        elif h in ('type', 'txn type', 'transaction type', 'dr/cr', 'cr/dr'):
+            role = 'type'
+        else:
+            continue
+        cols.setdefault(role, j)
+    return cols
+
+
+def _parse_date(value):
+    if value is None or value == '':
+        return NAT
+    if isinstance(value, datetime):
+        return np.datetime64(value.date(), 'D')
+    if isinstance(value, date):
+        return np.datetime64(value, 'D')
+    s = str(value).strip()[:11].strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.strptime(s, fmt).date(), 'D')
+        except ValueError:
+            continue
+    return NAT
+
+
+def _to_float_array(values):
+    """Fast C-level cast when the column is clean, cleanup ('1,250.00', '') otherwise."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    arr = np.asarray(values)
+    if arr.dtype.kind == 'U':
+        cleaned = np.char.strip(np.char.replace(arr, ',', ''))
+        cleaned[cleaned == ''] = 'nan'
+        try:
+            return cleaned.astype(np.float64)
+        except ValueError:
+            pass
+    out = [parse_amount(v) for v in values]
+    return np.array([np.nan if v is None else v for v in out], dtype=np.float64)
+
+
+def _to_date_array(values, cache):
+    arr = np.asarray(values)
+    if arr.dtype.kind == 'M':
+        return arr.astype('datetime64[D]')
+    if arr.dtype.kind == 'U':
+        try:
+            return arr.astype('datetime64[D]')  # ISO dates parse in C
+        except ValueError:
+            pass
+        # Statements repeat the same few hundred dates: parse each distinct string once
+        uniq, inv = np.unique(arr, return_inverse=True)
+        parsed = np.array([cache[u] if u in cache else cache.setdefault(u, _parse_date(u)) for u in uniq.tolist()],
+                          dtype='datetime64[D]')
+        return parsed[inv]
+    out = np.empty(len(values), dtype='datetime64[D]')
+    for i, v in enumerate(values):
+        try:
+            d = cache[v]
+        except KeyError:
+            d = cache[v] = _parse_date(v)
+        except TypeError:
+            d = _parse_date(v)
+        out[i] = d
+    return out
+
+
+def _direction_words(values):
+    """'DR' / 'Debit' / 'Withdrawal' -> -1, 'CR' / 'Credit' / 'Deposit' -> +1, else 0."""
+    words = np.char.lower(np.char.strip(np.array([v if v is not None else '' for v in values], dtype=str)))
+    debit = np.isin(words, DEBIT_WORDS) | np.char.startswith(words, 'debit') | np.char.startswith(words, 'withdraw')
+    credit = np.isin(words, CREDIT_WORDS) | np.char.startswith(words, 'credit') | np.char.startswith(words, 'deposit')
+    return np.where(debit, -1, np.where(credit, 1, 0)).astype(np.int8)
+
+
+class _ColumnBuilder:
+    """Converts blocks of raw cells (one list per role) into NumPy arrays."""
+
+    def __init__(self, roles, fixed_direction=0):
+        self.roles = tuple(roles)
+        self.fixed_direction = fixed_direction
+        self.blocks = []
+        self.date_cache = {}
+
+    def add_block(self, columns):
+        raw = dict(zip(self.roles, columns))
+        n = len(columns[0]) if columns else 0
+        if not n:
+            return
+        amount = _to_float_array(raw['amount']) if 'amount' in raw else np.full(n, np.nan)
+        explicit = np.full(n, self.fixed_direction, dtype=np.int8)
+        if 'debit' in raw or 'credit' in raw:
+            debit = np.abs(_to_float_array(raw['debit'])) if 'debit' in raw else np.full(n, np.nan)
+            credit = np.abs(_to_float_array(raw['credit'])) if 'credit' in raw else np.full(n, np.nan)
+            is_debit = np.nan_to_num(debit) > 0
+            is_credit = ~is_debit & (np.nan_to_num(credit) > 0)
+            amount = np.where(is_debit, debit, np.where(is_credit, credit, amount))
+            explicit = np.where(is_debit, -1, np.where(is_credit, 1, explicit)).astype(np.int8)
+        if 'type' in raw:
+            words = _direction_words(raw['type'])
+            explicit = np.where(words != 0, words, explicit).astype(np.int8)
+        keep = ~np.isnan(amount)
+        kept = int(keep.sum())
+        self.blocks.append({
+            'amount': amount[keep],
+            'explicit': explicit[keep],
+            'date': _to_date_array(raw['date'], self.date_cache)[keep] if 'date' in raw else np.full(kept, NAT),
+            'balance': _to_float_array(raw['balance'])[keep] if 'balance' in raw else np.full(kept, np.nan),
+        })
+
+    def build(self):
+        if not self.blocks:
+            return empty_columns()
+        signed = np.concatenate([b['amount'] for b in self.blocks])
+        explicit = np.concatenate([b['explicit'] for b in self.blocks])
+        # Amount signs only mean direction if the statement uses negative amounts at all
+        implied = np.sign(signed).astype(np.int8) if (signed < 0).any() else np.zeros(signed.size, dtype=np.int8)
+        return {
+            'amount': np.abs(signed),
+            'direction': np.where(explicit != 0, explicit, implied).astype(np.int8),
+            'date': np.concatenate([b['date'] for b in self.blocks]),
+            'balance': np.concatenate([b['balance'] for b in self.blocks]),
+        }
+
+
+def empty_columns():
+    return {
+        'amount': np.zeros(0, dtype=np.float64),
+        'direction': np.zeros(0, dtype=np.int8),
+        'date': np.zeros(0, dtype='datetime64[D]'),
+        'balance': np.zeros(0, dtype=np.float64),
+    }
+
+
+def _amount_roles(roles):
+    """Roles to load plus a fixed direction when a lone Debit/Credit column is the amount column."""
+    if 'amount' in roles or ('debit' in roles and 'credit' in roles):
+        return roles, 0
+    for only, sign in (('debit', -1), ('credit', 1)):
+        if only in roles:
+            roles = dict(roles)
+            roles['amount'] = roles.pop(only)
+            return roles, sign
+    return None, 0
+
+
+def _column(block, j):
+    try:
+        return [row[j] for row in block]
+    except IndexError:
+        return [row[j] if j < len(row) else None for row in block]
+
+
+def columns_from_rows(rows):
+    """Load a header + rows iterator (XLSX) into column arrays, BLOCK_ROWS rows at a time."""
+    rows = iter(rows)
+    roles, fixed = _amount_roles(resolve_columns(next(rows, None) or ()))
+    if roles is None:
+        return empty_columns()
+    order = list(roles)
+    builder = _ColumnBuilder(order, fixed)
+    while True:
+        block = list(islice(rows, BLOCK_ROWS))
+        if not block:
+            break
+        builder.add_block([_column(block, roles[r]) for r in order])
+    return builder.build()
+
+
+def columns_from_csv(path):
+    """Load a CSV statement into column arrays. Each block of lines goes through NumPy's C tokenizer,
+    typed when the cells are clean and as text otherwise; blocks it cannot handle at all (ragged rows,
+    odd quoting) fall back to the csv module."""
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        header = next(csv.reader([f.readline()]), None)
+        roles, fixed = _amount_roles(resolve_columns(header or ()))
+        if roles is None:
+            return empty_columns()
+        order = list(roles)
+        usecols = [roles[r] for r in order]
+        builder = _ColumnBuilder(order, fixed)
+        typed = np.dtype([(r, CSV_DTYPES[r]) for r in order])
+        while True:
+            lines = list(islice(f, BLOCK_ROWS))
+            if not lines:
+                break
+            try:
+                rec = np.loadtxt(lines, delimiter=',', quotechar='"', comments=None,
+                                 usecols=usecols, dtype=typed, ndmin=1)
+                columns = [rec[r] for r in order]
+            except ValueError:
+                try:
+                    arr = np.loadtxt(lines, delimiter=',', quotechar='"', comments=None,
+                                     usecols=usecols, dtype=str, ndmin=2)
+                    columns = [arr[:, k] for k in range(len(order))]
+                except ValueError:
+                    block = list(csv.reader(lines))
+                    columns = [_column(block, j) for j in usecols]
+            builder.add_block(columns)
+    return builder.build()
+
+
+def columns_from_records(records):
+    """Load flat JSON records (one per transaction) into column arrays."""
+    order = ('amount', 'debit', 'credit', 'date', 'balance', 'type')
+    builder = _ColumnBuilder(order)
+    resolved = {}
+    block = []
+    for rec in records:
+        keys = tuple(rec)
+        plan = resolved.get(keys)
+        if plan is None:
+            roles, fixed = _amount_roles({r: keys[j] for r, j in resolve_columns(keys).items()})
+            plan = resolved[keys] = None if roles is None else (
+                [roles.get(r) for r in order], {-1: 'debit', 1: 'credit'}.get(fixed))
+        if plan is None:
+            continue
+        keymap, fixed_word = plan
+        values = [rec.get(k) if k is not None else None for k in keymap]
+        if fixed_word:
+            values[-1] = fixed_word
+        block.append(values)
+        if len(block) >= BLOCK_ROWS:
+            builder.add_block([list(c) for c in zip(*block)])
+            block = []
+    if block:
+        builder.add_block([list(c) for c in zip(*block)])
+    return builder.build()
+
+
+def columns_from_table(columns, infer_from_balance=False):
+    """Column arrays from already-extracted cell lists keyed by role (e.g. PDF tables).
+    With infer_from_balance, rows without an explicit direction take it from the balance change."""
+    roles = [r for r in columns if columns[r] is not None]
+    builder = _ColumnBuilder(roles)
+    builder.add_block([columns[r] for r in roles])
+    cols = builder.build()
+    if infer_from_balance and cols['amount'].size:
+        change = np.diff(cols['balance'], prepend=np.nan)
+        unknown = (cols['direction'] == 0) & ~np.isnan(change) & (change != 0)
+        cols['direction'][unknown] = np.sign(change[unknown]).astype(np.int8)
+    return cols
+
+
+def load_statement(path, ext):
+    """Column arrays for a statement file, or None for unsupported types."""
+    if ext in ('.csv',):
+        return columns_from_csv(path)
+    if ext in ('.xlsx', '.xlsm', '.xltx', '.xltm'):
+        return columns_from_rows(iter_rows_xlsx(path))
+    if ext in ('.json', '.txt'):
+        return columns_from_records(iter_json_records(path))
+    return None
+
+
+def _group_counts(pairs, span):
+    """Distinct (group, value) pairs encoded as group * span + value -> (groups, distinct count per group)."""
+    groups = np.unique(pairs) // span
+    return np.unique(groups, return_counts=True)
+
+
+def _recurring_payments(amount, date, direction, limit=10):
+    """Outflows of the same (rounded) amount seen in 3+ distinct months roughly a month apart."""
+    mask = ~np.isnat(date) & (amount > 0)
+    if (direction == -1).any():
+        mask &= direction == -1
+    if mask.sum() < 3:
+        return []
+    amt = np.round(amount[mask]).astype(np.int64)
+    days = date[mask].astype(np.int64)
+    days -= days.min()
+    months = date[mask].astype('datetime64[M]').astype(np.int64)
+    months -= months.min()
+    span = int(max(days.max(), months.max())) + 1
+    values, occurrences = np.unique(amt, return_counts=True)
+    _, month_counts = _group_counts(amt * span + months, span)
+    # Average gap between distinct payment days: (last - first) / (distinct days - 1)
+    day_pairs = np.unique(amt * span + days)
+    day_groups, starts, day_counts = np.unique(day_pairs // span, return_index=True, return_counts=True)
+    first = day_pairs[starts] % span
+    last = day_pairs[starts + day_counts - 1] % span
+    interval = (last - first) / np.maximum(day_counts - 1, 1)
+    hit = (month_counts >= 3) & (day_counts >= 3) & (interval >= 25) & (interval <= 35)
+    order = np.lexsort((-values[hit], -month_counts[hit]))[:limit]
+    return [
+        {'amount': float(v), 'occurrences': int(c), 'months': int(mc)}
+        for v, c, mc in zip(values[hit][order], occurrences[hit][order], month_counts[hit][order])
+    ]
+
+
+def compute_features(cols, threshold=500.0):
+    """Batch activity features from column arrays."""
+    amount = cols['amount']
+    direction = cols['direction']
+    dates = cols['date']
+    balance = cols['balance']
+    total = int(amount.size)
+    small = int(np.count_nonzero(amount <= threshold))
+    features = {
+        'smallTransactions': small,
+        'totalTransactions': total,
+        'activityRatio': (small / total) if total else 0.0,
+        'totalVolume': round(float(amount.sum()), 2),
+        'totalInflow': round(float(amount[direction == 1].sum()), 2),
+        'totalOutflow': round(float(amount[direction == -1].sum()), 2),
+        'activeMonths': 0,
+        'transactionsPerMonth': 0.0,
+        'monthly': [],
+        'balanceVolatility': None,
+        'recurringPayments': [],
+    }
+    dated = ~np.isnat(dates)
+    if dated.any():
+        month_idx = dates[dated].astype('datetime64[M]')
+        months, inv = np.unique(month_idx, return_inverse=True)
+        amt, dirn = amount[dated], direction[dated]
+        inflow = np.bincount(inv, weights=np.where(dirn == 1, amt, 0.0), minlength=len(months))
+        outflow = np.bincount(inv, weights=np.where(dirn == -1, amt, 0.0), minlength=len(months))
+        counts = np.bincount(inv, minlength=len(months))
+        features['activeMonths'] = int(len(months))
+        features['transactionsPerMonth'] = round(float(counts.mean()), 1)
+        features['monthly'] = [
+            {'month': str(m), 'inflow': round(float(i), 2), 'outflow': round(float(o), 2), 'count': int(c)}
+            for m, i, o, c in zip(months, inflow, outflow, counts)
+        ]
+        features['recurringPayments'] = _recurring_payments(amount, dates, direction)
+    bal = balance[~np.isnan(balance)]
+    if bal.size < 2 and (direction != 0).any():
+        # No balance column: use the running net flow as a balance proxy
+        bal = np.cumsum(amount * direction)
+    if bal.size >= 2:
+        mean = float(np.abs(bal).mean())
+        features['balanceVolatility'] = round(float(bal.std()) / mean, 3) if mean else None
+    return features
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming bank statement readers. Every reader yields rows/values one at a time so memory
+stays flat no matter how large the statement is (co-operative banks send yearly files).
+"""
+
+import csv
+import json
+import re
+
+from lazy_imports import require
+
+# A JSON string (optionally followed by ": <scalar>") or an object brace. Quotes only occur inside
+# strings, so scanning string-to-string never loses alignment; everything else is structure we can skip.
+_JSON_STRING = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+_JSON_MEMBER = re.compile(
+    _JSON_STRING
+    + r'(?:\s*:\s*(?:' + _JSON_STRING + r'|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|(true|false|null))?)?'
+    + r'|([{}])'
+)
+_JSON_LITERALS = {'true': True, 'false': False, 'null': None}
+_TOKEN_MARGIN = 64  # a match this close to the end of the buffer may continue in the next chunk
+
+
+def _json_unescape(s):
+    return json.loads(f'"{s}"') if '\\' in s else s
+
+
+def parse_amount(value):
+    """'1,250.00' / 1250 / ' 1250 ' -> 1250.0; anything else -> None."""
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace(',', '').strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_rows_csv(path):
+    """Yield each CSV row as a list (header row first)."""
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        yield from csv.reader(f)
+
+
+def iter_rows_xlsx(path):
+    """Yield each row of the active sheet as a tuple, without loading the workbook into memory."""
+    wb = require('openpyxl').load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_json_events(path, chunk_size=1024 * 1024):
+    """Incremental JSON scan in chunks: yields ('pair', (key, scalar)) for object members with a
+    non-container value, and ('start', None) / ('end', None) for object braces."""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        carry = ''
+        eof = False
+        while not eof:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = carry + chunk
+            carry = ''
+            pos = 0
+            for m in _JSON_MEMBER.finditer(buf):
+                key, s_val, num, lit, brace = m.groups()
+                if not eof and (m.end() + _TOKEN_MARGIN > len(buf) or buf.startswith('"', m.end())):
+                    # Possibly cut mid-token (or a string value still being read): rescan with the next chunk
+                    carry = buf[m.start():]
+                    break
+                pos = m.end()
+                if brace is not None:
+                    yield ('start' if brace == '{' else 'end'), None
+                elif s_val is not None:
+                    yield 'pair', (_json_unescape(key), _json_unescape(s_val))
+                elif num is not None:
+                    yield 'pair', (_json_unescape(key), float(num))
+                elif lit is not None:
+                    yield 'pair', (_json_unescape(key), _JSON_LITERALS[lit])
+            else:
+                # No complete string left; keep only an unterminated one so the next scan stays aligned
+                quote = buf.find('"', pos)
+                carry = buf[quote:] if quote != -1 and not eof else ''
+
+
+def iter_json_pairs(path):
+    """Yield (key, scalar) for every object member whose value is not a container."""
+    for kind, value in iter_json_events(path):
+        if kind == 'pair':
+            yield value
+
+
+def iter_json_records(path):
+    """Yield each JSON object's scalar members as a flat dict (nested objects become their own records)."""
+    stack = []
+    for kind, value in iter_json_events(path):
+        if kind == 'pair':
+            if stack:
+                stack[-1][value[0]] = value[1]
+        elif kind == 'start':
+            stack.append({})
+        elif stack:
+            record = stack.pop()
+            if record:
+                yield record
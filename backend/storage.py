@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Where upload bytes live. LocalStorage keeps them in a directory (one node, or a mounted volume);
+S3Storage keeps them in an S3-compatible bucket (AWS S3, MinIO, Ceph, R2) so every app node sees the
+same uploads without NFS. Both write from a stream (S3 in multipart parts, so memory stays at one
+part whatever the file size) and read byte ranges. The parsers need real files, so objects are
+fetched into a local cache directory the first time a node needs them.
+
+Keys are '/'-separated relative paths ('blobs/ab/cd/<sha256>.jpg'); the local copy of a key is
+always local_root/<key>, on every backend.
+"""
+
+import os
+import uuid
+
+from lazy_imports import require
+
+CHUNK_SIZE = 1024 * 1024
+STORAGE_BACKEND = (os.getenv('STORAGE_BACKEND') or 'local').strip().lower()
+S3_PART_SIZE = int(float(os.getenv('S3_PART_SIZE_MB', 8)) * 1024 * 1024)  # S3 requires >= 5 MB except the last part
+
+
+def _check_key(key):
+    parts = (key or '').split('/')
+    if not key or key.startswith('/') or any(p in ('', '.', '..') for p in parts[:-1]) or parts[-1] in ('.', '..'):
+        raise ValueError(f'Invalid storage key: {key!r}')
+    return key
+
+
+def _atomic_write(path, chunks):
+    """Write chunks to path via a temp file in the same folder, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{uuid.uuid4().hex}.part'
+    size = 0
+    try:
+        with open(tmp, 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return size
+
+
+def iter_stream(stream, chunk_size=CHUNK_SIZE):
+    return iter(lambda: stream.read(chunk_size), b'')
+
+
+def read_full(stream, size):
+    """Up to size bytes; keeps reading across short reads (sockets, request bodies) until EOF."""
+    chunks, remaining = [], size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+class TooLarge(Exception):
+    """A capped stream delivered more than its limit."""
+
+
+class CappedStream:
+    """Reads through to stream, raising TooLarge once more than limit bytes have come through (for request
+    bodies without a Content-Length). A backend's put_stream then discards what it wrote."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size if size is not None and size >= 0 else self.remaining + 1)
+        self.remaining -= len(chunk)
+        if self.remaining < 0:
+            raise TooLarge()
+        return chunk
+
+
+def iter_file(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Bytes start..end (inclusive; end None = to the end of the file)."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class LocalStorage:
+    remote = False
+
+    def __init__(self, root):
+        self.local_root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key):
+        return os.path.join(self.local_root, *_check_key(key).split('/'))
+
+    def put_stream(self, key, stream):
+        """Store everything read from stream under key. Returns the size in bytes."""
+        return _atomic_write(self.local_path(key), iter_stream(stream))
+
+    def put_file(self, key, path):
+        target = self.local_path(key)
+        if os.path.abspath(path) == os.path.abspath(target):
+            return os.path.getsize(path)
+        return _atomic_write(target, iter_file(path))
+
+    def stat(self, key):
+        """(size, modified time); FileNotFoundError when the key does not exist."""
+        st = os.stat(self.local_path(key))
+        return st.st_size, st.st_mtime
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def stream(self, key, start=0, end=None):
+        return iter_file(self.local_path(key), start, end)
+
+    def read_range(self, key, start=0, end=None):
+        return b''.join(self.stream(key, start, end))
+
+    def touch(self, key):
+        os.utime(self.local_path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        """(key, size, modified time) for every key under prefix ('blobs/')."""
+        base = self.local_path(prefix.rstrip('/'))
+        for folder, _, names in os.walk(base):
+            for name in names:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.local_root).replace(os.sep, '/'), st.st_size, st.st_mtime
+
+    def fetch(self, key):
+        """Local path of key (already local here)."""
+        path = self.local_path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        return path
+
+    def stats(self):
+        return {'backend': 'local', 'root': self.local_root}
+
+
+class S3Storage:
+    """S3 API driver (boto3). endpoint_url points it at MinIO or another S3-compatible service;
+    credentials come from the usual AWS_* environment variables or instance profile."""
+    remote = True
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, local_root='uploads',
+                 part_size=S3_PART_SIZE, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.local_root = local_root
+        self.part_size = max(5 * 1024 * 1024, part_size)
+        self.s3 = client or require('boto3').client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self._fetched = 0
+
+    def _key(self, key):
+        return self.prefix + _check_key(key)
+
+    def local_path(self, key):
+        return os.path.join(self.local_root, *_check_key(key).split('/'))
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put_stream(self, key, stream):
+        """Upload from a stream: one PUT when it fits in a part, otherwise a multipart upload that
+        holds one part in memory at a time (aborted on failure, so no orphaned parts are billed)."""
+        first = read_full(stream, self.part_size)
+        if len(first) < self.part_size:
+            self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=first)
+            return len(first)
+        upload = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self._key(key))
+        parts, size, number, body = [], 0, 1, first
+        try:
+            while body:
+                part = self.s3.upload_part(Bucket=self.bucket, Key=self._key(key), UploadId=upload['UploadId'],
+                                           PartNumber=number, Body=body)
+                parts.append({'ETag': part['ETag'], 'PartNumber': number})
+                size += len(body)
+                number += 1
+                body = read_full(stream, self.part_size)
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload['UploadId'],
+                                              MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload['UploadId'])
+            raise
+        return size
+
+    def put_file(self, key, path):
+        with open(path, 'rb') as f:
+            return self.put_stream(key, f)
+
+    def stat(self, key):
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self.s3.exceptions.ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def exists(self, key):
+        try:
+            self.stat(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stream(self, key, start=0, end=None):
+        """Bytes start..end (inclusive) with a ranged GET, streamed in chunks."""
+        kwargs = {}
+        if start or end is not None:
+            kwargs['Range'] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self._key(key), **kwargs)['Body']
+        except self.s3.exceptions.ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def read_range(self, key, start=0, end=None):
+        return b''.join(self.stream(key, start, end))
+
+    def touch(self, key):
+        """Refresh LastModified (the retention clock) with an in-place server-side copy."""
+        self.s3.copy_object(Bucket=self.bucket, Key=self._key(key), MetadataDirective='REPLACE',
+                            CopySource={'Bucket': self.bucket, 'Key': self._key(key)})
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=self._key(key))
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get('Contents', ()):
+                yield obj['Key'][len(self.prefix):], obj['Size'], obj['LastModified'].timestamp()
+
+    def fetch(self, key):
+        """Local path of key, downloading it into the local cache on first use."""
+        path = self.local_path(key)
+        if not os.path.isfile(path):
+            _atomic_write(path, self.stream(key))
+            self._fetched += 1
+        return path
+
+    def stats(self):
+        return {'backend': 's3', 'bucket': self.bucket, 'prefix': self.prefix, 'fetched': self._fetched}
+
+
+def make_storage(local_root):
+    """Backend from STORAGE_BACKEND (local or s3; S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)."""
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(
+            os.environ['S3_BUCKET'],
+            prefix=os.getenv('S3_PREFIX', ''),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+            region=os.getenv('S3_REGION'),
+            local_root=local_root,
+        )
+    return LocalStorage(local_root)
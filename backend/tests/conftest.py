@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    """The Flask app module on a throwaway SQLite database, cache and upload folder."""
+    root = tmp_path_factory.mktemp('backend')
+    os.environ['DATABASE_URL'] = f'sqlite:///{root / "krishimitra.db"}'
+    os.environ['CACHE_FOLDER'] = str(root / 'cache')
+    os.environ.setdefault('JWT_SECRET_KEY', 'test-secret-key-long-enough-for-hs256')
+    cwd = os.getcwd()
+    os.chdir(root)  # uploads/ is relative to the working directory
+    try:
+        import app
+        app.create_app(resume_jobs=False)
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
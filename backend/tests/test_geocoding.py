@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoding import RateLimiter  # noqa: E402
+
+
+def test_limiter_is_shared_through_the_database(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    worker_a = RateLimiter(path, 'nominatim', min_interval=0.3, max_wait=1)
+    worker_b = RateLimiter(path, 'nominatim', min_interval=0.3, max_wait=1)
+    started = time.monotonic()
+    assert worker_a.acquire()
+    assert worker_b.acquire()
+    assert time.monotonic() - started >= 0.25
+
+
+def test_limiter_gives_up_instead_of_waiting(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    assert RateLimiter(path, 'nominatim', min_interval=30, max_wait=1).acquire()
+    other = RateLimiter(path, 'nominatim', min_interval=30, max_wait=1)
+    started = time.monotonic()
+    assert not other.acquire()
+    assert time.monotonic() - started < 0.5
+    assert other.rejected == 1
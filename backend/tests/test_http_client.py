@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import public_url_error  # noqa: E402
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1:5000/hook',
+    'http://10.1.2.3/hook',
+    'http://192.168.0.10/hook',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook',
+    'http://localhost/hook',
+    'ftp://93.184.216.34/hook',
+    'http:///hook',
+])
+def test_internal_and_non_http_urls_rejected(url):
+    assert public_url_error(url) is not None
+
+
+def test_public_address_allowed():
+    assert public_url_error('https://93.184.216.34/hook') is None
+
+
+def test_allowlist():
+    assert public_url_error('https://hooks.example.com/x', {'hooks.example.com'}) is None
+    assert public_url_error('https://93.184.216.34/x', {'hooks.example.com'}) == 'host is not allowed'
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import knowledge  # noqa: E402
+
+
+@pytest.mark.parametrize('question, section', [
+    ('trust score?', 'Trust Score (0–100)'),
+    ('customer care phone number', 'Contact and support'),
+    ('how do I redeem a voucher', 'Vouchers (Redeemable Vouchers)'),
+])
+def test_faq_answered_directly(question, section):
+    assert knowledge.answer(question)['section'] == section
+
+
+@pytest.mark.parametrize('question', [
+    'delete my account',
+    'my bank statement upload failed with error 500',
+    'voucher not working at dealer shop, refund?',
+    'rainfall was 5mm, will I get insurance payout?',
+    'vouchers',
+    'मेरा लोन नहीं मिला',
+])
+def test_complaints_and_specific_questions_go_to_model(question):
+    assert knowledge.answer(question) is None
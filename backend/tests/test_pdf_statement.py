@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pypdf = pytest.importorskip('pypdf')
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject  # noqa: E402
+
+import pdf_statement  # noqa: E402
+
+
+def _xobject_pdf(path, lines):
+    """A one-page PDF whose text is drawn by a Form XObject; the page itself only says 'q /Fx Do Q'."""
+    writer = pypdf.PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Courier'),
+    }))
+    body = 'BT /F1 10 Tf 12 TL 40 750 Td ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+    form = DecodedStreamObject()
+    form.set_data(body.encode('latin-1'))
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(612), FloatObject(792)]),
+        NameObject('/Resources'): DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        }),
+    })
+    contents = DecodedStreamObject()
+    contents.set_data(b'q /Fx Do Q')
+    page[NameObject('/Contents')] = writer._add_object(contents)
+    page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/XObject'): DictionaryObject({NameObject('/Fx'): writer._add_object(form)}),
+    })
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+STATEMENT = [
+    'Date        Description          Amount      Balance',
+    '01/04/2024  UPI grocery          250.00      9750.00',
+    '03/04/2024  UPI seeds            1,200.00    8550.00',
+    '07/04/2024  Salary credit        15,000.00 Cr 23550.00',
+]
+OTHER = [
+    'Date        Description          Amount      Balance',
+    '02/05/2024  Fertiliser           999.00      1001.00',
+]
+
+
+def test_xobject_page_text_falls_back_to_plain_extraction(tmp_path):
+    path = _xobject_pdf(str(tmp_path / 'a.pdf'), STATEMENT)
+    text = pdf_statement.page_texts(path, layout=True)[0]
+    assert 'UPI seeds' in text
+    assert len(pdf_statement.load_pdf_statement(path)['amount']) == 3
+
+
+def test_page_key_covers_xobject_content(tmp_path):
+    reader_a = pypdf.PdfReader(_xobject_pdf(str(tmp_path / 'a.pdf'), STATEMENT))
+    reader_b = pypdf.PdfReader(_xobject_pdf(str(tmp_path / 'b.pdf'), OTHER))
+    reader_c = pypdf.PdfReader(_xobject_pdf(str(tmp_path / 'c.pdf'), STATEMENT))
+    key_a = pdf_statement._page_key(reader_a.pages[0])
+    assert key_a != pdf_statement._page_key(reader_b.pages[0])
+    assert key_a == pdf_statement._page_key(reader_c.pages[0])
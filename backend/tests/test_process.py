@@ -0,0 +1,38 @@
+import io
+import uuid
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def auth(backend):
+    with backend.app.app_context():
+        name = uuid.uuid4().hex[:12]
+        user = backend.User(username=name, email=f'{name}@example.com', password='x')
+        backend.db.session.add(user)
+        backend.db.session.commit()
+        return {'Authorization': 'Bearer ' + create_access_token(identity=str(user.id))}
+
+
+def _upload_photo(client, auth):
+    buf = io.BytesIO()
+    PIL.new('RGB', (8, 8), (40, 160, 40)).save(buf, 'PNG')
+    buf.seek(0)
+    r = client.post('/api/upload', headers=auth, content_type='multipart/form-data',
+                    data={'file': (buf, 'leaf.png')})
+    return r.get_json()['file_id']
+
+
+def test_numeric_fields_are_accepted_as_text(client, auth):
+    file_id = _upload_photo(client, auth)
+    r = client.post(f'/api/process/{file_id}', headers=auth, json={'type': 'image', 'stage': 2})
+    assert r.status_code == 202
+
+
+def test_invalid_field_types_are_client_errors(client, auth):
+    file_id = _upload_photo(client, auth)
+    assert client.post(f'/api/process/{file_id}', headers=auth, json={'priority': 5}).status_code == 400
+    assert client.post(f'/api/process/{file_id}', headers=auth, json=[1, 2]).status_code == 400
@@ -0,0 +1,78 @@
+import io
+import json
+
+READING = {'ts': '2026-07-10T00:00:00Z', 'metric': 'rainfall', 'value': 10}
+
+
+def _kharif(client, farm_id):
+    return client.get(f'/api/farms/{farm_id}/rainfall?season=kharif&year=2026').get_json()['season']
+
+
+def test_retried_readings_are_counted_once(client):
+    first = client.post('/api/farms/retry-1/readings', json={'readings': [READING]}).get_json()
+    again = client.post('/api/farms/retry-1/readings', json={'readings': [READING, READING]}).get_json()
+    assert (first['accepted'], again['accepted'], again['duplicates']) == (1, 0, 2)
+    window = _kharif(client, 'retry-1')
+    assert (window['totalMm'], window['readings']) == (10.0, 1)
+    day = client.get('/api/farms/retry-1/readings?metric=rainfall&resolution=day'
+                     '&from=2026-07-01T00:00:00Z&to=2026-07-31T00:00:00Z').get_json()
+    assert [(b['count'], b['sum']) for b in day['series']['rainfall']] == [(1, 10.0)]
+
+
+def test_new_readings_still_add_up(client):
+    client.post('/api/farms/retry-2/readings', json={'readings': [READING]})
+    client.post('/api/farms/retry-2/readings', json={'readings': [dict(READING, ts='2026-07-11T00:00:00Z', value=5)]})
+    window = _kharif(client, 'retry-2')
+    assert (window['totalMm'], window['readings']) == (15.0, 2)
+
+
+def test_reuploaded_report_is_ingested_once(client):
+    report = json.dumps({'ph': 6.8, 'rainfall': 12}).encode()
+
+    def upload():
+        return client.post('/api/sensor-readings', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(report), 'lab.json'), 'farmId': 'report-1', 'takenAt': '2026-08-02T06:00:00Z',
+        }).get_json()
+
+    assert upload()['samplesAdded'] == 2
+    assert upload()['samplesAdded'] == 0
+    window = _kharif(client, 'report-1')
+    assert (window['totalMm'], window['readings']) == (12.0, 1)
+
+
+
+def test_year_out_of_range_is_rejected(client):
+    for year in (0, 10000):
+        assert client.get(f'/api/farms/f1/rainfall?year={year}').status_code == 400
+        assert client.get(f'/api/rainfall/eligible?threshold=10&year={year}').status_code == 400
+
+
+def test_bad_epoch_rejects_only_that_reading(client):
+    r = client.post('/api/farms/epoch-1/readings', json={'readings': [dict(READING, ts=1e20), READING]})
+    assert r.status_code == 201
+    assert (r.get_json()['accepted'], r.get_json()['rejected']) == (1, [{'index': 0, 'error': 'invalid ts'}])
+
+
+def _batch(client, files, **form):
+    data = dict(form, files=[(io.BytesIO(body), name) for name, body in files])
+    return client.post('/api/sensor-readings/batch', content_type='multipart/form-data', data=data)
+
+
+def test_batch_reports_feed_the_farm_once(client):
+    report = json.dumps({'moisture': 30, 'rainfall': 7}).encode()
+    other = json.dumps({'rainfall': 3}).encode()
+    r = _batch(client, [('a.json', report), ('b.json', report), ('c.json', other)],
+               farmId='batch-1', farmIds=json.dumps({'c.json': 'batch-2'}), takenAt='2026-09-01T00:00:00Z')
+    results = r.get_json()['results']
+    assert [(x['farmId'], x['samplesAdded']) for x in results] == [('batch-1', 2), ('batch-1', 0), ('batch-2', 1)]
+    _batch(client, [('a.json', report)], farmId='batch-1', takenAt='2026-09-01T00:00:00Z')
+    assert _kharif(client, 'batch-1')['totalMm'] == 7.0
+    assert _kharif(client, 'batch-2')['totalMm'] == 3.0
+
+
+def test_oversized_batch_is_refused_before_storing(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'BATCH_MAX_FILES', 2)
+    before = sum(1 for _ in backend.upload_storage.list('blobs/'))
+    bodies = [(f'{i}.json', json.dumps({'ph': 6 + i / 10}).encode()) for i in range(3)]
+    assert _batch(client, bodies).status_code == 413
+    assert sum(1 for _ in backend.upload_storage.list('blobs/')) == before
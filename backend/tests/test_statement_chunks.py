@@ -0,0 +1,32 @@
+import io
+
+
+def _start(client):
+    return client.post('/api/bank-statement/chunks', json={'filename': 'statement.csv'}).get_json()['uploadId']
+
+
+def test_offset_is_required(client):
+    upload_id = _start(client)
+    r = client.put(f'/api/bank-statement/chunks/{upload_id}', data=b'date,amount\n')
+    assert r.status_code == 400
+    assert client.put(f'/api/bank-statement/chunks/{upload_id}?offset=0', data=b'date,amount\n').get_json()['received'] == 12
+    # A retried PUT of the same chunk is refused instead of appended
+    assert client.put(f'/api/bank-statement/chunks/{upload_id}?offset=0', data=b'date,amount\n').status_code == 409
+
+
+def test_total_size_is_capped(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'STATEMENT_UPLOAD_MAX', 20)
+    upload_id = _start(client)
+    assert client.put(f'/api/bank-statement/chunks/{upload_id}?offset=0', data=b'x' * 15).status_code == 200
+    r = client.put(f'/api/bank-statement/chunks/{upload_id}?offset=15', data=b'x' * 10)
+    assert (r.status_code, r.get_json()['received']) == (413, 15)
+
+
+def test_streamed_chunk_without_length_is_capped(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'STATEMENT_UPLOAD_MAX', 20)
+    upload_id = _start(client)
+    r = client.put(f'/api/bank-statement/chunks/{upload_id}?offset=0', input_stream=io.BytesIO(b'y' * 50),
+                   headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True})
+    assert r.status_code == 413
+    r = client.put(f'/api/bank-statement/chunks/{upload_id}?offset=0', data=b'y' * 20)
+    assert (r.status_code, r.get_json()['received']) == (200, 20)
@@ -0,0 +1,46 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timeseries import parse_readings, parse_timestamp, rainfall_windows, season_bounds, season_of  # noqa: E402
+
+
+def test_season_of_labels_rabi_with_its_start_year():
+    assert season_of(datetime(2026, 7, 10)) == ('kharif', 2026)
+    assert season_of(datetime(2025, 12, 31)) == ('rabi', 2025)
+    assert season_of(datetime(2026, 2, 28)) == ('rabi', 2025)
+    assert season_of(datetime(2026, 3, 1)) == ('zaid', 2026)
+
+
+def test_season_bounds():
+    assert season_bounds('kharif', 2026) == (datetime(2026, 6, 1), datetime(2026, 11, 1))
+    assert season_bounds('rabi', 2025) == (datetime(2025, 11, 1), datetime(2026, 3, 1))
+    assert season_bounds('zaid', 2026) == (datetime(2026, 3, 1), datetime(2026, 6, 1))
+
+
+def test_rainfall_windows_split_by_season():
+    samples = [
+        ('rainfall', datetime(2026, 7, 10), 10.0),
+        ('rainfall', datetime(2026, 6, 1), 2.5),
+        ('ph', datetime(2026, 7, 10), 6.8),
+        ('rainfall', datetime(2026, 1, 5), 4.0),
+        ('rainfall', datetime(2025, 11, 20), 1.0),
+    ]
+    assert rainfall_windows(samples) == {
+        ('kharif', 2026): [2, 12.5, datetime(2026, 6, 1), datetime(2026, 7, 10)],
+        ('rabi', 2025): [2, 5.0, datetime(2025, 11, 20), datetime(2026, 1, 5)],
+    }
+
+
+
+def test_out_of_range_epoch_is_rejected_per_reading():
+    assert parse_timestamp(1e20) is None
+    assert parse_timestamp(-1e20) is None
+    samples, errors = parse_readings({'readings': [
+        {'ts': 1e20, 'metric': 'rainfall', 'value': 1},
+        {'ts': '2026-07-10T00:00:00Z', 'metric': 'rainfall', 'value': 2},
+    ]})
+    assert samples == [('rainfall', datetime(2026, 7, 10), 2.0)]
+    assert errors == [{'index': 0, 'error': 'invalid ts'}]
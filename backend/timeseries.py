@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Sensor time series: validation of ingested readings, hourly/daily rollup arithmetic and the
+seasonal rainfall windows used by Weather Insurance. Storage lives in app.py (SensorSample,
+SensorRollup, RainfallWindow); everything here is pure.
+"""
+
+import math
+import re
+from datetime import datetime, timezone
+
+RESOLUTIONS = ('hour', 'day')
+MAX_BATCH = 10000
+
+_METRIC = re.compile(r'^[a-z][a-z0-9_]{0,31}$')
+FARM_ID = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+# Common spellings from IoT exports mapped onto one metric name
+METRIC_ALIASES = {
+    'p_h': 'ph',
+    'soil_moisture': 'moisture',
+    'moist': 'moisture',
+    'n': 'nitrogen',
+    'rain': 'rainfall',
+    'rainfall_mm': 'rainfall',
+    'precip': 'rainfall',
+    'precipitation': 'rainfall',
+    'temp': 'temperature',
+    'temperature_c': 'temperature',
+    'humid': 'humidity',
+}
+
+
+def metric_name(raw):
+    """'Soil Moisture' -> 'moisture'; None when the name is unusable."""
+    name = re.sub(r'[^a-z0-9]+', '_', str(raw or '').strip().lower()).strip('_')
+    name = METRIC_ALIASES.get(name, name)
+    return name if _METRIC.match(name) else None
+
+
+def parse_timestamp(value, default=None):
+    """ISO-8601 string or epoch seconds -> naive UTC datetime (the DB stores naive UTC, like datetime.utcnow)."""
+    if value is None or value == '':
+        return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            return None  # NaN/inf or outside what the platform's time_t / datetime can hold
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def parse_readings(payload, now=None):
+    """Readings from a batch body. Each item is either {ts, metric, value} or {ts, <metric>: value, ...}.
+    Returns (samples as (metric, ts, value), errors as {index, error})."""
+    items = payload.get('readings') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return [], [{'index': None, 'error': 'readings must be a list'}]
+    now = now or datetime.utcnow()
+    samples, errors = [], []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': i, 'error': 'reading must be an object'})
+            continue
+        ts = parse_timestamp(item.get('ts', item.get('timestamp')), default=now)
+        if ts is None:
+            errors.append({'index': i, 'error': 'invalid ts'})
+            continue
+        if 'metric' in item:
+            pairs = [(item.get('metric'), item.get('value'))]
+        else:
+            pairs = [(k, v) for k, v in item.items() if k not in ('ts', 'timestamp')]
+        if not pairs:
+            errors.append({'index': i, 'error': 'no values'})
+            continue
+        for raw_name, raw_value in pairs:
+            name = metric_name(raw_name)
+            try:
+                value = float(raw_value)
+            except (TypeError, ValueError):
+                value = None
+            if name is None or value is None or not math.isfinite(value) or isinstance(raw_value, bool):
+                errors.append({'index': i, 'error': f'invalid reading {raw_name!r}'})
+                continue
+            samples.append((name, ts, value))
+    return samples, errors
+
+
+def bucket_start(ts, resolution):
+    if resolution == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_batch(samples):
+    """{(metric, resolution, bucket): [count, sum, min, max]} for a batch, ready to merge into stored rollups."""
+    out = {}
+    for metric, ts, value in samples:
+        for resolution in RESOLUTIONS:
+            key = (metric, resolution, bucket_start(ts, resolution))
+            agg = out.get(key)
+            if agg is None:
+                out[key] = [1, value, value, value]
+            else:
+                agg[0] += 1
+                agg[1] += value
+                if value < agg[2]:
+                    agg[2] = value
+                if value > agg[3]:
+                    agg[3] = value
+    return out
+
+
+# Cropping seasons used for insurance windows: kharif Jun-Oct, rabi Nov-Feb, zaid Mar-May.
+# A rabi season is labelled with the year it starts in (Nov 2025 - Feb 2026 is rabi 2025).
+SEASON_MONTHS = {
+    'kharif': (6, 7, 8, 9, 10),
+    'rabi': (11, 12, 1, 2),
+    'zaid': (3, 4, 5),
+}
+_SEASON_BY_MONTH = {m: name for name, months in SEASON_MONTHS.items() for m in months}
+SEASON_YEARS = (1970, 9998)  # season_bounds needs year + 1 to be a valid datetime year (rabi)
+
+# Same bands as the Weather Insurance page (rain over the last 30 days)
+DROUGHT_MM = 10.0
+NORMAL_MM = (25.0, 75.0)
+FLOOD_MM = 100.0
+
+
+def season_of(ts):
+    """(season, season_year) for a timestamp."""
+    season = _SEASON_BY_MONTH[ts.month]
+    year = ts.year - 1 if season == 'rabi' and ts.month <= 2 else ts.year
+    return season, year
+
+
+def season_bounds(season, year):
+    """[start, end) of a season as naive UTC datetimes."""
+    first = SEASON_MONTHS[season][0]
+    last = SEASON_MONTHS[season][-1]
+    start = datetime(year, first, 1)
+    end_year = year + 1 if season == 'rabi' else year
+    end = datetime(end_year + (last == 12), last % 12 + 1, 1)
+    return start, end
+
+
+def rainfall_windows(samples):
+    """{(season, season_year): [count, total, first_ts, last_ts]} for the rainfall samples in a batch."""
+    out = {}
+    for metric, ts, value in samples:
+        if metric != 'rainfall':
+            continue
+        key = season_of(ts)
+        agg = out.get(key)
+        if agg is None:
+            out[key] = [1, value, ts, ts]
+        else:
+            agg[0] += 1
+            agg[1] += value
+            if ts < agg[2]:
+                agg[2] = ts
+            if ts > agg[3]:
+                agg[3] = ts
+    return out
+
+
+def rainfall_status(total_mm, threshold_mm=DROUGHT_MM):
+    """'drought' (payout trigger), 'flood', 'normal' or 'watch' for a 30-day rainfall total."""
+    if total_mm < threshold_mm:
+        return 'drought'
+    if total_mm > FLOOD_MM:
+        return 'flood'
+    if NORMAL_MM[0] <= total_mm <= NORMAL_MM[1]:
+        return 'normal'
+    return 'watch'
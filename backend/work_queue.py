@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded worker pool with priorities for uploaded-file processing. Tasks wait in one heap ordered by
+(priority, arrival), so a quick sensor report submitted behind a queue of photo analyses still runs
+next. The queue has a hard cap; callers turn QueueFull into a 503. Threads start on the first submit,
+which keeps the pool safe to create before a preforking server forks its workers.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class QueueFull(Exception):
+    """The pool already holds max_queued waiting tasks."""
+
+
+class PriorityPool:
+    def __init__(self, workers=4, max_queued=500, name='worker'):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+
+    def submit(self, priority, fn, *args):
+        """Queue fn(*args); priority is a PRIORITIES name or number (lower runs first)."""
+        rank = PRIORITIES.get(priority, PRIORITIES['normal']) if isinstance(priority, str) else int(priority)
+        with self._cond:
+            if len(self._heap) >= self.max_queued:
+                raise QueueFull(f'{self.name} queue is full ({self.max_queued} waiting)')
+            heapq.heappush(self._heap, (rank, next(self._seq), fn, args))
+            self._start_workers()
+            self._cond.notify()
+
+    def _start_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            t = threading.Thread(target=self._work, name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, fn, args = heapq.heappop(self._heap)
+                self._running += 1
+            start = time.perf_counter()
+            ok = True
+            try:
+                fn(*args)
+            except Exception:
+                ok = False
+            with self._cond:
+                self._running -= 1
+                self._busy_seconds += time.perf_counter() - start
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def queued(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            waiting = {}
+            for rank, _, _, _ in self._heap:
+                waiting[rank] = waiting.get(rank, 0) + 1
+            names = {v: k for k, v in PRIORITIES.items()}
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._heap),
+                'queuedByPriority': {names.get(rank, str(rank)): n for rank, n in sorted(waiting.items())},
+                'maxQueued': self.max_queued,
+                'completed': self._completed,
+                'failed': self._failed,
+                'busySeconds': round(self._busy_seconds, 1),
+            }
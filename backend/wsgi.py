@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""
+WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app
+Unfinished analysis jobs and files are resumed by each worker (gunicorn.conf.py), not here, because
+this module is imported once in the master before workers are forked.
+"""
+
+import os
+
+from app import create_app
+
+# Warm the heavy parsers before fork (shared copy-on-write); WARM_IMPORTS=0 on scale-to-zero platforms,
+# where serving the first request sooner matters more
+app = create_app(resume_jobs=False, warm=os.getenv('WARM_IMPORTS', '1') != '0')
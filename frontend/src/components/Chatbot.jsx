@@ -1,6 +1,8 @@
 import { useState, useRef, useEffect } from 'react'
 import { useAuth } from '../context/AuthContext'
+import { useLanguage } from '../context/LanguageContext'
 import { notify } from '../context/NotificationContext'
+import { runAnalysisJob } from '../utils/analysisJobs'
 import './Chatbot.css'
 
 function formatChatText(str) {
@@ -26,6 +28,7 @@ const QUICK_REPLIES = [
 
 export default function Chatbot() {
   const { user } = useAuth()
+  const { language } = useLanguage()
   const [open, setOpen] = useState(false)
   const [messages, setMessages] = useState([])
   const [input, setInput] = useState('')
@@ -53,20 +56,51 @@ export default function Chatbot() {
     setInput('')
     setMessages((m) => [...m, { role: 'user', content: text }])
     setLoading(true)
+    let streamed = ''
+    let started = false
     try {
       const history = messages.map((msg) => ({ role: msg.role, content: msg.content }))
-      const res = await fetch(`${apiBase}/api/chat`, {
+      const res = await fetch(`${apiBase}/api/chat/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: text, history }),
+        body: JSON.stringify({ message: text, history, language }),
       })
-      const data = await res.json()
-      const reply = res.ok
-        ? (data.reply || 'No response.')
-        : (data.error && typeof data.error === 'string' ? data.error : FALLBACK_MESSAGE)
-      setMessages((m) => [...m, { role: 'assistant', content: reply }])
+      if (!res.ok || !res.body) {
+        const data = await res.json().catch(() => ({}))
+        const reply = data.error && typeof data.error === 'string' ? data.error : FALLBACK_MESSAGE
+        setMessages((m) => [...m, { role: 'assistant', content: reply }])
+        return
+      }
+      // Show the reply as it is generated: 'token' events append text, 'done' carries the final reply
+      setMessages((m) => [...m, { role: 'assistant', content: '' }])
+      started = true
+      const setReply = (content) =>
+        setMessages((m) => [...m.slice(0, -1), { role: 'assistant', content }])
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      for (;;) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const events = buffer.split('\n\n')
+        buffer = events.pop()
+        for (const evt of events) {
+          const name = evt.match(/^event: (.*)$/m)?.[1]
+          const payload = evt.match(/^data: (.*)$/m)?.[1]
+          if (!payload) continue
+          const data = JSON.parse(payload)
+          if (name === 'token') streamed += data.text
+          else if (name === 'done') streamed = data.reply || streamed
+          setReply(streamed)
+        }
+      }
+      if (!streamed) setReply('No response.')
     } catch (e) {
-      setMessages((m) => [...m, { role: 'assistant', content: FALLBACK_MESSAGE }])
+      setMessages((m) => [
+        ...(started ? m.slice(0, -1) : m),
+        { role: 'assistant', content: streamed || FALLBACK_MESSAGE },
+      ])
     } finally {
       setLoading(false)
     }
@@ -84,9 +118,8 @@ export default function Chatbot() {
     try {
       const form = new FormData()
       form.append('image', file)
-      const res = await fetch(`${apiBase}/api/crop-analysis`, { method: 'POST', body: form })
-      const data = await res.json()
-      if (res.ok && data.summary != null) {
+      const data = await runAnalysisJob('/api/crop-analysis', form)
+      if (data?.summary != null) {
         const text = [
           data.summary,
           data.details ? `\n\n${data.details}` : '',
@@ -2,21 +2,18 @@ import { useState, useRef } from 'react'
 import { useLanguage } from '../context/LanguageContext'
 import { useAuth } from '../context/AuthContext'
 import { kmKey } from '../utils/storageKeys'
+import { runAnalysisJob } from '../utils/analysisJobs'
 import './CropAnalysis.css'
 
 const ACCEPT = 'image/jpeg,image/png,image/webp,image/jpg'
 const MAX_SIZE_MB = 10
 
 async function analyzeCrop(file, prompt, crop) {
-  const apiBase = import.meta.env.VITE_API_URL || ''
   const formData = new FormData()
   formData.append('image', file)
   if (prompt) formData.append('prompt', prompt)
   if (crop) formData.append('crop', crop)
-  const res = await fetch(`${apiBase}/api/crop-analysis`, { method: 'POST', body: formData })
-  const data = await res.json()
-  if (!res.ok) throw new Error(data?.error || 'Analysis failed')
-  return data
+  return runAnalysisJob('/api/crop-analysis', formData)
 }
 
 export default function CropAnalysis() {
@@ -0,0 +1,24 @@
+/**
+ * Submit an image analysis as a background job and poll until it finishes.
+ * The backend answers 202 + jobId right away, so slow model calls never hold a request open.
+ */
+const POLL_MS = 1500
+const TIMEOUT_MS = 3 * 60 * 1000
+
+export async function runAnalysisJob(path, formData) {
+  const apiBase = import.meta.env.VITE_API_URL || ''
+  const res = await fetch(`${apiBase}${path}?async=1`, { method: 'POST', body: formData })
+  const data = await res.json()
+  if (!res.ok) throw new Error(data?.error || 'Analysis failed')
+  if (res.status !== 202) return data
+  const deadline = Date.now() + TIMEOUT_MS
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, POLL_MS))
+    const poll = await fetch(`${apiBase}/api/jobs/${data.jobId}`)
+    const job = await poll.json()
+    if (!poll.ok) throw new Error(job?.error || 'Analysis failed')
+    if (job.status === 'done') return job.result
+    if (job.status === 'failed') throw new Error(job.error || 'Analysis failed')
+  }
+  throw new Error('Analysis timed out')
+}